@@ -0,0 +1,84 @@
+"""Benchmark bulk delete, move and undo/redo of many selected contacts.
+
+Usage: python benchmarks/bench_bulk.py [--rows N] [--select N]
+                                       [--storage journal|sqlite|files]
+
+Generated contacts are stored in a temporary directory and loaded into a
+ContactService. Then --select random contacts are deleted as one batch,
+the delete is undone and redone, and another selection is moved to a
+different type. Each step reports the time in the store alone and in
+total with the storage write (one apply_batch call per step).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from datagen import generate_contacts
+from contact_service import ContactService
+from storage import JournalStorage, JsonLinesStorage, SqliteStorage, make_record
+
+BACKENDS = {
+    'files': lambda directory: JsonLinesStorage(directory),
+    'journal': lambda directory: JournalStorage(directory),
+    'sqlite': lambda directory: SqliteStorage(os.path.join(directory, 'contacts.db')),
+}
+
+
+class TimedStore:
+    """Wraps ContactStore.apply_changes to add up the time spent in the store"""
+    def __init__(self, store):
+        self.seconds = 0.0
+        self._apply_changes = store.apply_changes
+        store.apply_changes = self
+
+    def __call__(self, changes):
+        start = time.perf_counter()
+        try:
+            return self._apply_changes(changes)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def step(label, timed, action):
+    timed.seconds = 0.0
+    start = time.perf_counter()
+    result = action()
+    total = time.perf_counter() - start
+    print(f"{label:<24} {len(result.removed):>7} out {len(result.added):>7} in  "
+          f"store {timed.seconds * 1000:>7.0f} ms  total {total * 1000:>7.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--select', type=int, default=50_000)
+    parser.add_argument('--storage', choices=sorted(BACKENDS), default='journal')
+    args = parser.parse_args()
+
+    contacts = list(generate_contacts(args.rows))
+    with tempfile.TemporaryDirectory() as directory:
+        storage = BACKENDS[args.storage](directory)
+        storage.add_many(make_record(*c) for c in contacts)
+        storage.close()
+
+        service = ContactService(BACKENDS[args.storage](directory))
+        print(f"{args.rows} contacts, {args.storage} storage, loaded in {service.load():.1f} s")
+        timed = TimedStore(service.store)
+
+        rng = random.Random(5)
+        selected = [(name, phone) for name, phone, *_ in rng.sample(contacts, args.select)]
+        step(f"delete {args.select}", timed, lambda: service.delete_many(selected))
+        step("undo", timed, service.undo)
+        step("redo", timed, service.redo)
+
+        remaining = [(node.name, node.phone) for node in service.store]
+        moved = rng.sample(remaining, args.select)
+        step(f"move {args.select} to family", timed, lambda: service.retype_many(moved, 'family'))
+        step("undo", timed, service.undo)
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the record codecs: parse and serialize throughput, and a cold load.
+
+Usage: python benchmarks/bench_codec.py [--rows N] [--skip-load]
+
+Every codec encodes the same generated contacts into category file
+lines, then decodes those lines back; the binary record format does the
+same with bytes. ``json`` is the standard library (what the files were
+read and written with before the codecs), ``fields`` the schema-aware
+codec, ``fast`` the same with orjson parsing when it is installed.
+
+Then the contacts are written as category files and each codec parses
+them through the CategoryFileLoader in one process, as a cold start
+without a snapshot does.
+"""
+import argparse
+import tempfile
+import time
+
+from datagen import generate_contacts
+from codec import CODECS, BinaryRecords, get_codec, orjson
+from loader import CategoryFileLoader
+from storage import JsonLinesStorage, make_record
+
+
+def rate(count, seconds):
+    return f"{count / seconds / 1e6:>6.2f} M/s"
+
+
+def bench_codec(codec, contacts):
+    start = time.perf_counter()
+    encode = codec.encode
+    lines = [encode(*contact) for contact in contacts]
+    encoding = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decode = codec.decode
+    decoded = [decode(line) for line in lines]
+    decoding = time.perf_counter() - start
+    assert decoded == contacts
+    return encoding, decoding, sum(map(len, lines)) + len(lines)
+
+
+def bench_binary(contacts):
+    records = BinaryRecords()
+    start = time.perf_counter()
+    data = records.encode_many(contacts)
+    encoding = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [fields for _, fields in records.decode_many(data)]
+    decoding = time.perf_counter() - start
+    assert decoded == contacts
+    return encoding, decoding, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skip-load', action='store_true', help="only time encoding and decoding")
+    args = parser.parse_args()
+
+    contacts = list(generate_contacts(args.rows))
+    print(f"{args.rows} contacts, orjson {'installed' if orjson is not None else 'not installed'}")
+    print(f"{'codec':<8} {'serialize':>11} {'parse':>11} {'size':>10}")
+    for name in CODECS:
+        encoding, decoding, size = bench_codec(get_codec(name), contacts)
+        print(f"{name:<8} {rate(args.rows, encoding):>11} {rate(args.rows, decoding):>11} "
+              f"{size / 1e6:>7.1f} MB")
+    encoding, decoding, size = bench_binary(contacts)
+    print(f"{'binary':<8} {rate(args.rows, encoding):>11} {rate(args.rows, decoding):>11} {size / 1e6:>7.1f} MB")
+
+    if args.skip_load:
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        storage = JsonLinesStorage(directory)
+        storage.add_many(make_record(*contact) for contact in contacts)
+        filenames = [filename for contact_type in storage.contact_types
+                     for filename in storage.shards(contact_type).paths()]
+        print(f"{'codec':<8} {'cold load':>11}")
+        for name in CODECS:
+            start = time.perf_counter()
+            count = sum(1 for _ in CategoryFileLoader(filenames, workers=1, codec=get_codec(name)).load())
+            seconds = time.perf_counter() - start
+            assert count == args.rows
+            print(f"{name:<8} {seconds:>9.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark block-compressed category files against plain JSON lines.
+
+Usage: python benchmarks/bench_compression.py [--contacts N] [--reads N]
+
+The generated contacts are written to a fresh directory in each format.
+For each format it reports the size of the category files on disk, the
+time writing them took (sorting and encoding included), a cold full load
+(``load_sorted`` with the snapshot removed, so every file is parsed), and
+lazy mode: indexing the files, then ``--reads`` screens read at random
+positions through the page cache, each of which may decompress a block.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from datagen import generate_contacts
+from blockfile import COMPRESSIONS
+from paged_store import PagedContactStore
+from storage import JsonLinesStorage, make_record
+
+SCREEN = 25
+
+
+def category_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory)
+               if entry.name.endswith('.txt') and not entry.name.startswith('.'))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def cold_load(directory):
+    snapshot = os.path.join(directory, JsonLinesStorage.SNAPSHOT_NAME)
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+    return sum(1 for _ in JsonLinesStorage(directory).load_sorted())
+
+
+def lazy_reads(directory, contact_types, reads):
+    store = PagedContactStore(directory, contact_types)
+    _, index = timed(store.open)
+    rng = random.Random(5)
+    start = time.perf_counter()
+    for _ in range(reads):
+        first = rng.randrange(len(store))
+        for i in range(first, min(first + SCREEN, len(store))):
+            store[i]
+    return index, (time.perf_counter() - start) * 1000 / reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=1_000_000)
+    parser.add_argument('--reads', type=int, default=200, help="random screens read in lazy mode")
+    args = parser.parse_args()
+
+    records = [make_record(*contact) for contact in generate_contacts(args.contacts)]
+    print(f"{'format':<7} {'size':>10} {'ratio':>6} {'write':>8} {'load':>8} {'rows/s':>10} "
+          f"{'index':>8} {'screen':>10}")
+    plain = None
+    for compression in [None, *COMPRESSIONS]:
+        with tempfile.TemporaryDirectory() as directory:
+            storage = JsonLinesStorage(directory, compression=compression)
+            contact_types = storage.contact_types
+            _, write = timed(storage.add_many, records)
+            size = category_bytes(directory)
+            plain = plain or size
+            rows, load = timed(cold_load, directory)
+            index, screen = lazy_reads(directory, contact_types, args.reads)
+            print(f"{compression or 'plain':<7} {size / 1e6:>7.1f} MB {plain / size:>5.1f}x {write:>6.2f} s "
+                  f"{load:>6.2f} s {rows / load:>10.0f} {index:>6.2f} s {screen:>7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark typo-tolerant (fuzzy) name search.
+
+Usage: python benchmarks/bench_fuzzy.py [--rows N] [--queries N] [--distinct N]
+
+Loads generated contacts into a ContactStore and replays search terms
+made from real names with one typo (a wrong, missing, extra or swapped
+letter), sometimes with the last word cut short as while typing. Terms
+are drawn with a Zipf-like skew from a pool of --distinct terms, so
+popular searches repeat and hit the LRU result cache.
+
+Reports the cache hit rate, p50/p95 latency for cache misses and hits,
+recall (the misspelled name is among the results) and the time of the
+first fuzzy search, which builds the word index.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactQuery, ContactStore
+
+
+def misspell(word, rng):
+    """word with one random typo"""
+    i = rng.randrange(len(word) - 1)
+    kind = rng.choice(['substitute', 'delete', 'insert', 'swap'])
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    if kind == 'substitute':
+        return word[:i] + letter + word[i + 1:]
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'insert':
+        return word[:i] + letter + word[i:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def make_terms(contacts, count, rng):
+    """(search term, intended lowercase name) pairs"""
+    terms = []
+    while len(terms) < count:
+        name = rng.choice(contacts)[0].lower()
+        words = name.split()[:2]
+        # Only words long enough for a typo to be tolerated get one
+        typo_at = [i for i, word in enumerate(words) if len(word) >= 4]
+        if not typo_at:
+            continue
+        i = rng.choice(typo_at)
+        words[i] = misspell(words[i], rng)
+        if len(words) > 1 and i == 0 and rng.random() < 0.5:
+            # Still typing the last word
+            words[1] = words[1][:max(3, len(words[1]) // 2)]
+        terms.append((' '.join(words), name))
+    return terms
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, samples):
+    if samples:
+        print(f"{label:<14} {len(samples):>6} queries  p50={statistics.median(samples):8.2f} ms  "
+              f"p95={percentile(samples, 0.95):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=2_000)
+    parser.add_argument('--distinct', type=int, default=400, help="distinct search terms")
+    args = parser.parse_args()
+
+    contacts = list(generate_contacts(args.rows))
+    store = ContactStore()
+    start = time.perf_counter()
+    store.bulk_load({'name': n, 'phone': p, 'email': e, 'type': t}
+                    for n, p, e, t in sorted(contacts, key=lambda c: c[0].lower()))
+    print(f"{args.rows} contacts loaded in {time.perf_counter() - start:.2f} s")
+
+    rng = random.Random(3)
+    pool = make_terms(contacts, args.distinct, rng)
+    weights = [1 / rank for rank in range(1, len(pool) + 1)]
+    stream = rng.choices(pool, weights=weights, k=args.queries)
+
+    start = time.perf_counter()
+    store.query(ContactQuery('warm up', fuzzy=True))
+    print(f"first fuzzy search (builds the word index): {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    index = store.search_index
+    hits_before, misses_before = index.cache_hits, index.cache_misses
+    hit_ms, miss_ms, exact_ms = [], [], []
+    found = 0
+    for term, name in stream:
+        hits = index.cache_hits
+        start = time.perf_counter()
+        result = store.query(ContactQuery(term, fuzzy=True))
+        elapsed = (time.perf_counter() - start) * 1000
+        (hit_ms if index.cache_hits > hits else miss_ms).append(elapsed)
+        found += name in result.names
+
+        start = time.perf_counter()
+        store.query(ContactQuery(term))
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    hits = index.cache_hits - hits_before
+    lookups = hits + index.cache_misses - misses_before
+    print(f"cache hit rate {hits / lookups:.1%} ({hits} of {lookups}), "
+          f"recall {found / len(stream):.1%}")
+    report("fuzzy (miss)", miss_ms)
+    report("fuzzy (hit)", hit_ms)
+    report("fuzzy (all)", miss_ms + hit_ms)
+    report("exact search", exact_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark lazy mode against loading everything: first rows, scrolling, memory.
+
+Usage: python benchmarks/bench_lazy.py [--rows N] [--skip-eager]
+
+The category files are generated once in a temporary directory, then
+each mode runs in a fresh interpreter, as it would when the app starts
+(generating runs in one too, so its memory does not count as anyone's
+peak):
+
+  eager  ContactService.load() (snapshot removed first), then the same reads
+  cold   PagedContactService: scan the files for the page index, then reads
+  warm   PagedContactService reusing the saved page index
+
+Each reports the time until the first screen of rows is available, the
+time of a screenful at 100 random positions (scrollbar jumps), of
+scrolling 1000 rows one at a time, of a type filter and of a name search,
+and the peak resident memory of the process.
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from datagen import generate_contacts
+from contact_service import ContactService, PagedContactService
+from contact_store import ContactQuery
+from storage import JsonLinesStorage, make_record
+
+SCREEN = 25
+
+
+def screen(rows, first):
+    return [rows[i] for i in range(first, min(first + SCREEN, len(rows)))]
+
+
+def run_mode(mode, directory, rows):
+    """Runs in the child interpreter, prints one line of results"""
+    if mode == 'generate':
+        storage = JsonLinesStorage(directory)
+        storage.add_many(make_record(*c) for c in generate_contacts(rows))
+        storage.close()
+        return
+
+    start = time.perf_counter()
+    if mode == 'eager':
+        snapshot = os.path.join(directory, JsonLinesStorage.SNAPSHOT_NAME)
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+        service = ContactService(JsonLinesStorage(directory))
+    else:
+        service = PagedContactService(JsonLinesStorage(directory))
+    service.load()
+    rows = service.store
+    screen(rows, 0)
+    first_paint = time.perf_counter() - start
+
+    rng = random.Random(3)
+    start = time.perf_counter()
+    for _ in range(100):
+        screen(rows, rng.randrange(len(rows)))
+    jumps = (time.perf_counter() - start) / 100
+
+    first = len(rows) // 2
+    start = time.perf_counter()
+    for offset in range(1000):
+        screen(rows, first + offset)
+    scroll = (time.perf_counter() - start) / 1000
+
+    start = time.perf_counter()
+    screen(service.query(ContactQuery(contact_type='friend')), 0)
+    type_filter = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = service.query(ContactQuery(name='patel'))
+    screen(found, 0)
+    search = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == 'darwin':
+        peak /= 1024
+    print(len(rows), first_paint, jumps, scroll, type_filter, search, len(found), peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--skip-eager', action='store_true')
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.directory, args.rows)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'generate',
+                        '--rows', str(args.rows), '--directory', directory], check=True)
+
+        print(f"{'mode':<6} {'contacts':>9} {'first rows':>11} {'jump':>9} {'scroll':>9} "
+              f"{'filter':>9} {'search':>9} {'found':>7} {'peak RSS':>10}")
+        modes = ['cold', 'warm'] if args.skip_eager else ['eager', 'cold', 'warm']
+        for mode in modes:
+            command = [sys.executable, os.path.abspath(__file__), '--mode', mode, '--directory', directory]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            count, first_paint, jumps, scroll, type_filter, search, found, peak = output.split()[-8:]
+            print(f"{mode:<6} {int(count):>9} {float(first_paint):>9.3f} s {float(jumps) * 1000:>6.2f} ms "
+                  f"{float(scroll) * 1000:>6.3f} ms {float(type_filter) * 1000:>6.2f} ms "
+                  f"{float(search):>7.2f} s {int(found):>7} {float(peak):>7.0f} MiB")
+
+
+if __name__ == '__main__':
+    main()
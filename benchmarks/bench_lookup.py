@@ -0,0 +1,70 @@
+"""Benchmark reverse lookups by phone and email, and the duplicate report.
+
+Usage: python benchmarks/bench_lookup.py [--rows N] [--lookups N] [--scans N]
+
+Loads generated contacts into a ContactStore, then reports lookups per
+second through the phone and email indexes (hits as stored, hits written
+as '+91 XXXXX-XXXXX', misses), next to a linear scan of every contact as
+the store had to do before, and the time to build the duplicate report.
+"""
+import argparse
+import random
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactStore, normalize_phone
+
+
+def rate(label, lookup, keys):
+    start = time.perf_counter()
+    found = 0
+    for key in keys:
+        found += len(lookup(key))
+    seconds = time.perf_counter() - start
+    print(f"{label:<28} {len(keys) / seconds:>12,.0f} lookups/s "
+          f"{seconds / len(keys) * 1e6:>8.2f} us each, {found} contacts found")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--scans', type=int, default=5, help="linear scans for the baseline")
+    args = parser.parse_args()
+
+    contacts = list(generate_contacts(args.rows))
+    store = ContactStore()
+    start = time.perf_counter()
+    store.bulk_load({'name': n, 'phone': p, 'email': e, 'type': t}
+                    for n, p, e, t in sorted(contacts, key=lambda c: c[0].lower()))
+    print(f"{args.rows} contacts loaded in {time.perf_counter() - start:.2f} s")
+
+    rng = random.Random(7)
+    sample = [rng.choice(contacts) for _ in range(args.lookups)]
+    phones = [c[1] for c in sample]
+    formatted = [f"+91 {p[:5]}-{p[5:]}" for p in phones]
+    misses = [str(rng.randrange(1_000_000_000, 2_000_000_000)) for _ in range(args.lookups)]
+    emails = [c[2].upper() for c in sample if c[2]]
+
+    rate("phone (as stored)", store.lookup_by_phone, phones)
+    rate("phone (+91 XXXXX-XXXXX)", store.lookup_by_phone, formatted)
+    rate("phone (miss)", store.lookup_by_phone, misses)
+    rate("email (other case)", store.lookup_by_email, emails)
+
+    def scan(phone):
+        phone = normalize_phone(phone)
+        return [node for node in store if normalize_phone(node.phone) == phone]
+
+    rate("phone (linear scan)", scan, phones[:args.scans])
+
+    start = time.perf_counter()
+    groups = store.duplicate_report()
+    seconds = time.perf_counter() - start
+    by_field = {field: sum(1 for g in groups if g.field == field) for field in ('phone', 'email')}
+    cross_type = sum(1 for g in groups if g.cross_type)
+    print(f"duplicate report in {seconds * 1000:.0f} ms: {by_field['phone']} shared phones, "
+          f"{by_field['email']} shared emails, {cross_type} groups across types")
+
+
+if __name__ == '__main__':
+    main()
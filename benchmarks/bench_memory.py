@@ -0,0 +1,53 @@
+"""Benchmark memory per contact of a loaded ContactStore.
+
+Usage: python benchmarks/bench_memory.py [--rows N] [--top N]
+
+The generated contacts are written to JSON-lines category files in a
+temporary directory and loaded the way the app starts (load_sorted +
+bulk_load), under tracemalloc. Everything still allocated once the load
+is done belongs to the store, so it is reported per contact, together
+with the source lines holding the most memory.
+"""
+import argparse
+import gc
+import tempfile
+import tracemalloc
+
+from datagen import generate_contacts
+from contact_store import ContactStore
+from storage import JsonLinesStorage, make_record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--top', type=int, default=8, help="allocation sites to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = JsonLinesStorage(directory)
+        storage.add_many(make_record(*c) for c in generate_contacts(args.rows))
+        # Keep the snapshot out of it: measure the store, not the file format
+        storage.SNAPSHOT_NAME = '.unused'
+
+        gc.collect()
+        tracemalloc.start(1)
+        before = tracemalloc.take_snapshot()
+        store = ContactStore()
+        store.bulk_load(storage.load_sorted())
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    count = len(store)
+    print(f"{count} contacts: {current / 2**20:.1f} MiB held, {peak / 2**20:.1f} MiB peak")
+    print(f"{current / count:.0f} bytes per contact")
+    print()
+    for stat in after.compare_to(before, 'lineno')[:args.top]:
+        frame = stat.traceback[0]
+        print(f"{stat.size_diff / count:>8.1f} B/contact  {frame.filename.rsplit('/', 1)[-1]}:{frame.lineno}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark the query result cache: repeated searches and filters, and edits between them.
+
+Usage: python benchmarks/bench_query_cache.py [--contacts N] [--rounds N]
+
+The generated contacts are bulk-loaded into a ContactStore, then a set of
+common queries (search terms with and without a type filter, typo-tolerant
+searches, and a type sorted by phone) is run ``--rounds`` times, as when
+switching the filter back and forth or retyping a recent term. The first
+round computes every result (``miss``), later ones come from the cache
+(``hit``). Then a colleague is added before each round: results for other
+types stay cached, untyped and colleague ones are computed again.
+"""
+import argparse
+import statistics
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactQuery, ContactStore
+from storage import make_record
+
+QUERIES = [ContactQuery('ra'), ContactQuery('ra', 'friend'), ContactQuery('ra', 'colleague'),
+           ContactQuery('patel'), ContactQuery('patel', 'family'), ContactQuery('kumar 1', 'friend'),
+           ContactQuery('jonh smtih', fuzzy=True), ContactQuery('', 'friend', sort='phone'),
+           ContactQuery('', 'family', sort='email', descending=True)]
+
+
+def timed_round(store):
+    """Microseconds per query"""
+    samples = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        with store.lock.read():
+            store.query(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=1_000_000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    store = ContactStore()
+    store.bulk_load(make_record(*contact) for contact in generate_contacts(args.contacts))
+    print(f"loaded {args.contacts} contacts")
+
+    first = timed_round(store)
+    repeated = [sample for _ in range(args.rounds) for sample in timed_round(store)]
+    print(f"miss   p50 {statistics.median(first):>10.1f} us  max {max(first):>10.1f} us")
+    print(f"hit    p50 {statistics.median(repeated):>10.1f} us  max {max(repeated):>10.1f} us")
+
+    before = store.query_cache.stats()
+    edited = []
+    for i in range(args.rounds):
+        store.insert(f"Cache Bench {i:03d}", f"{9_300_000_000 + i}", '', 'colleague')
+        edited += timed_round(store)
+    after = store.query_cache.stats()
+    hits = after['hits'] - before['hits']
+    print(f"edits  p50 {statistics.median(edited):>10.1f} us  max {max(edited):>10.1f} us  "
+          f"({hits} of {len(edited)} still cached)")
+    print(', '.join(f"{key} {value}" for key, value in after.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Replay typed search queries against the live-search index.
+
+Usage: python benchmarks/bench_search.py [--contacts N]
+
+Each query is typed one character at a time, as the <KeyRelease> handler
+sees it, and the latency of every keystroke is recorded for the store's
+NameSearchIndex and for the old full scan (lowercase every name and test
+the substring).
+"""
+import argparse
+import statistics
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactStore
+
+TYPED_QUERIES = ['alice', 'patel', 'rahul shetty', 'kumar 12', 'wang', 'zara li', 'xyz']
+
+
+def keystrokes(query):
+    return [query[:i] for i in range(1, len(query) + 1)]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    store = ContactStore()
+    start = time.perf_counter()
+    for contact in generate_contacts(args.contacts):
+        store.insert(*contact)
+    print(f"built store + index for {args.contacts} contacts in {time.perf_counter() - start:.1f} s")
+
+    # The first query sorts the distinct-name array built during the load
+    start = time.perf_counter()
+    store.search('')
+    print(f"first query (name array sort) {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def full_scan(term):
+        return [c for c in store.get_all_contacts() if term in c.name.lower()]
+
+    for label, search in (('index', store.search), ('full scan', full_scan)):
+        samples = []
+        for query in TYPED_QUERIES:
+            for term in keystrokes(query):
+                start = time.perf_counter()
+                search(term)
+                samples.append((time.perf_counter() - start) * 1000)
+        under = sum(1 for sample in samples if sample < 16)
+        print(f"{label:<10} keystrokes={len(samples)} "
+              f"p50={statistics.median(samples):.2f} ms "
+              f"p95={percentile(samples, 0.95):.2f} ms max={max(samples):.2f} ms "
+              f"under 16 ms: {under}/{len(samples)}")
+
+
+if __name__ == '__main__':
+    main()
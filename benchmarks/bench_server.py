@@ -0,0 +1,153 @@
+"""Load-test the HTTP/JSON contact server on localhost.
+
+Usage: python benchmarks/bench_server.py [--contacts N] [--clients N]
+                                         [--seconds S] [--write-ratio F]
+                                         [--storage journal|sqlite|files]
+
+The server is started in a separate process over generated contacts in a
+temporary directory. Each client keeps one connection alive and sends
+requests back to back: mostly searches (a random name prefix, first page
+of 50) and lookups, plus a --write-ratio share of adds. Reports requests
+per second and latency percentiles, overall and per request kind.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+from datagen import generate_contacts
+from contact_server import ContactServer
+from contact_service import ContactService
+from storage import JournalStorage, JsonLinesStorage, SqliteStorage, make_record
+
+BACKENDS = {
+    'files': lambda directory: JsonLinesStorage(directory),
+    'journal': lambda directory: JournalStorage(directory),
+    'sqlite': lambda directory: SqliteStorage(os.path.join(directory, 'contacts.db')),
+}
+
+
+def serve(backend, directory, port, ready):
+    """Server process: load the contacts and serve until terminated"""
+    service = ContactService(BACKENDS[backend](directory))
+    service.load()
+    server = ContactServer(service, port=port)
+
+    async def run():
+        listener = await server.start()
+        ready.set()
+        await listener.serve_forever()
+
+    asyncio.run(run())
+
+
+async def request(reader, writer, method, target, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port, deadline, samples, rng, terms, probes, write_ratio, phones):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            roll = rng.random()
+            if roll < write_ratio:
+                kind = 'add'
+                phone = str(next(phones))
+                args = ('POST', '/contacts',
+                        make_record(f"Load Test {phone}", phone, '', rng.choice(['friend', 'family'])))
+            elif roll < write_ratio + (1 - write_ratio) / 2:
+                kind = 'search'
+                args = ('GET', f"/contacts?q={quote(rng.choice(terms))}&limit=50")
+            else:
+                kind = 'lookup'
+                name, phone = rng.choice(probes)
+                args = ('GET', f"/contacts/lookup?name={quote(name)}&phone={phone}")
+            start = time.perf_counter()
+            status = await request(reader, writer, *args)
+            samples[kind].append((time.perf_counter() - start) * 1000)
+            if status >= 500:
+                samples['errors'].append(status)
+    finally:
+        writer.close()
+
+
+def report(label, samples, seconds):
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<8} {len(samples):>8} req {len(samples) / seconds:>9,.0f} req/s  "
+          f"p50={statistics.median(samples):7.2f} ms  p99={p99:7.2f} ms")
+
+
+async def run_clients(args, port, contacts):
+    rng = random.Random(1)
+    terms = sorted({name.lower()[:length] for name, *_ in rng.sample(contacts, 500)
+                    for length in (3, 5, 8)})
+    probes = [(name, phone) for name, phone, *_ in rng.sample(contacts, 1000)]
+    phones = iter(range(8_000_000_000, 9_000_000_000))
+    samples = defaultdict(list)
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    await asyncio.gather(*(client(port, deadline, samples, random.Random(i), terms, probes,
+                                  args.write_ratio, phones)
+                           for i in range(args.clients)))
+    seconds = time.perf_counter() - start
+
+    everything = [sample for kind in ('search', 'lookup', 'add') for sample in samples[kind]]
+    report('all', everything, seconds)
+    for kind in ('search', 'lookup', 'add'):
+        if samples[kind]:
+            report(kind, samples[kind], seconds)
+    if samples['errors']:
+        print(f"{len(samples['errors'])} server errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=100_000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.05)
+    parser.add_argument('--storage', choices=sorted(BACKENDS), default='journal')
+    parser.add_argument('--port', type=int, default=8798)
+    args = parser.parse_args()
+
+    contacts = list(generate_contacts(args.contacts))
+    with tempfile.TemporaryDirectory() as directory:
+        storage = BACKENDS[args.storage](directory)
+        storage.add_many(make_record(*c) for c in contacts)
+        storage.close()
+
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, args=(args.storage, directory, args.port, ready))
+        server.start()
+        try:
+            if not ready.wait(300):
+                raise SystemExit("server did not start")
+            print(f"{args.contacts} contacts, {args.storage} storage, {args.clients} clients, "
+                  f"{args.write_ratio:.0%} writes, {args.seconds:.0f} s")
+            asyncio.run(run_clients(args, args.port, contacts))
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark sharded category files against one file per type.
+
+Usage: python benchmarks/bench_shards.py [--rows N] [--ops N] [--shard-sizes 0,2M,512k]
+
+The same generated contacts (mostly colleagues, as in real address
+books) are written with each shard size, ``0`` meaning one file per type
+as before sharding. Then single adds, updates and deletes of colleagues
+are timed, each of which rewrites one shard, and a cold sorted load
+(no snapshot), which parses every shard and merges them.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from datagen import generate_contacts
+from storage import JsonLinesStorage, ShardMap, make_record
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 1024, 'm': 1024 * 1024}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def bench(directory, records, shard_bytes, ops):
+    # 0 stands for no sharding: no shard ever reaches the threshold
+    storage = JsonLinesStorage(directory, shard_bytes=shard_bytes or 1 << 62)
+    start = time.perf_counter()
+    storage.add_many(records)
+    fill = time.perf_counter() - start
+    shards = len(ShardMap.read(directory, 'colleague'))
+
+    extra = [make_record(f"Shard Bench {i:03d}", f"{9_000_000_000 + i}", '', 'colleague') for i in range(ops)]
+    start = time.perf_counter()
+    for record in extra:
+        storage.add(record)
+    add = (time.perf_counter() - start) / ops
+
+    start = time.perf_counter()
+    for record in extra:
+        storage.update(record['name'], record['phone'], 'colleague',
+                       make_record(record['name'], record['phone'], 'moved@example.com', 'colleague'))
+    update = (time.perf_counter() - start) / ops
+
+    start = time.perf_counter()
+    for record in extra:
+        storage.delete(record['name'], record['phone'], 'colleague')
+    delete = (time.perf_counter() - start) / ops
+
+    snapshot = os.path.join(directory, JsonLinesStorage.SNAPSHOT_NAME)
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+    start = time.perf_counter()
+    count = len(list(JsonLinesStorage(directory).load_sorted()))
+    load = time.perf_counter() - start
+    assert count == len(records)
+    return fill, shards, add, update, delete, load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--ops', type=int, default=20, help="single adds/updates/deletes to time")
+    parser.add_argument('--shard-sizes', default='0,2M,512k,128k', help="comma-separated, 0 = one file per type")
+    args = parser.parse_args()
+
+    records = [make_record(*c) for c in generate_contacts(args.rows)]
+    colleagues = sum(record['type'] == 'colleague' for record in records)
+    print(f"{args.rows} contacts, {colleagues} colleagues")
+    print(f"{'shard size':>10} {'shards':>7} {'fill':>8} {'add':>10} {'update':>10} {'delete':>10} {'cold load':>10}")
+    for text in args.shard_sizes.split(','):
+        shard_bytes = parse_size(text)
+        with tempfile.TemporaryDirectory() as directory:
+            fill, shards, add, update, delete, load = bench(directory, list(records), shard_bytes, args.ops)
+        print(f"{text.strip() if shard_bytes else 'unsharded':>10} {shards:>7} {fill:>6.2f} s "
+              f"{add * 1000:>7.2f} ms {update * 1000:>7.2f} ms {delete * 1000:>7.2f} ms {load:>8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
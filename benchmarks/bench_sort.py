@@ -0,0 +1,78 @@
+"""Benchmark header-click sorting: index builds, clicks, and paging sorted views.
+
+Usage: python benchmarks/bench_sort.py [--contacts N] [--pages N]
+
+The generated contacts are bulk-loaded into a ContactStore, then every
+column is clicked ascending and descending, as the GUI asks for it: with
+no search (a view over the store's indexes; the first phone or email click
+builds that column's index), filtered to one type, and for a search term
+(the matches sorted on their keys). Each result is paged through the way
+the virtual list reads it, 50 rows at a time from the top, middle and end.
+``sorted`` is the plain full sort of every contact the indexes replace.
+Finally single inserts and deletes are timed once every index exists.
+"""
+import argparse
+import statistics
+import time
+
+from datagen import generate_contacts
+from contact_store import SORT_COLUMNS, ContactQuery, ContactStore, sort_contacts
+from storage import make_record
+
+PAGE = 50
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def read_pages(rows, pages):
+    """Milliseconds per page of PAGE rows, spread over the result"""
+    total = len(rows)
+    if not total:
+        return 0.0
+    starts = [int(total * i / pages) for i in range(pages)]
+    start = time.perf_counter()
+    for first in starts:
+        for i in range(first, min(first + PAGE, total)):
+            rows[i]
+    return (time.perf_counter() - start) * 1000 / pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=1_000_000)
+    parser.add_argument('--pages', type=int, default=20, help="pages read from each sorted result")
+    args = parser.parse_args()
+
+    store = ContactStore()
+    _, load = timed(store.bulk_load, (make_record(*contact) for contact in generate_contacts(args.contacts)))
+    print(f"loaded {args.contacts} contacts in {load / 1000:.1f} s")
+
+    for column in SORT_COLUMNS:
+        _, ms = timed(sort_contacts, store, column)
+        print(f"sorted {column:<6} {ms:>9.1f} ms")
+
+    print(f"{'query':<10} {'column':<7} {'order':<5} {'click':>10} {'page':>10} {'rows':>9}")
+    for label, name, contact_type in (('all', '', None), ('friend', '', 'friend'), ('search', 'ra', None)):
+        for column in SORT_COLUMNS:
+            for descending in (False, True):
+                query = ContactQuery(name, contact_type, sort=column, descending=descending)
+                with store.lock.read():
+                    rows, click = timed(store.query, query)
+                    page = read_pages(rows, args.pages)
+                print(f"{label:<10} {column:<7} {'desc' if descending else 'asc':<5} {click:>7.2f} ms "
+                      f"{page:>7.3f} ms {len(rows):>9}")
+
+    contacts = [(f"Sort Bench {i:03d}", f"{9_200_000_000 + i}", f"bench{i}@example.com", 'friend')
+                for i in range(100)]
+    insert = [timed(store.insert, *contact)[1] for contact in contacts]
+    delete = [timed(store.delete, name, phone)[1] for name, phone, _, _ in contacts]
+    print(f"with every index: insert p50 {statistics.median(insert):.3f} ms, "
+          f"delete p50 {statistics.median(delete):.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark startup: loading the category files into a ContactStore.
+
+Usage: python benchmarks/bench_startup.py [--rows N] [--workers N] [--skip-legacy]
+
+The category files are generated once in a temporary directory, then each
+startup path runs in a fresh interpreter, as it would when the app starts:
+
+  legacy  sequential parse, one ContactStore.insert per contact
+  cold    parallel parse + k-way merge + bulk_load, then write the snapshot
+  warm    mmap the snapshot (files unchanged) + bulk_load
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactStore
+from storage import JsonLinesStorage, make_record
+
+
+def run_phase(phase, directory, workers):
+    """Runs in the child interpreter, prints the seconds taken"""
+    storage = JsonLinesStorage(directory, workers=workers)
+    store = ContactStore()
+    start = time.perf_counter()
+    if phase == 'legacy':
+        store.load(storage.load())
+    else:
+        store.bulk_load(storage.load_sorted())
+    print(time.perf_counter() - start, len(store))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="parser processes (default: one per CPU)")
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--phase', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        run_phase(args.phase, args.directory, args.workers)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = JsonLinesStorage(directory)
+        storage.add_many(make_record(*c) for c in generate_contacts(args.rows))
+        snapshot = os.path.join(directory, JsonLinesStorage.SNAPSHOT_NAME)
+
+        phases = ['cold', 'warm'] if args.skip_legacy else ['legacy', 'cold', 'warm']
+        for phase in phases:
+            if phase == 'cold' and os.path.exists(snapshot):
+                os.remove(snapshot)
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--phase', phase, '--directory', directory]
+            if args.workers:
+                command += ['--workers', str(args.workers)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            seconds, count = output.split()[-2:]
+            print(f"{phase:<8} {int(count):>9} contacts {float(seconds):>8.2f} s")
+
+        text_size = sum(os.path.getsize(os.path.join(directory, name))
+                        for name in os.listdir(directory) if name.endswith('.txt'))
+        print(f"snapshot {os.path.getsize(snapshot) / 2**20:.1f} MiB, "
+              f"category files {text_size / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark the JSON-lines and SQLite storage backends.
+
+Usage: python benchmarks/bench_storage.py [--rows N] [--ops N]
+
+Each backend is filled with the same generated contacts in a temporary
+directory, then timed on a full load, single adds and deletes, the
+duplicate check (find), a name search and a type filter. JSON-lines has
+no index, so find/search/filter there are the in-memory scans the GUI
+does over the loaded list.
+"""
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+from datagen import generate_contacts
+from storage import JsonLinesStorage, SqliteStorage, make_record
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def bench(label, storage, records, probes, ops):
+    results = {}
+    results['bulk insert'], _ = timed(lambda: storage.add_many(records))
+    results['load'], loaded = timed(lambda: list(storage.load()))
+
+    if storage.indexed:
+        find = lambda name, phone: storage.find(name, phone)
+        search = lambda term: storage.search(term)
+        filter_type = lambda contact_type: storage.search(contact_type=contact_type)
+    else:
+        find = lambda name, phone: next((r for r in loaded if r['name'] == name and r['phone'] == phone), None)
+        search = lambda term: [r for r in loaded if term in r['name'].lower()]
+        filter_type = lambda contact_type: [r for r in loaded if r['type'] == contact_type]
+
+    results['find'], _ = timed(lambda: [find(r['name'], r['phone']) for r in probes])
+    results['find'] /= len(probes)
+    results['search "patel 4"'], _ = timed(lambda: search('patel 4'))
+    results['filter "friend"'], _ = timed(lambda: filter_type('friend'))
+
+    extra = [make_record(f"Bench {i}", f"{9_000_000_000 + i}", '', 'friend') for i in range(ops)]
+    results['single add'], _ = timed(lambda: [storage.add(r) for r in extra])
+    results['single add'] /= ops
+    # JsonLinesStorage.delete prints its debug trace, keep it off the terminal
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results['single delete'], _ = timed(
+            lambda: [storage.delete(r['name'], r['phone'], r['type']) for r in extra])
+    results['single delete'] /= ops
+
+    for name, seconds in results.items():
+        print(f"{label:<10} {name:<18} {seconds * 1000:>12.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--ops', type=int, default=5, help="single adds/deletes to time")
+    args = parser.parse_args()
+
+    records = [make_record(*c) for c in generate_contacts(args.rows)]
+    probes = random.Random(0).sample(records, 100)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bench('jsonl', JsonLinesStorage(os.path.join(directory, 'files')), records, probes, args.ops)
+        sqlite = SqliteStorage(os.path.join(directory, 'contacts.db'))
+        bench('sqlite', sqlite, records, probes, args.ops)
+        sqlite.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare ContactStore against the original ContactLinkedList.
+
+Usage: python benchmarks/bench_store.py [sizes...] [--linked-limit N]
+
+The linked list insert is O(n) per contact, so loading it is O(n^2).
+Sizes above --linked-limit (default 20000) skip the linked list and
+report it as skipped instead of running for hours.
+"""
+import argparse
+import random
+import time
+
+from datagen import generate_contacts
+from contact_store import ContactLinkedList, ContactStore
+
+
+def run(structure_cls, contacts, lookups):
+    structure = structure_cls()
+
+    start = time.perf_counter()
+    for name, phone, email, contact_type in contacts:
+        structure.insert(name, phone, email, contact_type)
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name, phone in lookups:
+        structure.find(name, phone)
+    find = (time.perf_counter() - start) / len(lookups)
+
+    start = time.perf_counter()
+    for name, phone in lookups:
+        structure.delete(name, phone)
+    delete = (time.perf_counter() - start) / len(lookups)
+
+    return load, find, delete
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--linked-limit', type=int, default=20_000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'structure':<18} {'load (s)':>10} {'find (us)':>11} {'delete (us)':>12}")
+    for size in args.sizes:
+        contacts = list(generate_contacts(size))
+        rng = random.Random(size)
+        lookups = [(c[0], c[1]) for c in rng.sample(contacts, min(args.lookups, size))]
+
+        for structure_cls in (ContactLinkedList, ContactStore):
+            label = structure_cls.__name__
+            if structure_cls is ContactLinkedList and size > args.linked_limit:
+                print(f"{size:>9} {label:<18} {'skipped (O(n^2) load)':>35}")
+                continue
+            load, find, delete = run(structure_cls, contacts, lookups)
+            print(f"{size:>9} {label:<18} {load:>10.3f} {find * 1e6:>11.1f} {delete * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
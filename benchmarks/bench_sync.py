@@ -0,0 +1,109 @@
+"""Benchmark delta sync between two contact directories against copying them whole.
+
+Usage: python benchmarks/bench_sync.py [--sizes 10k,100k] [--changes 10,100,1000]
+
+For each size the generated contacts are written to one directory and
+copied to a second, as when the contacts/ folder is carried between
+machines, and a ContactService with a change feed is loaded on each. The
+first sync compares every contact (both stores recorded no change yet,
+so nothing differs). Then for each number of changes, that many random
+edits (new emails and types, renames, deletes, adds) are made in each
+store and the two are synced: ``entries`` is how many feed entries each
+side read from the other, and ``feed`` the bytes of the feed appended
+since the last sync. Both follow the number of changes, while copying
+the folder (``copy``) means all of its category files every time.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from datagen import generate_contacts
+from change_feed import ChangeFeed
+from contact_service import ContactError, ContactService
+from storage import JsonLinesStorage, make_record
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def category_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory)
+               if entry.name.endswith('.txt') and not entry.name.startswith('.'))
+
+
+def open_service(directory):
+    service = ContactService(JsonLinesStorage(directory), feed=ChangeFeed(directory))
+    service.load()
+    return service
+
+
+def contacts(service):
+    return sorted((node.name, node.phone, node.email, node.contact_type) for node in service.store)
+
+
+def edit(service, rng, count, tag):
+    """count random changes, as a user would make them in the GUI"""
+    nodes = [service.store[i] for i in rng.sample(range(len(service.store)), count)]
+    for i, node in enumerate(nodes):
+        roll = rng.random()
+        try:
+            if roll < 0.5:
+                service.update(node.name, node.phone, node.name, node.phone,
+                               f"{tag}{i}@example.com", node.contact_type)
+            elif roll < 0.7:
+                service.update(node.name, node.phone, f"{node.name} {tag}", node.phone, node.email, 'friend')
+            elif roll < 0.85:
+                service.delete(node.name, node.phone)
+            else:
+                service.add(f"Sync Bench {tag} {i}", f"9{rng.randrange(10 ** 9):09d}", '', 'colleague')
+        except ContactError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10k,100k')
+    parser.add_argument('--changes', default='10,100,1000', help="edits made in each store before a sync")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    print(f"{'contacts':>9} {'changes':>8} {'sync':>10} {'entries':>15} {'feed':>10} {'copy':>10}")
+    for text in args.sizes.split(','):
+        size = parse_size(text)
+        with tempfile.TemporaryDirectory() as root:
+            first, second = os.path.join(root, 'a'), os.path.join(root, 'b')
+            storage = JsonLinesStorage(first)
+            storage.add_many(make_record(*contact) for contact in generate_contacts(size))
+            storage.close()
+            shutil.copytree(first, second)
+            a, b = open_service(first), open_service(second)
+
+            start = time.perf_counter()
+            pulled, sent = a.sync(b)
+            seconds = time.perf_counter() - start
+            print(f"{size:>9} {'first':>8} {seconds * 1000:>7.1f} ms {pulled.pulled:>7}/{sent.pulled:<7} "
+                  f"{'':>10} {category_bytes(first) / 1e6:>7.1f} MB")
+
+            for count in (int(c) for c in args.changes.split(',')):
+                feed_before = os.path.getsize(a.feed.path) + os.path.getsize(b.feed.path)
+                edit(a, rng, count, f"a{count}")
+                edit(b, rng, count, f"b{count}")
+                feed = os.path.getsize(a.feed.path) + os.path.getsize(b.feed.path) - feed_before
+                start = time.perf_counter()
+                pulled, sent = a.sync(b)
+                seconds = time.perf_counter() - start
+                assert contacts(a) == contacts(b)
+                print(f"{size:>9} {count:>8} {seconds * 1000:>7.1f} ms {pulled.pulled:>7}/{sent.pulled:<7} "
+                      f"{feed / 1e3:>7.1f} KB {category_bytes(first) / 1e6:>7.1f} MB")
+            a.close()
+            b.close()
+
+
+if __name__ == '__main__':
+    main()
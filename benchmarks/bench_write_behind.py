@@ -0,0 +1,76 @@
+"""Benchmark edit latency with write-behind storage against writing each change at once.
+
+Usage: python benchmarks/bench_write_behind.py [--sizes 10k,100k,300k] [--ops N] [--shard-bytes N]
+
+For each size the generated contacts (mostly colleagues) are written to
+category files, loaded into a ContactService, and single adds, updates
+and deletes of colleagues are timed as the GUI makes them. ``sync`` is
+the files backend alone, which rewrites the contact's category file (or
+shard) before returning; ``behind`` wraps it in WriteBehindStorage, which
+queues the change for its writer thread. The time close() takes to
+write what is still queued is reported too: next to nothing when the
+run fits in one write interval, as each contact's add, update and delete
+cancel out in the queue. By default the category files are not sharded,
+the worst case for ``sync``.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from datagen import generate_contacts
+from contact_service import ContactService
+from storage import JsonLinesStorage, make_record
+from write_behind import WriteBehindStorage
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def bench(directory, mode, ops, shard_bytes):
+    storage = JsonLinesStorage(directory, shard_bytes=shard_bytes or 1 << 62)
+    if mode == 'behind':
+        storage = WriteBehindStorage(storage)
+    service = ContactService(storage)
+    service.load()
+
+    names = [f"Write Bench {i:03d}" for i in range(ops)]
+    phones = [f"{9_100_000_000 + i}" for i in range(ops)]
+    add = [timed(service.add, name, phone, '', 'colleague') for name, phone in zip(names, phones)]
+    update = [timed(service.update, name, phone, name, phone, 'moved@example.com', 'colleague')
+              for name, phone in zip(names, phones)]
+    delete = [timed(service.delete, name, phone) for name, phone in zip(names, phones)]
+    drain = timed(service.close)
+    return statistics.median(add), statistics.median(update), statistics.median(delete), drain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10k,100k,300k')
+    parser.add_argument('--ops', type=int, default=30, help="adds, updates and deletes to time")
+    parser.add_argument('--shard-bytes', type=int, default=0, help="0 = one file per type")
+    args = parser.parse_args()
+
+    print(f"{'contacts':>9} {'mode':<7} {'add':>10} {'update':>10} {'delete':>10} {'close':>10}")
+    for text in args.sizes.split(','):
+        size = parse_size(text)
+        records = [make_record(*contact) for contact in generate_contacts(size)]
+        with tempfile.TemporaryDirectory() as directory:
+            JsonLinesStorage(directory, shard_bytes=args.shard_bytes or 1 << 62).add_many(records)
+            for mode in ('sync', 'behind'):
+                add, update, delete, drain = bench(directory, mode, args.ops, args.shard_bytes)
+                print(f"{size:>9} {mode:<7} {add:>7.3f} ms {update:>7.3f} ms {delete:>7.3f} ms "
+                      f"{drain:>7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Seeded generator of synthetic contacts for the benchmarks"""
+import os
+import random
+import sys
+from typing import Iterator, Tuple
+
+# Benchmarks run from the repository root or from this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CONTACT_TYPES = ['college', 'family', 'colleague', 'friend', 'neighbour', 'relatives']
+
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Alice', 'Amit', 'Ananya', 'Arjun', 'Bob', 'Carlos', 'Chen',
+    'Deepa', 'Diego', 'Elena', 'Fatima', 'George', 'Hana', 'Ishaan', 'Jack', 'Kavya',
+    'Lakshmi', 'Liam', 'Maria', 'Meera', 'Mohammed', 'Nikhil', 'Olivia', 'Priya',
+    'Rahul', 'Rohan', 'Sara', 'Sneha', 'Tanvi', 'Vikram', 'Wei', 'Yusuf', 'Zara',
+]
+
+LAST_NAMES = [
+    'Acharya', 'Bhat', 'Brown', 'Chowdhury', 'Das', 'Fernandes', 'Garcia', 'Gupta',
+    'Hegde', 'Iyer', 'Joshi', 'Kamath', 'Khan', 'Kumar', 'Li', 'Menon', 'Nair',
+    'Padiyar', 'Patel', 'Pillai', 'Rao', 'Reddy', 'Shah', 'Shetty', 'Singh', 'Smith',
+    'Wang', 'Williams',
+]
+
+DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.com', 'college.edu']
+
+
+def generate_contacts(count: int, seed: int = 42) -> Iterator[Tuple[str, str, str, str]]:
+    """Yield (name, phone, email, contact_type) tuples, unique on (name, phone)"""
+    rng = random.Random(seed)
+    # Unique phones: a shuffled stride through the 10-digit space
+    start = rng.randrange(6_000_000_000, 7_000_000_000)
+    for i in range(count):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        name = f"{first} {last}"
+        if rng.random() < 0.3:
+            name = f"{name} {rng.randrange(1, 1000)}"
+        phone = str(start + i * 7919 % 3_000_000_000)
+        email = ''
+        if rng.random() < 0.8:
+            email = f"{first}.{last}{rng.randrange(100)}@{rng.choice(DOMAINS)}".lower()
+        # Skewed like real address books: mostly colleagues
+        contact_type = rng.choices(CONTACT_TYPES, weights=(10, 8, 50, 20, 5, 7))[0]
+        yield name, phone, email, contact_type
@@ -0,0 +1,174 @@
+"""Stand-in tkinter modules, so the GUI's own handlers can be benchmarked
+without a display.
+
+install() puts fake ``tkinter``, ``tkinter.ttk``, ``tkinter.messagebox``,
+``tkinter.filedialog``, ``tkinter.simpledialog`` and ``tkinter.font``
+modules in sys.modules; then load_app() imports "contact list.py".
+Widgets accept and ignore every call, except that the Treeview keeps its
+items (so rendering does the same Python work as on screen), variables
+hold their value, dialogs answer yes (and questions nothing), error
+messages are collected in ``errors``, and root.after only queues
+callbacks for run_pending().
+
+What this measures is the application's Python side: the time Tk itself
+spends drawing is not included.
+"""
+import importlib.util
+import itertools
+import os
+import sys
+import types
+from typing import Dict, List, Tuple
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'contact list.py obl.py')
+
+# Messages the app showed with messagebox.showerror, so a benchmark can
+# tell a rejected action from a fast one
+errors: List[str] = []
+
+
+class Variable:
+    def __init__(self, master=None, value='', name=None):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+
+class Widget:
+    """Accepts any constructor arguments and method call"""
+    def __init__(self, *args, **options):
+        self._options = dict(options)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+    def configure(self, *args, **options):
+        # ttk.Style.configure takes a style name first
+        self._options.update(options)
+
+    config = configure
+
+    def cget(self, option):
+        return self._options.get(option)
+
+    def __setitem__(self, option, value):
+        self._options[option] = value
+
+    def __getitem__(self, option):
+        return self._options.get(option)
+
+    def winfo_exists(self):
+        return True
+
+
+class Tk(Widget):
+    def __init__(self, *args, **options):
+        super().__init__(*args, **options)
+        self._ids = itertools.count()
+        self.pending: Dict[str, Tuple] = {}
+
+    def after(self, ms, func=None, *args):
+        after_id = f"after#{next(self._ids)}"
+        if func is not None:
+            self.pending[after_id] = (func, args)
+        return after_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    def run_pending(self, skip=()):
+        """Run every queued callback once (ignoring delays), except those named in skip"""
+        pending, self.pending = self.pending, {}
+        for after_id, (func, args) in pending.items():
+            if getattr(func, '__name__', '') in skip:
+                self.pending[after_id] = (func, args)
+            else:
+                func(*args)
+
+
+class Treeview(Widget):
+    def __init__(self, *args, **options):
+        super().__init__(*args, **options)
+        self._ids = itertools.count()
+        self._items: Dict[str, Tuple] = {}
+        self._order: List[str] = []
+        self._selection: Tuple[str, ...] = ()
+
+    def insert(self, parent, index, iid=None, values=(), **options):
+        iid = iid or f"I{next(self._ids):03X}"
+        self._items[iid] = tuple(values)
+        if index == 'end':
+            self._order.append(iid)
+        else:
+            self._order.insert(index, iid)
+        return iid
+
+    def delete(self, *iids):
+        for iid in iids:
+            del self._items[iid]
+            self._order.remove(iid)
+
+    def item(self, iid, option=None, **options):
+        if 'values' in options:
+            self._items[iid] = tuple(options['values'])
+            return None
+        return {'values': list(self._items[iid])}
+
+    def get_children(self, item=''):
+        return tuple(self._order)
+
+    def selection(self):
+        return self._selection
+
+    def selection_set(self, *items):
+        if len(items) == 1 and isinstance(items[0], (list, tuple)):
+            items = items[0]
+        self._selection = tuple(items)
+
+
+def install() -> types.ModuleType:
+    """Register the stand-in modules, returns the fake tkinter"""
+    tk = types.ModuleType('tkinter')
+    ttk = types.ModuleType('tkinter.ttk')
+    messagebox = types.ModuleType('tkinter.messagebox')
+    filedialog = types.ModuleType('tkinter.filedialog')
+    simpledialog = types.ModuleType('tkinter.simpledialog')
+    font = types.ModuleType('tkinter.font')
+
+    tk.Tk = Tk
+    tk.StringVar = tk.BooleanVar = tk.IntVar = tk.DoubleVar = Variable
+    tk.Menu = tk.Toplevel = tk.Text = tk.Label = tk.Frame = Widget
+    tk.END = 'end'
+    tk.TclError = RuntimeError
+    for name in ('Style', 'Label', 'Frame', 'LabelFrame', 'Entry', 'Combobox', 'Button',
+                 'Scrollbar', 'Checkbutton', 'Progressbar'):
+        setattr(ttk, name, Widget)
+    ttk.Treeview = Treeview
+
+    messagebox.askyesno = lambda *args, **kwargs: True
+    messagebox.showerror = lambda title, message, **kwargs: errors.append(message)
+    messagebox.showinfo = messagebox.showwarning = lambda *args, **kwargs: None
+    filedialog.askopenfilename = filedialog.asksaveasfilename = lambda *args, **kwargs: ''
+    simpledialog.askstring = lambda *args, **kwargs: None
+
+    tk.ttk, tk.messagebox, tk.filedialog, tk.font = ttk, messagebox, filedialog, font
+    tk.simpledialog = simpledialog
+    sys.modules.update({'tkinter': tk, 'tkinter.ttk': ttk, 'tkinter.messagebox': messagebox,
+                        'tkinter.filedialog': filedialog, 'tkinter.simpledialog': simpledialog,
+                        'tkinter.font': font})
+    return tk
+
+
+def load_app(path: str = APP_PATH) -> types.ModuleType:
+    """Import the GUI module (its file name has a space) against the stand-ins"""
+    install()
+    spec = importlib.util.spec_from_file_location('contact_app', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
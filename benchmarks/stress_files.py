@@ -0,0 +1,171 @@
+"""Stress-test several processes sharing one directory of category files.
+
+Usage: python benchmarks/stress_files.py [--processes N] [--ops N] [--kills N] [--shard-bytes N]
+
+Each worker process runs its own ContactService over the same directory
+and adds, updates (often to another type) and deletes its own contacts,
+polling reload_changed now and then as the GUI does. An observer service
+loaded before the workers start only learns about their changes through
+reload_changed. Then a writer that moves one contact between types is
+killed with SIGKILL at random moments, to check no crash leaves a
+truncated file or a contact in two files. Shards are kept small, so
+categories are split and merged while all of this goes on.
+
+Afterwards every shard file must be valid, sorted JSON lines within its
+name range, the categories must hold exactly the contacts the workers
+expect (no lost writes, no duplicates), no temp or transaction files may
+be left, and the observer must agree.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import tempfile
+import time
+
+from datagen import CONTACT_TYPES
+from contact_service import ContactService
+from storage import JsonLinesStorage, ShardMap, make_record
+
+
+def worker(directory, number, ops, seed, shard_bytes):
+    """Returns the contacts this worker expects to be stored in the end"""
+    rng = random.Random(seed)
+    service = ContactService(JsonLinesStorage(directory, shard_bytes=shard_bytes))
+    service.load()
+    mine = {}
+    for op in range(ops):
+        roll = rng.random()
+        if mine and roll < 0.2:
+            name, phone = rng.choice(sorted(mine))
+            service.delete(name, phone)
+            del mine[name, phone]
+        elif mine and roll < 0.5:
+            name, phone = rng.choice(sorted(mine))
+            new_name = f"{name.split(' v')[0]} v{op}"
+            contact_type = rng.choice(CONTACT_TYPES)
+            service.update(name, phone, new_name, phone, '', contact_type)
+            del mine[name, phone]
+            mine[new_name, phone] = contact_type
+        else:
+            name, phone = f"Worker {number} Contact {op}", f"{number:03d}{op:07d}"
+            contact_type = rng.choice(CONTACT_TYPES)
+            service.add(name, phone, '', contact_type)
+            mine[name, phone] = contact_type
+        if op % 10 == 0:
+            service.reload_changed()
+    service.close()
+    return [make_record(name, phone, '', contact_type) for (name, phone), contact_type in mine.items()]
+
+
+def mover(directory, shard_bytes):
+    """Move one contact between types forever, until killed"""
+    storage = JsonLinesStorage(directory, shard_bytes=shard_bytes)
+    record = make_record('Crash Test', '9999999999', '', CONTACT_TYPES[0])
+    storage.add(record)
+    while True:
+        old_type = record['type']
+        record = make_record('Crash Test', '9999999999', '', CONTACT_TYPES[
+            (CONTACT_TYPES.index(old_type) + 1) % len(CONTACT_TYPES)])
+        storage.update('Crash Test', '9999999999', old_type, record)
+
+
+def read_category_files(directory):
+    """All stored records, checking each shard is valid JSON lines in name order and in its range"""
+    records = []
+    listed = set()
+    for contact_type in CONTACT_TYPES:
+        shards = ShardMap.read(directory, contact_type)
+        listed.update(shards.files)
+        for i, filename in enumerate(shards.paths()):
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'r') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            names = [row['name'].lower() for row in rows]
+            shard = os.path.basename(filename)
+            assert names == sorted(names), f"{shard} is not sorted"
+            assert all(row['type'] == contact_type for row in rows), f"{shard} holds other types"
+            high = shards.lows[i + 1] if i + 1 < len(shards) else None
+            assert all(shards.lows[i] <= name and (high is None or name < high) for name in names), \
+                f"{shard} holds names outside its range"
+            records += rows
+    unlisted = [name for name in os.listdir(directory) if name.endswith('.txt') and name not in listed]
+    assert not unlisted, f"shard files in no manifest: {unlisted}"
+    return records
+
+
+def check_leftovers(directory):
+    leftovers = [name for name in os.listdir(directory)
+                 if name.endswith(('.tmp', '.txn')) or name.startswith(JsonLinesStorage.TXN_PREFIX)]
+    assert not leftovers, f"left behind: {leftovers}"
+
+
+def shard_count(directory):
+    return sum(len(ShardMap.read(directory, contact_type)) for contact_type in CONTACT_TYPES)
+
+
+def key_set(records):
+    keys = [(r['name'], r['phone'], r['type']) for r in records]
+    assert len(keys) == len(set(keys)), "duplicate contacts"
+    return set(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=300, help="operations per process")
+    parser.add_argument('--kills', type=int, default=20, help="times to kill the mover")
+    parser.add_argument('--shard-bytes', type=int, default=2048, help="split category shards past this size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        observer = ContactService(JsonLinesStorage(directory, shard_bytes=args.shard_bytes))
+        observer.load()
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(worker, [(directory, i, args.ops, i, args.shard_bytes)
+                                            for i in range(args.processes)])
+        seconds = time.perf_counter() - start
+        expected = key_set(record for result in results for record in result)
+        stored = key_set(read_category_files(directory))
+        check_leftovers(directory)
+        assert stored == expected, (f"{len(expected - stored)} lost, "
+                                    f"{len(stored - expected)} unexpected contacts")
+        print(f"{args.processes} processes x {args.ops} ops in {seconds:.2f} s: "
+              f"{len(stored)} contacts in {shard_count(directory)} shards, none lost or duplicated")
+
+        changed = observer.reload_changed()
+        seen = key_set(observer.to_record(node) for node in observer.store)
+        assert seen == expected, "observer disagrees with the files"
+        print(f"observer reloaded {len(changed)} changed categories and matches")
+
+        rng = random.Random(0)
+        for _ in range(args.kills):
+            process = multiprocessing.Process(target=mover, args=(directory, args.shard_bytes))
+            process.start()
+            time.sleep(rng.uniform(0.05, 0.3))
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+            # The next instance rolls forward what the killed one committed;
+            # temp files of a write it never committed are simply dropped
+            JsonLinesStorage(directory)
+            for name in os.listdir(directory):
+                if name.endswith(('.tmp', '.txn')):
+                    os.remove(os.path.join(directory, name))
+            check_leftovers(directory)
+            records = read_category_files(directory)
+            crash = [r for r in records if r['name'] == 'Crash Test']
+            assert len(crash) == 1, f"Crash Test stored {len(crash)} times"
+            assert key_set(r for r in records if r['name'] != 'Crash Test') == expected
+            # Start the next round from a clean slate
+            JsonLinesStorage(directory, shard_bytes=args.shard_bytes).delete(
+                'Crash Test', '9999999999', crash[0]['type'])
+        print(f"killed a writer {args.kills} times: every file intact, no contact lost or doubled")
+
+
+if __name__ == '__main__':
+    main()
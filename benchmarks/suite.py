@@ -0,0 +1,295 @@
+"""Headless benchmark suite for the contact manager, with baseline comparison.
+
+Usage: python benchmarks/suite.py [--sizes 1k,10k,100k] [--scenarios a,b,...]
+                                  [--storage files|journal|sqlite] [--repeat N]
+                                  [--output FILE] [--baseline FILE] [--tolerance F]
+
+For every size, seeded contacts from datagen are written to a temporary
+contacts/ directory, and the scenarios below are run through the GUI's
+own handlers (ContactManager with Tk replaced by benchmarks/headless_tk):
+
+  cold_load       ContactService.load() with no startup snapshot
+  single_add      add_contact() from the form: store insert, storage write, row patch
+  update_type     update_contact() moving a contact to another type
+  delete          delete_contact() of the selected contact
+  keystroke       one search query and result display per typed character
+  type_filter     the type filter on its own, for every type
+  full_redraw     refresh_contact_display()
+  bulk_import     iter_import() of a CSV holding a tenth of the size (timed per row)
+
+Results go to stdout as a table and, with --output, to a JSON file. With
+--baseline (e.g. benchmarks/baseline.json, written by an earlier run with
+--output) each median is compared to the stored one, and the exit status
+is 1 if any is more than --tolerance slower. Medians below --noise-ms are
+never flagged. Sizes take k/M suffixes; 1M needs a few GB and minutes.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import headless_tk
+from datagen import CONTACT_TYPES, generate_contacts
+from storage import JournalStorage, JsonLinesStorage, SqliteStorage, make_record
+
+BACKENDS = {
+    'files': lambda: JsonLinesStorage('contacts'),
+    'journal': lambda: JournalStorage('contacts'),
+    'sqlite': lambda: SqliteStorage(os.path.join('contacts', 'contacts.db')),
+}
+
+SEARCH_TERMS = ['alice', 'patel', 'rahul shetty', 'kumar 12', 'xyz']
+
+SCENARIOS = ['cold_load', 'single_add', 'update_type', 'delete', 'keystroke',
+             'type_filter', 'full_redraw', 'bulk_import']
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def timed(action, *args):
+    start = time.perf_counter()
+    action(*args)
+    return time.perf_counter() - start
+
+
+class Bench:
+    """One size: the contacts directory, a headless GUI over it and the scenarios"""
+    def __init__(self, app_module, size, storage_name, repeat, seed):
+        self.app_module = app_module
+        self.size = size
+        self.storage_name = storage_name
+        self.repeat = repeat
+        self.seed = seed
+        self.contacts = list(generate_contacts(size, seed))
+        storage = BACKENDS[storage_name]()
+        storage.add_many(make_record(*contact) for contact in self.contacts)
+        storage.close()
+        self.root = None
+        self.app = None
+
+    def open_app(self):
+        self.root = headless_tk.Tk()
+        self.app = self.app_module.ContactManager(self.root, BACKENDS[self.storage_name]())
+
+    def close(self):
+        if self.app is not None:
+            self.app.close()
+
+    def _show(self, search='', contact_type='All'):
+        """Run the current query the way the worker and its result poll would"""
+        app = self.app
+        app.search_var.set(search)
+        app.filter_var.set(contact_type)
+        query = app.current_query()
+        app._show_query_results(query, app.service.query(query))
+
+    def _fill_form(self, name, phone, email, contact_type):
+        app = self.app
+        app.name_var.set(name)
+        app.phone_var.set(phone)
+        app.email_var.set(email)
+        app.type_var.set(contact_type)
+
+    # Scenarios, each returns (samples in seconds, unit)
+
+    def cold_load(self):
+        samples = []
+        for _ in range(self.repeat):
+            snapshot = os.path.join('contacts', JsonLinesStorage.SNAPSHOT_NAME)
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            service = self.app_module.ContactService(BACKENDS[self.storage_name]())
+            samples.append(service.load())
+            service.close()
+        return samples, 'load'
+
+    def _added(self):
+        return [(f"Bench Contact {i:03d}", f"5{self.seed:03d}{i:06d}") for i in range(20 * self.repeat)]
+
+    def _added_nodes(self):
+        """The bench contacts, adding (untimed) any that single_add did not"""
+        for i, (name, phone) in enumerate(self._added()):
+            node = self.app.contact_list.find(name, phone)
+            if node is None:
+                self._fill_form(name, phone, '', CONTACT_TYPES[i % len(CONTACT_TYPES)])
+                self.app.add_contact()
+                node = self.app.contact_list.find(name, phone)
+            yield i, node
+
+    def _select(self, node):
+        self.app.view.see(self.app.contact_list.index(node))
+        self.app.view.select([node])
+
+    def single_add(self):
+        self.app.refresh_contact_display()
+        samples = []
+        for i, (name, phone) in enumerate(self._added()):
+            self._fill_form(name, phone, '', CONTACT_TYPES[i % len(CONTACT_TYPES)])
+            samples.append(timed(self.app.add_contact))
+        return samples, 'op'
+
+    def update_type(self):
+        samples = []
+        for i, node in list(self._added_nodes()):
+            self._select(node)
+            self._fill_form(node.name, node.phone, 'moved@example.com',
+                            CONTACT_TYPES[(i + 1) % len(CONTACT_TYPES)])
+            samples.append(timed(self.app.update_contact))
+        return samples, 'op'
+
+    def delete(self):
+        samples = []
+        for _, node in list(self._added_nodes()):
+            self._select(node)
+            samples.append(timed(self.app.delete_contact))
+        return samples, 'op'
+
+    def keystroke(self):
+        samples = []
+        for _ in range(self.repeat):
+            for term in SEARCH_TERMS:
+                for end in range(1, len(term) + 1):
+                    samples.append(timed(self._show, term[:end]))
+        self._show()
+        return samples, 'keystroke'
+
+    def type_filter(self):
+        samples = []
+        for _ in range(self.repeat):
+            for contact_type in CONTACT_TYPES:
+                samples.append(timed(self._show, '', contact_type))
+        self._show()
+        return samples, 'op'
+
+    def full_redraw(self):
+        samples = [timed(self.app.refresh_contact_display) for _ in range(10 * self.repeat)]
+        return samples, 'op'
+
+    def bulk_import(self):
+        rows = max(1000, self.size // 10)
+        path = os.path.abspath('import.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'phone', 'email', 'type'])
+            for i, (name, _, email, contact_type) in enumerate(generate_contacts(rows, self.seed + 1)):
+                writer.writerow([f"{name} Imported", f"4{i:09d}", email, contact_type])
+        app = self.app
+        stats = None
+        start = time.perf_counter()
+        for stats in self.app_module.iter_import(path, app.service):
+            pass
+        seconds = time.perf_counter() - start
+        return [seconds / max(1, stats.imported)], 'row'
+
+
+def summarize(scenario, size, samples, unit):
+    ordered = sorted(samples)
+    return {
+        'scenario': scenario,
+        'size': size,
+        'unit': unit,
+        'samples': len(samples),
+        'median_ms': round(statistics.median(ordered) * 1000, 4),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+    }
+
+
+def compare(results, baseline, tolerance, noise_ms):
+    """Print each result against the baseline, returns the regressions"""
+    stored = {(r['scenario'], r['size']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'scenario':<13} {'size':>9} {'baseline ms':>12} {'now ms':>10} {'ratio':>7}")
+    for result in results:
+        before = stored.get((result['scenario'], result['size']))
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else 1.0
+        regressed = ratio > 1 + tolerance and result['median_ms'] >= noise_ms
+        if regressed:
+            regressions.append(result)
+        print(f"{result['scenario']:<13} {result['size']:>9} {before['median_ms']:>12.3f} "
+              f"{result['median_ms']:>10.3f} {ratio:>7.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1k,10k,100k', help="comma-separated, e.g. 1k,10k,100k,1M")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--storage', choices=sorted(BACKENDS), default='files')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="compare against results written earlier with --output")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument('--noise-ms', type=float, default=0.05, help="never flag medians below this")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    scenarios = [name.strip() for name in args.scenarios.split(',')]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    app_module = headless_tk.load_app()
+    results = []
+    print(f"{'scenario':<13} {'size':>9} {'median ms':>11} {'p95 ms':>10}  per")
+    cwd = os.getcwd()
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='contacts-bench-')
+        os.chdir(directory)
+        bench = Bench(app_module, size, args.storage, args.repeat, args.seed)
+        try:
+            bench.open_app()
+            for scenario in scenarios:
+                samples, unit = getattr(bench, scenario)()
+                if headless_tk.errors:
+                    raise RuntimeError(f"{scenario} was rejected: {headless_tk.errors[0]}")
+                result = summarize(scenario, size, samples, unit)
+                results.append(result)
+                print(f"{scenario:<13} {size:>9} {result['median_ms']:>11.3f} {result['p95_ms']:>10.3f}  {unit}")
+        finally:
+            bench.close()
+            os.chdir(cwd)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline is not None:
+        if baseline['meta'].get('storage') != args.storage:
+            print(f"note: baseline was measured with {baseline['meta'].get('storage')} storage")
+        regressions = compare(results, baseline, args.tolerance, args.noise_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
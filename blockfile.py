@@ -0,0 +1,361 @@
+import bisect
+import gzip
+import io
+import os
+import struct
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import lzma
+except ImportError:
+    # Optional: Python builds without liblzma offer zlib and gzip only
+    lzma = None
+
+MAGIC = b'CNTBLK1\n'
+# File header: MAGIC, compression code
+_HEADER = struct.Struct('<8sB')
+# Before each block: compressed size, uncompressed size, lines, CRC-32 of the compressed bytes
+_BLOCK = struct.Struct('<IIII')
+# Block index entry: file offset of the block, uncompressed offset and first line of its data
+_ENTRY = struct.Struct('<QQQ')
+# Last bytes of the file: index offset, blocks, CRC-32 of the index, END
+_TRAILER = struct.Struct('<QII8s')
+END = b'CNTBEND\n'
+
+# Uncompressed bytes per block: the unit of reading, checking and decompressing
+BLOCK_BYTES = 64 * 1024
+
+# name -> (code in the file header, compress, decompress)
+COMPRESSIONS: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'zlib': (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    'gzip': (2, lambda data: gzip.compress(data, 6), gzip.decompress),
+}
+if lzma is not None:
+    COMPRESSIONS['lzma'] = (3, lzma.compress, lzma.decompress)
+_BY_CODE = {code: (name, decompress) for name, (code, _, decompress) in COMPRESSIONS.items()}
+
+
+class CorruptBlockError(ValueError):
+    """A block of a compressed category file failed its CRC, would not
+    decompress, or is missing from a truncated file"""
+    def __init__(self, path: str, block: int, first_line: int, lines: int, reason: str):
+        where = f"lines {first_line + 1}-{first_line + lines}" if lines else f"from line {first_line + 1}"
+        super().__init__(f"{path}: block {block} ({where}) is corrupt: {reason}")
+        self.path = path
+        self.block = block
+        self.first_line = first_line
+        self.lines = lines
+
+
+class BlockWriter:
+    """Writes lines to a binary file as compressed blocks of about ``block_bytes``.
+
+    The file is the header, then each block (its _BLOCK header and the
+    compressed lines, every one ending in a newline, so the data of all
+    blocks in order is exactly the plain file), then the block index and
+    the trailer pointing at it. close() writes the last block and the index.
+    """
+    def __init__(self, f: BinaryIO, compression: str = 'zlib', block_bytes: int = BLOCK_BYTES):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', use one of {', '.join(COMPRESSIONS)}")
+        code, self._compress, _ = COMPRESSIONS[compression]
+        self._f = f
+        self.block_bytes = block_bytes
+        self._lines: List[bytes] = []
+        self._size = 0
+        self._position = _HEADER.size
+        # (file offset, uncompressed offset, first line) of every block written
+        self._entries: List[Tuple[int, int, int]] = []
+        self._offset = 0
+        self._line = 0
+        f.write(_HEADER.pack(MAGIC, code))
+
+    def write(self, line: str):
+        data = (line + '\n').encode('utf-8')
+        self._lines.append(data)
+        self._size += len(data)
+        if self._size >= self.block_bytes:
+            self._write_block()
+
+    def _write_block(self):
+        if not self._lines:
+            return
+        data = b''.join(self._lines)
+        compressed = self._compress(data)
+        self._entries.append((self._position, self._offset, self._line))
+        self._f.write(_BLOCK.pack(len(compressed), len(data), len(self._lines), zlib.crc32(compressed)))
+        self._f.write(compressed)
+        self._position += _BLOCK.size + len(compressed)
+        self._offset += len(data)
+        self._line += len(self._lines)
+        self._lines = []
+        self._size = 0
+
+    def close(self):
+        self._write_block()
+        # A last entry for the end of the data, so every block's extent is known
+        entries = self._entries + [(self._position, self._offset, self._line)]
+        index = b''.join(_ENTRY.pack(*entry) for entry in entries)
+        self._f.write(index)
+        self._f.write(_TRAILER.pack(self._position, len(self._entries), zlib.crc32(index), END))
+
+
+class BlockReader:
+    """A compressed category file read back as its plain lines, one block at a time.
+
+    The block index says where each block's data falls in the plain file,
+    so ``seek`` and ``read`` work in plain-file offsets (what the lazy
+    mode's page index stores) and only decompress the blocks they touch.
+    Every block's CRC is checked before it is used; a block that fails
+    raises CorruptBlockError. A missing or damaged index is rebuilt by
+    walking the block headers, and a truncated last block is reported
+    as corrupt too.
+    """
+    def __init__(self, f: BinaryIO, path: str = ''):
+        self._file = f
+        self.path = path or getattr(f, 'name', '')
+        f.seek(0)
+        magic, code = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or code not in _BY_CODE:
+            raise ValueError(f"{self.path} is not a compressed category file")
+        self.compression, self._decompress = _BY_CODE[code]
+        # Per block plus one for the end: file offset, plain offset, first line
+        self._positions: List[int] = []
+        self._offsets: List[int] = []
+        self._first_lines: List[int] = []
+        # File offset of a block cut off by the end of the file, if any
+        self.truncated_at: Optional[int] = None
+        if not self._read_index():
+            self._walk()
+        self._position = 0
+        # The last decompressed block, as (number, data)
+        self._cached: Tuple[int, bytes] = (-1, b'')
+
+    def _read_index(self) -> bool:
+        f = self._file
+        end = f.seek(0, os.SEEK_END)
+        if end < _HEADER.size + _TRAILER.size:
+            return False
+        f.seek(end - _TRAILER.size)
+        index_at, blocks, crc, marker = _TRAILER.unpack(f.read(_TRAILER.size))
+        size = (blocks + 1) * _ENTRY.size
+        if marker != END or index_at + size + _TRAILER.size != end:
+            return False
+        f.seek(index_at)
+        index = f.read(size)
+        if zlib.crc32(index) != crc:
+            return False
+        for entry in _ENTRY.iter_unpack(index):
+            self._positions.append(entry[0])
+            self._offsets.append(entry[1])
+            self._first_lines.append(entry[2])
+        return True
+
+    def _walk(self):
+        """Rebuild a missing or damaged index from the block headers"""
+        f = self._file
+        end = f.seek(0, os.SEEK_END)
+        position, offset, line = _HEADER.size, 0, 0
+        # Blocks follow each other up to the index, which takes the rest of the file
+        while position + _BLOCK.size <= end and not self._index_at(position, end):
+            f.seek(position)
+            size, raw_size, lines, _ = _BLOCK.unpack(f.read(_BLOCK.size))
+            if not lines or position + _BLOCK.size + size > end:
+                break
+            self._positions.append(position)
+            self._offsets.append(offset)
+            self._first_lines.append(line)
+            position += _BLOCK.size + size
+            offset += raw_size
+            line += lines
+        if position < end and not self._index_at(position, end):
+            # Whatever is left is neither a block nor the index
+            self.truncated_at = position
+        self._positions.append(position)
+        self._offsets.append(offset)
+        self._first_lines.append(line)
+
+    def _index_at(self, position: int, end: int) -> bool:
+        return position + (len(self._positions) + 1) * _ENTRY.size + _TRAILER.size == end
+
+    def __len__(self) -> int:
+        """Number of blocks"""
+        return len(self._positions) - 1
+
+    @property
+    def size(self) -> int:
+        """Bytes of the plain file"""
+        return self._offsets[-1]
+
+    @property
+    def lines(self) -> int:
+        return self._first_lines[-1]
+
+    def span(self, block: int) -> Tuple[int, int]:
+        """Plain-file offsets where a block's data starts and ends"""
+        return self._offsets[block], self._offsets[block + 1]
+
+    def corrupt(self, block: int, reason: str) -> CorruptBlockError:
+        first = self._first_lines[block]
+        return CorruptBlockError(self.path, block, first, self._first_lines[block + 1] - first, reason)
+
+    def check(self):
+        """Raise CorruptBlockError if the file was cut short after its last whole block"""
+        if self.truncated_at is not None:
+            raise CorruptBlockError(self.path, len(self), self.lines, 0,
+                                    f"file is truncated at byte {self.truncated_at}")
+
+    def read_block(self, block: int) -> bytes:
+        """The plain data of one block, after checking it"""
+        number, data = self._cached
+        if number == block:
+            return data
+        start, end = self._positions[block], self._positions[block + 1]
+        self._file.seek(start)
+        raw = self._file.read(end - start)
+        if len(raw) < _BLOCK.size:
+            raise self.corrupt(block, "block is cut short")
+        size, raw_size, _, crc = _BLOCK.unpack_from(raw)
+        compressed = raw[_BLOCK.size:]
+        if len(compressed) != size or zlib.crc32(compressed) != crc:
+            raise self.corrupt(block, "CRC mismatch")
+        try:
+            data = self._decompress(compressed)
+        except Exception as e:
+            raise self.corrupt(block, f"cannot decompress: {e}")
+        if len(data) != raw_size or raw_size != self._offsets[block + 1] - self._offsets[block]:
+            raise self.corrupt(block, "wrong length")
+        self._cached = (block, data)
+        return data
+
+    # File-like access in plain-file offsets, for the lazy mode's pages
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_END:
+            position += self.size
+        elif whence == os.SEEK_CUR:
+            position += self._position
+        self._position = max(0, position)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size < 0 else min(self.size, self._position + size)
+        chunks = []
+        while self._position < end:
+            block = bisect.bisect_right(self._offsets, self._position) - 1
+            start = self._position - self._offsets[block]
+            chunk = self.read_block(block)[start:start + end - self._position]
+            chunks.append(chunk)
+            self._position += len(chunk)
+        return b''.join(chunks)
+
+    def __iter__(self) -> Iterator[bytes]:
+        """Lines from the current position on, each with its newline"""
+        while self._position < self.size:
+            block = bisect.bisect_right(self._offsets, self._position) - 1
+            data = self.read_block(block)
+            start = self._position - self._offsets[block]
+            self._position = self._offsets[block + 1]
+            # Blocks end at line ends, so no line spans two
+            yield from io.BytesIO(data[start:])
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'BlockReader':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compression_of(path: str) -> Optional[str]:
+    """The compression of a category file, None for a plain (or missing) one"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) == _HEADER.size:
+        magic, code = _HEADER.unpack(header)
+        if magic == MAGIC and code in _BY_CODE:
+            return _BY_CODE[code][0]
+    return None
+
+
+def open_category(path: str) -> Union[BinaryIO, BlockReader]:
+    """A category file opened for binary reading: the file itself if it is
+    plain, a BlockReader presenting its plain contents if it is compressed"""
+    f = open(path, 'rb')
+    try:
+        if f.read(len(MAGIC)) == MAGIC:
+            return BlockReader(f, path)
+        f.seek(0)
+        return f
+    except BaseException:
+        f.close()
+        raise
+
+
+def content_size(path: str) -> int:
+    """Bytes of a category file's plain contents, 0 if it is missing"""
+    try:
+        with open_category(path) as f:
+            return f.size if isinstance(f, BlockReader) else os.fstat(f.fileno()).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def iter_lines(path: str, corrupt: Optional[List[CorruptBlockError]] = None) -> Iterator[str]:
+    """The lines of a category file, plain or compressed, without line ends.
+
+    A corrupt block raises CorruptBlockError, or, given a corrupt list, is
+    added to it and skipped so the rest of the file can still be read.
+    """
+    if compression_of(path) is None:
+        with open(path, 'r') as f:
+            for line in f:
+                yield line.rstrip('\n')
+        return
+    with open_category(path) as reader:
+        for block, lines in iter_blocks(reader, corrupt):
+            yield from lines
+
+
+def iter_blocks(reader: BlockReader, corrupt: Optional[List[CorruptBlockError]] = None
+                ) -> Iterator[Tuple[int, List[str]]]:
+    """(block number, lines) of every block that checks out, see iter_lines"""
+    for block in range(len(reader)):
+        try:
+            data = reader.read_block(block)
+        except CorruptBlockError as e:
+            if corrupt is None:
+                raise
+            corrupt.append(e)
+            continue
+        lines = data.decode('utf-8').split('\n')
+        # The block's last line ends in a newline too
+        lines.pop()
+        yield block, lines
+    try:
+        reader.check()
+    except CorruptBlockError as e:
+        if corrupt is None:
+            raise
+        corrupt.append(e)
+
+
+def write_blocks(f: BinaryIO, lines: Iterable[str], compression: str = 'zlib',
+                 block_bytes: int = BLOCK_BYTES):
+    """Write lines to an open binary file as a compressed category file"""
+    writer = BlockWriter(f, compression, block_bytes)
+    for line in lines:
+        writer.write(line)
+    writer.close()
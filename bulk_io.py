@@ -0,0 +1,366 @@
+import csv
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator, TextIO, BinaryIO
+
+from codec import BinaryRecords, get_codec, loads
+from contact_service import ContactService
+from contact_store import normalize_phone, validate_contact
+from storage import Record, make_record
+
+FORMATS = ('csv', 'vcard', 'jsonl', 'binary')
+# Formats read and written as bytes rather than text
+BINARY_FORMATS = ('binary',)
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.vcf': 'vcard',
+    '.vcard': 'vcard',
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+    '.txt': 'jsonl',
+    '.cbin': 'binary',
+}
+
+# vCard text escapes: \\ \, \; and \n (or \N) for a line break
+_VCARD_ESCAPE = re.compile(r'\\([\\,;nN])')
+_VCARD_UNESCAPED = {'n': '\n', 'N': '\n'}
+
+# Separators allowed inside vCard TEL values, e.g. "+91 98765-43210" (see _vcard_phone)
+_PHONE_FORMATTING = str.maketrans('', '', ' -.()')
+
+_codec = get_codec()
+# Bytes read at a time from a binary file
+BINARY_CHUNK = 1 << 20
+
+
+def detect_format(path: str) -> str:
+    """Pick csv, vcard, jsonl or binary from a file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Cannot tell the format of '{path}', use one of {', '.join(FORMATS)}")
+    return EXTENSIONS[extension]
+
+
+class ProgressLines:
+    """Iterates the lines of a text file while counting the characters consumed"""
+    def __init__(self, f: TextIO):
+        self._f = f
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self._f:
+            self.bytes_read += len(line)
+            yield line
+
+
+class ProgressChunks:
+    """Iterates a binary file in chunks while counting the bytes consumed"""
+    def __init__(self, f: BinaryIO, size: int = BINARY_CHUNK):
+        self._f = f
+        self._size = size
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._f.read(self._size)
+            if not chunk:
+                return
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+# Parsers: each yields (line number, record) and never holds the whole file
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Tuple[int, Record]]:
+    """CSV with a header row naming name, phone, email and type (or contact_type)"""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        row = {(key or '').strip().lower(): (value or '') for key, value in row.items()}
+        yield reader.line_num, make_record(
+            row.get('name', '').strip(),
+            row.get('phone', '').strip(),
+            row.get('email', '').strip(),
+            (row.get('type') or row.get('contact_type') or '').strip().lower()
+        )
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[Tuple[int, Record]]:
+    """The same JSON lines the category files use"""
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        fields = _codec.decode(line)
+        if fields is not None:
+            yield line_num, make_record(fields[0].strip(), str(fields[1]).strip(), str(fields[2]).strip(),
+                                        str(fields[3]).strip().lower())
+            continue
+        # Not a whole contact: take what is there and let validation report the rest
+        try:
+            contact = loads(line)
+        except ValueError:
+            yield line_num, None
+            continue
+        yield line_num, make_record(
+            str(contact.get('name', '')).strip(),
+            str(contact.get('phone', '')).strip(),
+            str(contact.get('email', '')).strip(),
+            str(contact.get('type', '')).strip().lower()
+        )
+
+
+def _unfold(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Join vCard continuation lines (starting with a space or tab)"""
+    pending = None
+    pending_num = 0
+    for line_num, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending_num, pending
+        pending, pending_num = line, line_num
+    if pending is not None:
+        yield pending_num, pending
+
+
+def _vcard_unescape(value: str) -> str:
+    """Undo _vcard_escape in one pass, so an escaped backslash never starts another escape"""
+    return _VCARD_ESCAPE.sub(lambda m: _VCARD_UNESCAPED.get(m.group(1), m.group(1)), value)
+
+
+def _vcard_phone(value: str) -> str:
+    """A TEL value as the 10 digits the input form takes: "+91 98765-43210" -> "9876543210".
+
+    Formatting, a tel: URI prefix and a country or trunk prefix are dropped;
+    anything else is kept as written, for validation to report.
+    """
+    phone = value.strip()
+    if phone[:4].lower() == 'tel:':
+        phone = phone[4:]
+    phone = phone.translate(_PHONE_FORMATTING)
+    digits = phone[1:] if phone.startswith('+') else phone
+    return normalize_phone(digits) if digits.isdigit() else phone
+
+
+def parse_vcard(lines: Iterable[str]) -> Iterator[Tuple[int, Record]]:
+    """vCard 3/4: FN, the first TEL and EMAIL, and CATEGORIES (or X-CONTACT-TYPE) as type"""
+    card: Optional[Dict[str, str]] = None
+    start = 0
+    for line_num, line in _unfold(lines):
+        prop, _, value = line.partition(':')
+        name = prop.split(';', 1)[0].upper()
+        if name == 'BEGIN' and value.upper() == 'VCARD':
+            card, start = {}, line_num
+        elif name == 'END' and card is not None:
+            yield start, make_record(
+                card.get('FN', '').strip(),
+                _vcard_phone(card.get('TEL', '')),
+                card.get('EMAIL', '').strip(),
+                (card.get('X-CONTACT-TYPE') or card.get('CATEGORIES', '').split(',')[0]).strip().lower()
+            )
+            card = None
+        elif card is not None and name not in card:
+            card[name] = _vcard_unescape(value)
+
+
+def parse_binary(chunks: Iterable[bytes]) -> Iterator[Tuple[int, Record]]:
+    """Records written by BinaryRecords (see codec.py), numbered from 1 instead of lines.
+
+    Raises ValueError if the file does not start with BinaryRecords.MAGIC.
+    """
+    records = BinaryRecords()
+    data = b''
+    started = False
+    record_num = 0
+    for chunk in chunks:
+        data += chunk
+        if not started:
+            if len(data) < len(records.MAGIC):
+                continue
+            if not data.startswith(records.MAGIC):
+                raise ValueError("Not a binary contacts file")
+            data = data[len(records.MAGIC):]
+            started = True
+        offset = 0
+        for offset, (name, phone, email, contact_type) in records.decode_many(data):
+            record_num += 1
+            yield record_num, make_record(name.strip(), phone.strip(), email.strip(), contact_type.strip().lower())
+        # A record cut by the chunk boundary is completed by the next chunk
+        data = data[offset:]
+    if not started:
+        raise ValueError("Not a binary contacts file")
+    if data:
+        raise ValueError("Binary contacts file is truncated")
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'vcard': parse_vcard,
+    'jsonl': parse_jsonl,
+    'binary': parse_binary,
+}
+
+
+@dataclass
+class ImportStats:
+    """Running totals for one import"""
+    read: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    batches: int = 0
+    bytes_read: int = 0
+    total_bytes: int = 0
+    seconds: float = 0.0
+    # First few (line number, message) pairs for rejected rows
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+    @property
+    def progress(self) -> float:
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+
+    def summary(self) -> str:
+        return (f"Imported {self.imported} contacts ({self.duplicates} duplicates, "
+                f"{self.invalid} invalid) from {self.read} rows "
+                f"at {self.rows_per_second:,.0f} rows/sec")
+
+
+MAX_REPORTED_ERRORS = 100
+
+
+def iter_import(path: str, service: ContactService, fmt: Optional[str] = None,
+                batch_size: int = 5000) -> Iterator[ImportStats]:
+    """Stream contacts from a file into a ContactService.
+
+    Rows are validated with the same rules as the input form and skipped
+    when their (name, phone) is already in the store or earlier in the
+    file. Accepted rows are committed in batches through
+    ``service.add_many`` (one write per category file per batch, undone as
+    one operation). Batches grow with the number of contacts already
+    imported, so backends that rewrite a whole category file per batch
+    stay linear overall. Yields the running stats after every batch, so
+    callers can show progress. A batch that cannot be saved raises
+    ContactError and is left out of the store; the batches before it stay.
+    """
+    fmt = fmt or detect_format(path)
+    parse = PARSERS[fmt]
+    stats = ImportStats(total_bytes=os.path.getsize(path))
+    start = time.perf_counter()
+    contact_types = service.contact_types
+
+    binary = fmt in BINARY_FORMATS
+    with open(path, 'rb') if binary else open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = ProgressChunks(f) if binary else ProgressLines(f)
+        batch: List[Record] = []
+        # (name, phone) of the batch, which is not in the store until it is saved
+        batch_keys = set()
+        for line_num, record in parse(lines):
+            stats.read += 1
+            error = "Invalid JSON" if record is None else validate_contact(
+                record['name'], record['phone'], record['email'], record['type'], contact_types)
+            if error:
+                stats.invalid += 1
+                if len(stats.errors) < MAX_REPORTED_ERRORS:
+                    stats.errors.append((line_num, error))
+                continue
+
+            key = (record['name'], record['phone'])
+            if key in batch_keys or service.store.find(*key):
+                stats.duplicates += 1
+                continue
+            batch_keys.add(key)
+            batch.append(record)
+
+            if len(batch) >= max(batch_size, stats.imported // 4):
+                service.add_many(batch)
+                stats.imported += len(batch)
+                stats.batches += 1
+                batch = []
+                batch_keys.clear()
+                stats.bytes_read = lines.bytes_read
+                stats.seconds = time.perf_counter() - start
+                yield stats
+
+        if batch:
+            service.add_many(batch)
+            stats.imported += len(batch)
+            stats.batches += 1
+        service.storage.flush()
+        stats.bytes_read = stats.total_bytes
+        stats.seconds = time.perf_counter() - start
+        yield stats
+
+
+# Writers: one function per format, each takes the open file and contacts
+
+def _write_csv(f: TextIO, contacts: Iterable) -> Iterator[int]:
+    writer = csv.writer(f)
+    writer.writerow(['name', 'phone', 'email', 'type'])
+    for count, contact in enumerate(contacts, 1):
+        writer.writerow([contact.name, contact.phone, contact.email, contact.contact_type])
+        yield count
+
+
+def _vcard_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;').replace('\n', '\\n')
+
+
+def _write_vcard(f: TextIO, contacts: Iterable) -> Iterator[int]:
+    for count, contact in enumerate(contacts, 1):
+        f.write("BEGIN:VCARD\r\nVERSION:3.0\r\n")
+        f.write(f"FN:{_vcard_escape(contact.name)}\r\n")
+        f.write(f"N:{_vcard_escape(contact.name)};;;;\r\n")
+        f.write(f"TEL;TYPE=CELL:{contact.phone}\r\n")
+        if contact.email:
+            f.write(f"EMAIL:{_vcard_escape(contact.email)}\r\n")
+        f.write(f"CATEGORIES:{_vcard_escape(contact.contact_type)}\r\n")
+        f.write("END:VCARD\r\n")
+        yield count
+
+
+def _write_jsonl(f: TextIO, contacts: Iterable) -> Iterator[int]:
+    encode = _codec.encode
+    for count, contact in enumerate(contacts, 1):
+        f.write(encode(contact.name, contact.phone, contact.email, contact.contact_type) + '\n')
+        yield count
+
+
+def _write_binary(f: BinaryIO, contacts: Iterable) -> Iterator[int]:
+    records = BinaryRecords()
+    f.write(records.MAGIC)
+    for count, contact in enumerate(contacts, 1):
+        f.write(records.encode(contact.name, contact.phone, contact.email, contact.contact_type))
+        yield count
+
+
+WRITERS = {
+    'csv': _write_csv,
+    'vcard': _write_vcard,
+    'jsonl': _write_jsonl,
+    'binary': _write_binary,
+}
+
+
+def iter_export(path: str, contacts: Iterable, fmt: Optional[str] = None,
+                chunk: int = 10000) -> Iterator[int]:
+    """Stream contacts (e.g. a ContactStore in name order) to a file.
+
+    Yields the number of contacts written every ``chunk`` rows and once at
+    the end.
+    """
+    fmt = fmt or detect_format(path)
+    count = 0
+    binary = fmt in BINARY_FORMATS
+    with open(path, 'wb') if binary else open(path, 'w', encoding='utf-8', newline='') as f:
+        for count in WRITERS[fmt](f, contacts):
+            if count % chunk == 0:
+                yield count
+    yield count
@@ -0,0 +1,459 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Optional, Callable, Dict, Iterable, List, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): only one instance should use a directory
+    fcntl = None
+
+from instrumentation import metrics
+from storage import Change, Record, atomic_write_lines, fsync_directory
+
+logger = logging.getLogger(__name__)
+
+FEED_NAME = 'changes.log'
+# This store's node ID and the watermark of every store it pulled from
+REPLICA_NAME = '.replica.json'
+# close() compacts the log once it holds this many entries, and twice as many as contacts
+COMPACT_MIN_ENTRIES = 1000
+# Contacts stored before the feed recorded a change to them get IDs derived from (name, phone)
+ID_NAMESPACE = uuid.UUID('5b0c7e2e-8f4a-4c61-9d3e-3a1f6c2b9e47')
+
+# (name, phone) of a contact, stripped as ContactStore keys it
+Key = Tuple[str, str]
+
+
+def contact_key(record: Record) -> Key:
+    return str(record['name']).strip(), str(record['phone']).strip()
+
+
+def derived_id(key: Key) -> str:
+    """The ID of a contact stored as key before any change to it was recorded"""
+    return uuid.uuid5(ID_NAMESPACE, '\n'.join(key)).hex
+
+
+def _rank(version: int, node: str, record: Optional[Record]) -> Tuple:
+    """Order of two versions of a contact: the higher one wins.
+
+    At equal (version, node) a deletion wins, which is how a contact that
+    lost its name and phone to another is retired (see ChangeFeed.resolve).
+    Otherwise equal stamps only happen for contacts that were in two
+    stores before either recorded a change; the fields decide then, so
+    both stores pick the same one.
+    """
+    return version, node, record is None, '' if record is None else json.dumps(record, sort_keys=True)
+
+
+@dataclass
+class FeedEntry:
+    """One recorded change: contact ``id`` became ``record`` (None: deleted).
+
+    ``version`` and ``node`` stamp the change where it was made and travel
+    with it to other stores. ``born`` is the (name, phone) a derived ID
+    was made from, so a store that never saw that contact change can still
+    find it. ``via`` is the node of the store it was pulled from, which
+    has it already. ``seq`` is the entry's position in the feed it was
+    read from.
+    """
+    id: str
+    version: int
+    node: str
+    record: Optional[Record]
+    born: Optional[Key] = None
+    via: Optional[str] = None
+    seq: int = 0
+
+    def rank(self) -> Tuple:
+        return _rank(self.version, self.node, self.record)
+
+    def to_json(self) -> str:
+        entry = {'seq': self.seq, 'id': self.id, 'version': self.version, 'node': self.node,
+                 'record': self.record}
+        if self.born is not None:
+            entry['born'] = list(self.born)
+        if self.via is not None:
+            entry['via'] = self.via
+        return json.dumps(entry)
+
+    @classmethod
+    def from_json(cls, line: str) -> 'FeedEntry':
+        entry = json.loads(line)
+        born = entry.get('born')
+        return cls(entry['id'], entry['version'], entry['node'], entry['record'],
+                   tuple(born) if born else None, entry.get('via'), entry['seq'])
+
+
+class ChangeFeed:
+    """The change feed of a contact directory: every add, update and delete,
+    appended to ``changes.log`` as the ContactService makes it.
+
+    Each contact has a stable ID, kept through renames and type changes:
+    a random one from its first add, or for a contact stored before the
+    feed recorded a change to it, one derived from its (name, phone) (so
+    copies of one directory agree on them). Every change gets a version
+    greater than any the feed has seen: the time in microseconds, or one
+    more, so versions only grow and roughly follow the clock across
+    machines. Of two versions of a contact the higher one wins, ties going
+    to the higher node ID.
+
+    Entries are numbered by ``seq``. A store pulling from this one keeps
+    the last seq it applied (its watermark, in its own ``.replica.json``)
+    and next time reads only the entries after it, found through their
+    byte offsets. The feed keeps the latest entry of every contact it has
+    recorded, so memory grows with the contacts changed, not those stored.
+    A pull only reads the latest entry of each contact either, so ``compact``
+    can drop every older one from the log, keeping the seqs of the rest;
+    ``close`` does when most of the log is superseded, so the log and the
+    time reading it at startup grow with the contacts changed, not the
+    changes. Several processes may share the directory: appends hold an
+    fcntl lock on the log and first read what the others appended, and a
+    log compacted by another process is read again from the start.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, FEED_NAME)
+        self._replica_path = os.path.join(directory, REPLICA_NAME)
+        # RLock: resolve and append run inside locked()
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        # Latest entry per contact ID, and the ID of every (name, phone) stored under one
+        self._entries: Dict[str, FeedEntry] = {}
+        self._ids: Dict[Key, str] = {}
+        # Seq and byte offset of every entry in the log, in order
+        self._seqs = array('Q')
+        self._offsets = array('Q')
+        self._size = 0
+        self._clock = 0
+        os.makedirs(directory, exist_ok=True)
+        with self.locked():
+            self.node = self._read_replica().get('node')
+            if self.node is None:
+                self.node = uuid.uuid4().hex
+                self._write_replica({'node': self.node, 'peers': {}})
+
+    @property
+    def seq(self) -> int:
+        """The last entry read or written so far"""
+        return self._seqs[-1] if self._seqs else 0
+
+    # Locking and reading
+
+    @contextmanager
+    def locked(self):
+        """Hold the feed against other threads and processes, caught up with their appends"""
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth == 1:
+                    self._acquire()
+                try:
+                    self._catch_up()
+                    yield
+                finally:
+                    if self._depth == 1 and fcntl is not None:
+                        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._depth -= 1
+
+    def _acquire(self):
+        while True:
+            if self._file is None:
+                self._file = open(self.path, 'a+b')
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if not replaced:
+                return
+            # Compacted since we opened it: start over on the new log
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+            self._entries, self._ids = {}, {}
+            self._seqs, self._offsets = array('Q'), array('Q')
+            self._size = 0
+
+    def refresh(self) -> int:
+        """Read what other processes appended, returns the last seq"""
+        with self.locked():
+            return self.seq
+
+    def _catch_up(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self._size)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn append of a crashed writer, cut off by the next append
+                    break
+                try:
+                    entry = FeedEntry.from_json(line.decode('utf-8'))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error("Skipped change %d of %s: %s", self.seq + 1, self.path, e)
+                    entry = None
+                self._seqs.append(entry.seq if entry is not None else self.seq + 1)
+                self._offsets.append(self._size)
+                self._size += len(line)
+                if entry is not None:
+                    self._index(entry)
+
+    def _index(self, entry: FeedEntry):
+        previous = self._entries.get(entry.id)
+        if previous is not None and previous.record is not None:
+            key = contact_key(previous.record)
+            if self._ids.get(key) == entry.id:
+                del self._ids[key]
+        self._entries[entry.id] = entry
+        if entry.record is not None:
+            self._ids[contact_key(entry.record)] = entry.id
+        self._clock = max(self._clock, entry.version)
+
+    def contact_id(self, name: str, phone: str) -> Tuple[str, int]:
+        """ID and version of the contact stored as (name, phone); version 0 if
+        no change to it was recorded yet"""
+        key = (str(name).strip(), str(phone).strip())
+        with self._lock:
+            contact_id = self._ids.get(key)
+            if contact_id is None:
+                return derived_id(key), 0
+            return contact_id, self._entries[contact_id].version
+
+    def changes_since(self, seq: int, node: Optional[str] = None) -> List[FeedEntry]:
+        """The latest entry of every contact changed after seq, in feed order,
+        leaving out those pulled from node (it has them). Reads only the
+        entries after seq: the cost grows with the changes, not the contacts."""
+        with self.locked():
+            if seq >= self.seq:
+                return []
+            latest: Dict[str, FeedEntry] = {}
+            # The first entry after seq: a compacted log has gaps
+            first = bisect.bisect_right(self._seqs, seq)
+            with open(self.path, 'rb') as f:
+                f.seek(self._offsets[first])
+                for _ in range(len(self._seqs) - first):
+                    line = f.readline()
+                    try:
+                        entry = FeedEntry.from_json(line.decode('utf-8'))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    latest.pop(entry.id, None)
+                    latest[entry.id] = entry
+        entries = [entry for entry in latest.values() if node is None or entry.via != node]
+        metrics.count('feed_entries_read', len(entries))
+        return entries
+
+    def baseline(self, records: Iterable[Record]) -> List[FeedEntry]:
+        """Entries for the stored contacts no recorded change covers, at version 0,
+        so a first pull also sees what was stored before the feed started"""
+        with self._lock:
+            return [FeedEntry(derived_id(key), 0, '', record, key)
+                    for record in records
+                    for key in [contact_key(record)] if key not in self._ids]
+
+    # Writing
+
+    def record(self, changes: Iterable[Change]) -> List[FeedEntry]:
+        """Stamp and append changes made to this store, returns their entries"""
+        with self.locked():
+            entries = []
+            for old, new in changes:
+                if old is None:
+                    contact_id, born = uuid.uuid4().hex, None
+                else:
+                    key = contact_key(old)
+                    contact_id = self._ids.get(key)
+                    born = self._entries[contact_id].born if contact_id is not None else key
+                    contact_id = contact_id or derived_id(key)
+                self._clock = max(time.time_ns() // 1000, self._clock + 1)
+                entries.append(FeedEntry(contact_id, self._clock, self.node, new, born))
+            self.append(entries)
+        return entries
+
+    def append(self, entries: List[FeedEntry]):
+        """Append entries as they are, e.g. pulled ones keeping their versions"""
+        if not entries:
+            return
+        with self.locked():
+            if os.fstat(self._file.fileno()).st_size != self._size:
+                self._file.truncate(self._size)
+            lines = []
+            for entry in entries:
+                entry.seq = self.seq + 1
+                line = (entry.to_json() + '\n').encode('utf-8')
+                self._seqs.append(entry.seq)
+                self._offsets.append(self._size)
+                self._size += len(line)
+                self._index(entry)
+                lines.append(line)
+            data = b''.join(lines)
+            self._file.write(data)
+            self._file.flush()
+        metrics.count('bytes_written', len(data))
+
+    def resolve(self, entries: Iterable[FeedEntry], lookup: Callable[[Key], Optional[Record]],
+                via: Optional[str] = None) -> Tuple[List[Change], List[FeedEntry]]:
+        """Decide which entries pulled from node via win over this store's
+        contacts; call under locked().
+
+        lookup returns the stored contact of a (name, phone), if any. Returns
+        the (old, new) changes bringing the store up to date, one per
+        contact, and the entries to append once they are applied: the
+        winners, and a deletion of each contact whose name and phone
+        another took. Of two contacts with the same name and phone the
+        later version keeps them; the other is deleted at its own version,
+        so a later change to it elsewhere (say, a rename) still wins.
+        """
+        merge = _Merge(self, lookup, via)
+        for entry in entries:
+            merge.pull(entry)
+        changes = [(merge.before[contact_id], record) for contact_id, record in merge.after.items()
+                   if merge.before[contact_id] != record]
+        return changes, merge.accepted
+
+    # Watermarks
+
+    def _read_replica(self) -> Dict:
+        try:
+            with open(self._replica_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error("Error reading %s: %s", self._replica_path, e)
+            return {}
+
+    def _write_replica(self, replica: Dict):
+        atomic_write_lines(self._replica_path, [json.dumps(replica)])
+
+    def watermark(self, node: str) -> Optional[int]:
+        """The last seq of node's feed this store applied, None if it never pulled from it"""
+        return self._read_replica().get('peers', {}).get(node)
+
+    def set_watermark(self, node: str, seq: int):
+        with self.locked():
+            replica = self._read_replica()
+            replica['node'] = self.node
+            replica.setdefault('peers', {})[node] = seq
+            self._write_replica(replica)
+
+    def flush(self):
+        """Make every entry appended so far durable"""
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                fsync_directory(self.directory)
+
+    def compact(self):
+        """Rewrite the log with only the latest entry of every contact.
+
+        Entries keep their seqs, and a pull reads only the latest entry of
+        each contact after its watermark anyway, so every store pulling from
+        this one gets the same changes as before, whatever its watermark.
+        """
+        with self.locked():
+            entries = sorted(self._entries.values(), key=attrgetter('seq'))
+            before = len(self._seqs)
+            atomic_write_lines(self.path, (entry.to_json() for entry in entries))
+        logger.info("Compacted %s from %d to %d entries", self.path, before, len(entries))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and len(self._seqs) >= max(COMPACT_MIN_ENTRIES, 2 * len(self._entries)):
+                try:
+                    self.compact()
+                except OSError as e:
+                    logger.error("Error compacting %s: %s", self.path, e)
+            if self._file is not None:
+                self.flush()
+                self._file.close()
+                self._file = None
+
+
+class _Merge:
+    """The state of a feed as pulled entries are resolved, before any is applied"""
+    def __init__(self, feed: ChangeFeed, lookup: Callable[[Key], Optional[Record]], via: Optional[str]):
+        self.feed = feed
+        self.lookup = lookup
+        self.via = via
+        self.entries: Dict[str, FeedEntry] = {}
+        self.ids: Dict[Key, Optional[str]] = {}
+        # Stored contact of each changed ID before the merge, and after it
+        self.before: Dict[str, Optional[Record]] = {}
+        self.after: Dict[str, Optional[Record]] = {}
+        self.accepted: List[FeedEntry] = []
+
+    def entry(self, contact_id: str) -> Optional[FeedEntry]:
+        return self.entries.get(contact_id) or self.feed._entries.get(contact_id)
+
+    def stored(self, contact_id: str, born: Optional[Key]) -> Optional[Record]:
+        """The stored contact with this ID, as it was before the merge"""
+        entry = self.feed._entries.get(contact_id)
+        if entry is not None:
+            return self.lookup(contact_key(entry.record)) if entry.record is not None else None
+        if born is not None and self.feed._ids.get(born) is None and derived_id(born) == contact_id:
+            return self.lookup(born)
+        return None
+
+    def current(self, contact_id: str, born: Optional[Key]) -> Optional[FeedEntry]:
+        """The contact's version here, None if unknown"""
+        entry = self.entry(contact_id)
+        if entry is not None:
+            return entry
+        record = self.stored(contact_id, born)
+        return FeedEntry(contact_id, 0, '', record, born) if record is not None else None
+
+    def holder(self, key: Key) -> Optional[str]:
+        """ID of the contact stored as key here"""
+        if key in self.ids:
+            return self.ids[key]
+        contact_id = self.feed._ids.get(key)
+        if contact_id is None and self.lookup(key) is not None:
+            contact_id = derived_id(key)
+        return contact_id
+
+    def pull(self, entry: FeedEntry):
+        current = self.current(entry.id, entry.born)
+        if current is not None and (current.version, current.node, current.record) == \
+                (entry.version, entry.node, entry.record):
+            # Already here, as every untouched contact of a first pull is
+            return
+        if current is not None and entry.rank() <= current.rank():
+            return
+        entry.via = self.via
+        if entry.record is not None:
+            key = contact_key(entry.record)
+            other = self.holder(key)
+            if other is not None and other != entry.id:
+                holder = self.current(other, key)
+                if holder is not None and holder.rank() > entry.rank():
+                    # The contact stored as (name, phone) is the later one: the pulled one is retired
+                    entry = FeedEntry(entry.id, entry.version, entry.node, None, entry.born)
+                elif holder is not None:
+                    self.accept(FeedEntry(other, holder.version, holder.node, None, holder.born))
+        self.accept(entry)
+
+    def accept(self, entry: FeedEntry):
+        if entry.id not in self.before:
+            self.before[entry.id] = self.stored(entry.id, entry.born)
+        previous = self.after.get(entry.id, self.before[entry.id])
+        if previous is not None and self.holder(contact_key(previous)) == entry.id:
+            self.ids[contact_key(previous)] = None
+        if entry.record is not None:
+            self.ids[contact_key(entry.record)] = entry.id
+        self.after[entry.id] = entry.record
+        self.entries[entry.id] = entry
+        self.accepted.append(entry)
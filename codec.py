@@ -0,0 +1,150 @@
+import json
+import struct
+from json.encoder import encode_basestring_ascii
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    # Optional: the standard library parser is used instead
+    orjson = None
+
+Record = Dict[str, str]
+# name, phone, email, type of one contact
+Fields = Tuple[str, str, str, str]
+_KEYS = ('name', 'phone', 'email', 'type')
+
+# Parse any JSON text, with orjson when it is installed
+loads = orjson.loads if orjson is not None else json.loads
+
+_TEMPLATE = '{"name": %s, "phone": %s, "email": %s, "type": %s}'
+# The text around the strings of a line written by json.dumps(make_record(...))
+_SEPARATORS = ('{', ': ', ', ', ': ', ', ', ': ', ', ', ': ')
+
+
+class RecordCodec:
+    """Turns contacts into category file lines and back, with the standard json module.
+
+    Lines are the JSON objects ``{"name", "phone", "email", "type"}`` the
+    files have always held, whatever the codec: codecs differ in speed,
+    not format, and every codec reads what any other wrote.
+    """
+    name = 'json'
+
+    def encode(self, name: str, phone: str, email: str, contact_type: str) -> str:
+        """One contact as a line, without the newline"""
+        return json.dumps({'name': name, 'phone': phone, 'email': email, 'type': contact_type})
+
+    def encode_record(self, record: Record) -> str:
+        return self.encode(record['name'], record['phone'], record.get('email', ''), record['type'])
+
+    def decode(self, line: str) -> Optional[Fields]:
+        """The fields of one line, None if it is not a contact (email defaults to '')"""
+        return self._decode_json(json.loads, line)
+
+    @staticmethod
+    def _decode_json(parse, line: str) -> Optional[Fields]:
+        try:
+            record = parse(line)
+            fields = record['name'], record['phone'], record.get('email', ''), record['type']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return fields if isinstance(fields[0], str) else None
+
+    def decode_record(self, line: str) -> Optional[Record]:
+        fields = self.decode(line)
+        return None if fields is None else dict(zip(_KEYS, fields))
+
+
+class FieldCodec(RecordCodec):
+    """Schema-aware codec for the four contact fields, no dicts in between.
+
+    Encoding fills a fixed template with the C string escaper json.dumps
+    itself uses, so lines come out byte for byte as ``json.dumps`` writes
+    them. Decoding splits a line at its quotes: if it has exactly that
+    shape and no escapes, the four values are read straight out of it;
+    any other line (escaped characters, other key order, extra keys) is
+    parsed as JSON.
+    """
+    name = 'fields'
+
+    def encode(self, name: str, phone: str, email: str, contact_type: str) -> str:
+        return _TEMPLATE % (encode_basestring_ascii(name), encode_basestring_ascii(phone),
+                            encode_basestring_ascii(email), encode_basestring_ascii(contact_type))
+
+    def decode(self, line: str) -> Optional[Fields]:
+        parts = line.split('"')
+        if len(parts) == 17 and '\\' not in line:
+            (s0, name_key, s1, name, s2, phone_key, s3, phone, s4, email_key, s5, email, s6, type_key, s7,
+             contact_type, end) = parts
+            if (name_key == 'name' and phone_key == 'phone' and email_key == 'email' and type_key == 'type'
+                    and (s0, s1, s2, s3, s4, s5, s6, s7) == _SEPARATORS and end.rstrip() == '}'):
+                return name, phone, email, contact_type
+        return self._decode_json(loads, line)
+
+
+class FastJsonCodec(FieldCodec):
+    """FieldCodec that parses every line with orjson, faster still where it is installed.
+
+    Lines are still written by the template: orjson's compact output would
+    differ byte for byte from the lines already in the files.
+    """
+    name = 'fast'
+
+    def decode(self, line: str) -> Optional[Fields]:
+        if orjson is None:
+            return super().decode(line)
+        return self._decode_json(orjson.loads, line)
+
+
+CODECS = {codec.name: codec for codec in (RecordCodec, FieldCodec, FastJsonCodec)}
+DEFAULT_CODEC = 'fast' if orjson is not None else 'fields'
+
+
+def get_codec(name: str = DEFAULT_CODEC) -> RecordCodec:
+    """A codec by name: json (the json module), fields (schema-aware) or fast (fields plus orjson)"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown record codec '{name}', use one of {', '.join(CODECS)}")
+    return CODECS[name]()
+
+
+class BinaryRecords:
+    """Compact binary contact records, for export files.
+
+    Each record is a 6-byte header with the UTF-8 length of each field
+    (name and email up to 65535 bytes, phone and type up to 255), then
+    the four fields' bytes. A file starts with MAGIC.
+    """
+    MAGIC = b'CNTREC1\n'
+    _HEADER = struct.Struct('<HBHB')
+
+    def encode(self, name: str, phone: str, email: str, contact_type: str) -> bytes:
+        """One record; raises ValueError if a field is too long"""
+        fields = [name.encode('utf-8'), phone.encode('utf-8'), email.encode('utf-8'),
+                  contact_type.encode('utf-8')]
+        try:
+            header = self._HEADER.pack(*map(len, fields))
+        except struct.error:
+            raise ValueError(f"Contact '{name}' has a field too long for a binary record")
+        return header + b''.join(fields)
+
+    def encode_many(self, contacts: Iterable[Fields]) -> bytes:
+        return b''.join(self.encode(*fields) for fields in contacts)
+
+    def decode_many(self, data: bytes, offset: int = 0) -> Iterator[Tuple[int, Fields]]:
+        """(offset after, fields) of every whole record in data from offset on"""
+        header = self._HEADER
+        size = header.size
+        end = len(data)
+        while offset + size <= end:
+            lengths = header.unpack_from(data, offset)
+            start = offset + size
+            stop = start + sum(lengths)
+            if stop > end:
+                return
+            fields: List[str] = []
+            for length in lengths:
+                fields.append(data[start:start + length].decode('utf-8'))
+                start += length
+            offset = stop
+            yield offset, tuple(fields)
@@ -1,96 +1,70 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, font
+from tkinter import ttk, messagebox, font, filedialog, simpledialog
 import os
-import json
-from typing import Optional, Dict, List
+import argparse
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from operator import attrgetter
+from typing import Optional, Dict
 
-class ContactNode:
-    """Node for linked list implementation"""
-    def __init__(self, name: str, phone: str, email: str, contact_type: str):
-        self.name = name
-        self.phone = phone
-        self.email = email
-        self.contact_type = contact_type
-        self.next: Optional['ContactNode'] = None
+from contact_store import ContactNode, ContactQuery
+from contact_service import ContactError, ContactService, PagedContactService
+from contact_server import ContactServer
+from change_feed import ChangeFeed
+from blockfile import COMPRESSIONS
+from storage import JsonLinesStorage, JournalStorage, SqliteStorage, migrate
+from write_behind import WriteBehindStorage
+from virtual_list import VirtualTreeview
+from query_scheduler import QueryScheduler
+from bulk_io import FORMATS, iter_import, iter_export
+from instrumentation import ProfileCapture, metrics
 
-class ContactLinkedList:
-    """Linked list to store contacts in alphabetical order"""
-    def __init__(self):
-        self.head: Optional[ContactNode] = None
-    
-    def insert(self, name: str, phone: str, email: str, contact_type: str):
-        """Insert contact in alphabetical order"""
-        new_node = ContactNode(name, phone, email, contact_type)
-        
-        if not self.head or self.head.name.lower() > name.lower():
-            new_node.next = self.head
-            self.head = new_node
-            return
-        
-        current = self.head
-        while current.next and current.next.name.lower() < name.lower():
-            current = current.next
-        
-        new_node.next = current.next
-        current.next = new_node
-    
-    def delete(self, name: str, phone: str) -> bool:
-        """Delete contact by name and phone"""
-        if not self.head:
-            return False
-        
-        # Convert to strings and strip for comparison
-        search_name = str(name).strip()
-        search_phone = str(phone).strip()
-        
-        # Check head node
-        if (str(self.head.name).strip() == search_name and 
-            str(self.head.phone).strip() == search_phone):
-            self.head = self.head.next
-            return True
-        
-        current = self.head
-        while current.next:
-            if (str(current.next.name).strip() == search_name and 
-                str(current.next.phone).strip() == search_phone):
-                current.next = current.next.next
-                return True
-            current = current.next
-        
-        return False
-    
-    def find(self, name: str, phone: str) -> Optional[ContactNode]:
-        """Find contact by name and phone"""
-        current = self.head
-        while current:
-            # Convert to strings and strip for comparison
-            if (str(current.name).strip() == str(name).strip() and 
-                str(current.phone).strip() == str(phone).strip()):
-                return current
-            current = current.next
-        return None
-    
-    def get_all_contacts(self) -> List[ContactNode]:
-        """Get all contacts as a list"""
-        contacts = []
-        current = self.head
-        while current:
-            contacts.append(current)
-            current = current.next
-        return contacts
+logger = logging.getLogger(__name__)
 
 class ContactManager:
-    def __init__(self, root):
+    # How often to look for contact files changed by another instance
+    POLL_MS = 1000
+    # How often an open stats panel redraws
+    STATS_MS = 1000
+    # How often to check whether lazy mode has finished indexing
+    INDEXING_MS = 50
+    # How often the status bar shows whether background writes are saved
+    DURABILITY_MS = 250
+    
+    def __init__(self, root, storage=None, debug=False, service=None, lazy=False, feed=None):
         self.root = root
         self.root.title("Contact Management System")
         self.root.geometry("900x700")
         self.root.configure(bg='#2c3e50')
         
-        # Contact types
-        self.contact_types = ['college', 'family', 'colleague', 'friend', 'neighbour', 'relatives']
+        # Headless core: validation, changes, search and storage. The storage
+        # backend defaults to the JSON-lines category files; in lazy mode
+        # contacts stay in them and are paged in as they are shown
+        storage = storage or JsonLinesStorage('contacts')
+        self.lazy = lazy
+        self.service = service or (PagedContactService(storage, feed=feed) if lazy
+                                   else ContactService(storage, feed=feed))
+        self.storage = self.service.storage
+        
+        # Contact types: the built-in ones, or those saved in contacts/types.json
+        self.contact_types = self.service.contact_types
+        
+        # Indexed store for contacts (sorted by name, hashed on name + phone)
+        self.contact_list = self.service.store
+        
+        # Show the treeview render time in the status bar
+        self.debug = debug
+        self.frame_ms = 0.0
+        
+        # Opt-in cProfile/tracemalloc capture, toggled from the stats panel
+        self.profiler = ProfileCapture()
+        self.stats_dialog = None
         
-        # Linked list for contacts
-        self.contact_list = ContactLinkedList()
+        # Search and filter run debounced on a worker thread
+        self.scheduler = QueryScheduler(self.root)
         
         # Create directories if they don't exist
         self.create_directories()
@@ -103,6 +77,15 @@ class ContactManager:
         
         # Load contacts into treeview
         self.refresh_contact_display()
+        
+        # Watch for categories changed by another instance on the same files
+        self._poll_id = self.root.after(self.POLL_MS, self.poll_changes)
+        
+        # With write-behind storage, show whether edits have reached the files
+        self._durability_id = None
+        if isinstance(self.storage, WriteBehindStorage):
+            self.poll_durability()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def create_directories(self):
         """Create directories for storing contact files"""
@@ -123,6 +106,31 @@ class ContactManager:
         style.configure('Custom.TCombobox', fieldbackground='#ecf0f1', font=('Arial', 10))
         style.configure('Custom.TButton', font=('Arial', 10, 'bold'))
         
+        # Menu bar
+        menubar = tk.Menu(self.root)
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Import Contacts...", command=self.import_contacts)
+        file_menu.add_command(label="Export Shown Contacts...", command=self.export_contacts)
+        file_menu.add_command(label="Duplicate Report...", command=self.show_duplicate_report)
+        file_menu.add_command(label="Performance Stats...", command=self.show_stats)
+        file_menu.add_separator()
+        file_menu.add_command(label="Exit", command=self.root.destroy)
+        menubar.add_cascade(label="File", menu=file_menu)
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=self.undo)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=self.redo)
+        edit_menu.add_separator()
+        self.move_menu = tk.Menu(edit_menu, tearoff=0)
+        for contact_type in self.contact_types:
+            self.move_menu.add_command(label=contact_type,
+                                       command=lambda t=contact_type: self.retype_selected(t))
+        edit_menu.add_cascade(label="Move Selected To", menu=self.move_menu)
+        edit_menu.add_command(label="Add Contact Type...", command=self.add_contact_type)
+        menubar.add_cascade(label="Edit", menu=edit_menu)
+        self.root.config(menu=menubar)
+        self.root.bind('<Control-z>', lambda event: self.undo())
+        self.root.bind('<Control-y>', lambda event: self.redo())
+        
         # Main title
         title_label = ttk.Label(self.root, text="📞 Contact Management System", style='Title.TLabel')
         title_label.pack(pady=20)
@@ -191,9 +199,14 @@ class ContactManager:
         ttk.Label(search_frame, text="Search by Name", style='Heading.TLabel').pack(anchor='w')
         self.search_var = tk.StringVar()
         self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var, style='Custom.TEntry', width=25)
-        self.search_entry.pack(fill='x', pady=(5, 10))
+        self.search_entry.pack(fill='x', pady=(5, 0))
         self.search_entry.bind('<KeyRelease>', self.search_contacts)
         
+        # Typo-tolerant matching, ranked by closeness
+        self.fuzzy_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_frame, text="Allow typos", variable=self.fuzzy_var,
+                        command=self.filter_contacts).pack(anchor='w', pady=(5, 10))
+        
         # Filter by type
         ttk.Label(search_frame, text="Filter by Type", style='Heading.TLabel').pack(anchor='w')
         self.filter_var = tk.StringVar()
@@ -214,16 +227,23 @@ class ContactManager:
         
         # Treeview for contacts
         columns = ('Name', 'Phone', 'Email', 'Type')
-        self.tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=20)
+        # Ctrl/Shift-click selects several contacts for bulk delete, move and edit
+        self.tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=20,
+                                 selectmode='extended')
         
-        # Define headings
+        # Define headings; clicking one sorts by that column, again reverses it
         for col in columns:
-            self.tree.heading(col, text=col, anchor='w')
+            self.tree.heading(col, text=col, anchor='w', command=lambda c=col: self.sort_by(c.lower()))
             self.tree.column(col, width=120, anchor='w')
+        self.sort_column: Optional[str] = None
+        self.sort_descending = False
         
         # Scrollbar
-        scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar = ttk.Scrollbar(list_frame, orient='vertical')
+        
+        # Virtual list: only the rows in view exist as treeview items
+        self.view = VirtualTreeview(self.tree, scrollbar, self._row_values,
+                                    on_render=self._on_render)
         
         # Pack treeview and scrollbar
         self.tree.pack(side='left', fill='both', expand=True)
@@ -231,6 +251,7 @@ class ContactManager:
         
         # Bind double-click to edit
         self.tree.bind('<Double-1>', self.on_item_select)
+        self.tree.bind('<Delete>', lambda event: self.delete_contact())
         
         # Delete button
         delete_frame = ttk.Frame(right_frame)
@@ -240,157 +261,207 @@ class ContactManager:
                                     command=self.delete_contact, style='Custom.TButton')
         self.delete_btn.pack(side='right')
         
-        # Debug button (for testing)
-        self.debug_btn = ttk.Button(delete_frame, text="Debug Files", 
-                                   command=self.debug_files, style='Custom.TButton')
-        self.debug_btn.pack(side='right', padx=(0, 10))
+        # Timings and counters, see instrumentation.Metrics
+        self.stats_btn = ttk.Button(delete_frame, text="Stats", 
+                                   command=self.show_stats, style='Custom.TButton')
+        self.stats_btn.pack(side='right', padx=(0, 10))
         
-        # Status bar
+        # Status bar: messages on the left, whether changes are saved on the right
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side='bottom', fill='x')
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, 
+        self.durability_var = tk.StringVar()
+        durability_label = ttk.Label(status_frame, textvariable=self.durability_var, 
+                                     relief='sunken', anchor='e', background='#34495e', foreground='#ecf0f1')
+        durability_label.pack(side='right')
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, 
                               relief='sunken', anchor='w', background='#34495e', foreground='#ecf0f1')
-        status_bar.pack(side='bottom', fill='x')
+        status_bar.pack(side='left', fill='x', expand=True)
+    
+    def form_values(self):
+        """(name, phone, email, type) as entered in the form"""
+        return (
+            self.name_var.get().strip(),
+            self.phone_var.get().strip(),
+            self.email_var.get().strip(),
+            self.type_var.get().strip()
+        )
     
     def validate_input(self) -> bool:
         """Validate input fields"""
-        name = self.name_var.get().strip()
-        phone = self.phone_var.get().strip()
-        email = self.email_var.get().strip()
-        contact_type = self.type_var.get().strip()
-        
-        # Check required fields
-        if not name:
-            messagebox.showerror("Error", "Name is required!")
-            return False
-        
-        if not phone:
-            messagebox.showerror("Error", "Phone number is required!")
-            return False
-        
-        if not contact_type:
-            messagebox.showerror("Error", "Contact type is required!")
-            return False
-        
-        # Validate phone number
-        if len(phone) != 10 or not phone.isdigit():
-            messagebox.showerror("Error", "Phone number must be exactly 10 digits!")
-            return False
-        
-        # Validate email if provided
-        if email and '@' not in email:
-            messagebox.showerror("Error", "Email must contain '@' symbol!")
+        error = self.service.validate(*self.form_values())
+        if error:
+            messagebox.showerror("Error", error)
             return False
         
         return True
     
     def add_contact(self):
         """Add a new contact"""
-        if not self.validate_input():
-            return
-        
-        name = self.name_var.get().strip()
-        phone = self.phone_var.get().strip()
-        email = self.email_var.get().strip()
-        contact_type = self.type_var.get().strip()
+        name, phone, email, contact_type = self.form_values()
         
-        # Check if contact already exists
-        if self.contact_list.find(name, phone):
-            messagebox.showerror("Error", "Contact with this name and phone number already exists!")
+        # A query running against the old contents would show stale rows
+        self.scheduler.cancel()
+        try:
+            node = self.service.add(name, phone, email, contact_type)
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        # Add to linked list
-        self.contact_list.insert(name, phone, email, contact_type)
-        
-        # Save to file
-        self.save_contact_to_file(name, phone, email, contact_type)
-        
-        # Refresh display
-        self.refresh_contact_display()
+        # Patch the new row into the display
+        self.show_inserted(node)
         
         # Clear fields
         self.clear_fields()
         
-        self.status_var.set(f"Contact '{name}' added successfully!")
+        self.set_status(f"Contact '{name}' added successfully!")
     
     def update_contact(self):
         """Update selected contact"""
-        selected = self.tree.selection()
+        selected = self.view.selection()
         if not selected:
             messagebox.showerror("Error", "Please select a contact to update!")
             return
         
-        if not self.validate_input():
+        if len(selected) > 1:
+            self.edit_selected(selected)
             return
         
         # Get old contact data
-        item = self.tree.item(selected[0])
-        old_name, old_phone = item['values'][0], item['values'][1]
-        old_type = item['values'][3]
-        
-        # Get new data
-        new_name = self.name_var.get().strip()
-        new_phone = self.phone_var.get().strip()
-        new_email = self.email_var.get().strip()
-        new_type = self.type_var.get().strip()
-        
-        # Delete old contact
-        self.contact_list.delete(old_name, old_phone)
-        self.delete_contact_from_file(old_name, old_phone, old_type)
-        
-        # Add updated contact
-        self.contact_list.insert(new_name, new_phone, new_email, new_type)
-        self.save_contact_to_file(new_name, new_phone, new_email, new_type)
+        contact = selected[0]
+        old = self.contact_list.find(contact.name, contact.phone)
+        index = self.contact_list.index(old) if old else -1
         
-        # Refresh display
-        self.refresh_contact_display()
+        # Replace old contact with the form's data
+        self.scheduler.cancel()
+        try:
+            node = self.service.update(contact.name, contact.phone, *self.form_values())
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.show_deleted(index, old)
+        self.show_inserted(node)
         
         # Clear fields
         self.clear_fields()
         
-        self.status_var.set(f"Contact updated successfully!")
+        self.set_status(f"Contact updated successfully!")
     
     def delete_contact(self):
         """Delete selected contact"""
-        selected = self.tree.selection()
+        selected = self.view.selection()
         if not selected:
             messagebox.showerror("Error", "Please select a contact to delete!")
             return
         
+        if len(selected) > 1:
+            if messagebox.askyesno("Confirm", f"Are you sure you want to delete {len(selected)} contacts?"):
+                self.run_batch(self.service.delete_many, selected)
+            return
+        
         if messagebox.askyesno("Confirm", "Are you sure you want to delete this contact?"):
-            item = self.tree.item(selected[0])
-            name, phone, contact_type = item['values'][0], item['values'][1], item['values'][3]
+            contact = selected[0]
+            name, phone, contact_type = contact.name, contact.phone, contact.contact_type
             
-            print(f"Attempting to delete: {name}, {phone}, {contact_type}")  # Debug
-            
-            # Delete from linked list
-            deleted_from_list = self.contact_list.delete(name, phone)
-            print(f"Deleted from linked list: {deleted_from_list}")  # Debug
-            
-            # Delete from file
-            deleted_from_file = self.delete_contact_from_file(name, phone, contact_type)
-            print(f"Deleted from file: {deleted_from_file}")  # Debug
-            
-            # Refresh display
-            self.refresh_contact_display()
+            # Delete from contact store and file, then drop its row from the display
+            self.scheduler.cancel()
+            old = self.contact_list.find(name, phone)
+            index = self.contact_list.index(old) if old else -1
+            try:
+                deleted_from_file = self.service.delete(name, phone)
+            except ContactError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.show_deleted(index, old)
+            logger.debug("Deleted %s, %s (%s), from file: %s", name, phone, contact_type, deleted_from_file)
             
             if deleted_from_file:
-                self.status_var.set(f"Contact '{name}' deleted successfully!")
+                self.set_status(f"Contact '{name}' deleted successfully!")
             else:
-                self.status_var.set(f"Contact '{name}' deleted from display but may still exist in file!")
+                self.set_status(f"Contact '{name}' deleted from display but may still exist in file!")
+    
+    def edit_selected(self, selected):
+        """Bulk edit: give every selected contact the form's type and/or email, whichever is filled in"""
+        _, _, email, contact_type = self.form_values()
+        if not email and not contact_type:
+            messagebox.showerror("Error", "Fill in a type and/or email to give the selected contacts!")
+            return
+        what = " and ".join(f"{field} '{value}'" for field, value in
+                            (("type", contact_type), ("email", email)) if value)
+        if messagebox.askyesno("Confirm", f"Give {len(selected)} contacts {what}?"):
+            self.run_batch(lambda keys: self.service.edit_many(keys, email or None, contact_type or None),
+                           selected)
+    
+    def retype_selected(self, contact_type: str):
+        """Move every selected contact to another type"""
+        selected = self.view.selection()
+        if not selected:
+            messagebox.showerror("Error", "Please select the contacts to move!")
+            return
+        self.run_batch(lambda keys: self.service.retype_many(keys, contact_type), selected)
+    
+    def add_contact_type(self):
+        """Ask for the name of a new contact type and offer it everywhere types are listed"""
+        name = simpledialog.askstring("Add Contact Type", "Name of the new contact type:", parent=self.root)
+        if not name:
+            return
+        try:
+            contact_type = self.service.add_contact_type(name)
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.type_combo.configure(values=self.contact_types)
+        self.move_menu.add_command(label=contact_type,
+                                   command=lambda: self.retype_selected(contact_type))
+        self.update_type_counts()
+        self.set_status(f"Added contact type '{contact_type}'")
+    
+    def run_batch(self, change, selected):
+        """Apply a bulk change to the selected contacts as one undoable operation"""
+        self.scheduler.cancel()
+        anchor = self.view.anchor()
+        try:
+            result = change([(contact.name, contact.phone) for contact in selected])
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.show_batch(result, anchor)
+        self.set_status(f"Done: {result.operation.label} (Ctrl+Z to undo)")
+    
+    def undo(self):
+        """Revert the last change"""
+        self._replay_history(self.service.undo, "Undid", "Nothing to undo")
+    
+    def redo(self):
+        """Re-apply the last undone change"""
+        self._replay_history(self.service.redo, "Redid", "Nothing to redo")
+    
+    def _replay_history(self, step, done: str, nothing: str):
+        self.scheduler.cancel()
+        anchor = self.view.anchor()
+        try:
+            result = step()
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if result is None:
+            self.set_status(nothing)
+            return
+        self.show_batch(result, anchor)
+        self.set_status(f"{done}: {result.operation.label}")
     
     def on_item_select(self, event):
         """Handle item selection for editing"""
-        selected = self.tree.selection()
+        selected = self.view.selection()
         if selected:
-            item = self.tree.item(selected[0])
-            values = item['values']
+            contact = selected[0]
             
             # Fill form with selected contact data
-            self.name_var.set(values[0])
-            self.phone_var.set(values[1])
-            self.email_var.set(values[2])
-            self.type_var.set(values[3])
+            self.name_var.set(contact.name)
+            self.phone_var.set(contact.phone)
+            self.email_var.set(contact.email)
+            self.type_var.set(contact.contact_type)
     
     def clear_fields(self):
         """Clear all input fields"""
@@ -399,246 +470,559 @@ class ContactManager:
         self.email_var.set("")
         self.type_var.set("")
     
-    def save_contact_to_file(self, name: str, phone: str, email: str, contact_type: str):
-        """Save contact to appropriate file"""
-        filename = f"contacts/{contact_type}.txt"
-        
-        # Read existing contacts
-        contacts = []
-        if os.path.exists(filename):
-            try:
-                with open(filename, 'r') as f:
-                    for line in f:
-                        if line.strip():
-                            try:
-                                contacts.append(json.loads(line.strip()))
-                            except json.JSONDecodeError:
-                                continue
-            except Exception as e:
-                print(f"Error reading file: {e}")
-        
-        # Add new contact
-        contact_data = {
-            'name': name,
-            'phone': phone,
-            'email': email,
-            'type': contact_type
-        }
-        contacts.append(contact_data)
-        
-        # Sort contacts by name (case-insensitive)
-        contacts.sort(key=lambda x: x['name'].lower())
-        
-        # Write back to file
-        try:
-            with open(filename, 'w') as f:
-                for contact in contacts:
-                    f.write(json.dumps(contact) + '\n')
-        except Exception as e:
-            print(f"Error writing to file: {e}")
-            messagebox.showerror("Error", f"Could not save contact to file: {e}")
+    def show_inserted(self, node: ContactNode):
+        """Patch a contact just added to the store into the display"""
+        if self.view.rows is self.contact_list:
+            self.view.row_inserted(self.contact_list.index(node))
+        else:
+            # A search or filter is showing: re-run it on the new contents
+            self.run_query(delay_ms=0, keep_position=True)
+        self.update_type_counts()
     
-    def delete_contact_from_file(self, name: str, phone: str, contact_type: str):
-        """Delete contact from file"""
-        filename = f"contacts/{contact_type}.txt"
-        print(f"Looking for file: {filename}")  # Debug
-        
-        if not os.path.exists(filename):
-            print(f"File {filename} does not exist!")  # Debug
-            return False
-        
-        # Read existing contacts
-        contacts = []
-        found = False
+    def show_batch(self, result, anchor):
+        """Patch the display after a batch change, anchor being view.anchor() from before it"""
+        if self.view.rows is self.contact_list:
+            self.view.rows_replaced(anchor, result.removed, result.added, attrgetter('sort_key'))
+        else:
+            self.run_query(delay_ms=0, keep_position=True)
+        self.update_type_counts()
+    
+    def show_deleted(self, index: int, node: ContactNode):
+        """Drop a contact just deleted from the store (it was at index) from the display"""
+        if self.view.rows is self.contact_list:
+            self.view.row_deleted(index, node)
+        else:
+            self.run_query(delay_ms=0, keep_position=True)
+        self.update_type_counts()
+    
+    def poll_changes(self):
+        """Reload categories another instance changed and refresh the display"""
         try:
-            with open(filename, 'r') as f:
-                content = f.read()
-                print(f"File content before deletion:\n{content}")  # Debug
-                
-            # Re-read the file line by line
-            with open(filename, 'r') as f:
-                for line_num, line in enumerate(f, 1):
-                    if line.strip():
-                        try:
-                            contact = json.loads(line.strip())
-                            print(f"Line {line_num}: {contact}")  # Debug
-                            
-                            # Check if this is the contact to delete
-                            # Convert both to strings and strip whitespace for comparison
-                            contact_name = str(contact['name']).strip()
-                            contact_phone = str(contact['phone']).strip()
-                            search_name = str(name).strip()
-                            search_phone = str(phone).strip()
-                            
-                            print(f"Comparing: '{contact_name}' == '{search_name}' and '{contact_phone}' == '{search_phone}'")  # Debug
-                            
-                            if contact_name == search_name and contact_phone == search_phone:
-                                print(f"Found contact to delete: {contact}")  # Debug
-                                found = True
-                            else:
-                                contacts.append(contact)
-                        except json.JSONDecodeError as e:
-                            print(f"JSON decode error on line {line_num}: {e}")  # Debug
-                            continue
-            
-            print(f"Contact found for deletion: {found}")  # Debug
-            print(f"Remaining contacts: {contacts}")  # Debug
-            
-            # Write back to file only if contact was found
-            if found:
-                with open(filename, 'w') as f:
-                    for contact in contacts:
-                        f.write(json.dumps(contact) + '\n')
-                
-                print(f"File rewritten with {len(contacts)} contacts")  # Debug
-                
-                # Verify the file was written correctly
-                with open(filename, 'r') as f:
-                    new_content = f.read()
-                    print(f"File content after deletion:\n{new_content}")  # Debug
-                
-                return True
-            else:
-                print("Contact not found in file!")  # Debug
-                return False
-                
+            changed = self.service.reload_changed()
         except Exception as e:
-            print(f"Error deleting contact from file: {e}")  # Debug
-            return False
+            logger.warning("Error reloading changed contacts: %s", e)
+            changed = []
+        if changed:
+            self.run_query(delay_ms=0, keep_position=True)
+            self.update_type_counts()
+            self.set_status(f"Reloaded {', '.join(changed)} contacts changed by another instance")
+        self._poll_id = self.root.after(self.POLL_MS, self.poll_changes)
+    
+    def poll_durability(self):
+        """Show how many edits are still waiting for the background writer"""
+        pending = self.storage.pending
+        if self.storage.last_error:
+            self.durability_var.set(f"{pending} changes not saved, retrying: {self.storage.last_error}")
+        elif pending:
+            self.durability_var.set(f"Saving {pending} changes...")
+        else:
+            self.durability_var.set("All changes saved")
+        self._durability_id = self.root.after(self.DURABILITY_MS, self.poll_durability)
     
     def load_contacts(self):
-        """Load contacts from files into linked list"""
-        for contact_type in self.contact_types:
-            filename = f"contacts/{contact_type}.txt"
-            if os.path.exists(filename):
-                try:
-                    with open(filename, 'r') as f:
-                        for line in f:
-                            if line.strip():
-                                try:
-                                    contact = json.loads(line.strip())
-                                    self.contact_list.insert(
-                                        contact['name'],
-                                        contact['phone'],
-                                        contact['email'],
-                                        contact['type']
-                                    )
-                                except json.JSONDecodeError:
-                                    continue
-                except Exception as e:
-                    print(f"Error loading contacts from {filename}: {e}")
+        """Load contacts from the storage backend into the contact store"""
+        if self.lazy:
+            # Index on a thread: the window comes up (empty) right away
+            self._indexing = threading.Thread(target=self._index_contacts, name='index', daemon=True)
+            self._indexing.start()
+            self.root.after(self.INDEXING_MS, self._check_indexed)
+            return
+        # The window keeps its contacts until it closes, so they can be frozen out of collections
+        self.load_seconds = self.service.load(freeze_gc=True)
+        logger.info("Loaded %d contacts in %.2f s", len(self.contact_list), self.load_seconds)
+    
+    def _index_contacts(self):
+        try:
+            self.load_seconds = self.service.load()
+        except Exception:
+            logger.exception("Error indexing contacts")
+            self.load_seconds = None
+    
+    def _check_indexed(self):
+        """Show the contacts once lazy mode has indexed them"""
+        if self._indexing.is_alive():
+            self.set_status("Indexing contacts...")
+            self.root.after(self.INDEXING_MS, self._check_indexed)
+            return
+        if self.load_seconds is None:
+            messagebox.showerror("Error", "Could not index the contact files, see the log for details")
+            return
+        logger.info("Indexed %d contacts in %.2f s", len(self.contact_list), self.load_seconds)
+        self.run_query(delay_ms=0)
+        self.update_type_counts()
     
     def refresh_contact_display(self):
         """Refresh the contact display in treeview"""
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Get all contacts
-        contacts = self.contact_list.get_all_contacts()
-        
-        # Add contacts to treeview
-        for contact in contacts:
-            self.tree.insert('', 'end', values=(
-                contact.name,
-                contact.phone,
-                contact.email,
-                contact.contact_type
-            ))
+        if self.sort_column is not None:
+            # Keep the clicked column's order
+            self.run_query(delay_ms=0, keep_position=True)
+            self.update_type_counts()
+            return
+        # The virtual list reads rows straight from the store
+        self.view.set_rows(self.contact_list, keep_position=True)
+        self.update_type_counts()
         
         # Update status
-        self.status_var.set(f"Total contacts: {len(contacts)}")
+        self.set_status(f"Total contacts: {len(self.contact_list)}")
     
     def search_contacts(self, event):
-        """Search contacts by name"""
-        search_term = self.search_var.get().lower()
-        
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Get all contacts
-        contacts = self.contact_list.get_all_contacts()
-        
-        # Filter contacts
-        filtered_contacts = [
-            contact for contact in contacts
-            if search_term in contact.name.lower()
-        ]
-        
-        # Add filtered contacts to treeview
-        for contact in filtered_contacts:
-            self.tree.insert('', 'end', values=(
-                contact.name,
-                contact.phone,
-                contact.email,
-                contact.contact_type
-            ))
-        
-        self.status_var.set(f"Found {len(filtered_contacts)} contacts")
-    
-    def filter_contacts(self, event):
-        """Filter contacts by type"""
-        filter_type = self.filter_var.get()
-        
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Get all contacts
-        contacts = self.contact_list.get_all_contacts()
-        
-        # Filter contacts
-        if filter_type == 'All':
-            filtered_contacts = contacts
+        """Search contacts by name, within the selected type"""
+        # Debounced: only the last keystroke in a burst runs the query
+        self.run_query()
+    
+    def filter_contacts(self, event=None):
+        """Filter contacts by type, keeping the search term"""
+        # Same worker path as search, without the typing delay
+        self.run_query(delay_ms=0)
+    
+    def sort_by(self, column: str):
+        """Sort the list by a column header, reversing the order on a second click"""
+        if self.lazy:
+            # The category files are only in ascending name order
+            messagebox.showerror("Error", "Lazy mode only lists contacts by name; start without --lazy to sort")
+            return
+        if column == self.sort_column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column, self.sort_descending = column, False
+        for col in ('Name', 'Phone', 'Email', 'Type'):
+            arrow = (' \u25bc' if self.sort_descending else ' \u25b2') if col.lower() == column else ''
+            self.tree.heading(col, text=col + arrow)
+        self.run_query(delay_ms=0)
+    
+    def current_query(self) -> ContactQuery:
+        """The search box, type filter and sorted column as one query"""
+        # Filter labels carry a count, e.g. "friend (42)"
+        filter_type = self.filter_var.get().rsplit(' (', 1)[0]
+        return ContactQuery(
+            name=self.search_var.get().strip().lower(),
+            contact_type=None if filter_type in ('', 'All') else filter_type,
+            fuzzy=bool(self.fuzzy_var.get()),
+            sort=self.sort_column,
+            descending=self.sort_descending
+        )
+    
+    def run_query(self, delay_ms: Optional[int] = None, keep_position: bool = False):
+        """Evaluate the current query on the worker and show the results"""
+        query = self.current_query()
+        self.scheduler.submit(lambda cancelled: self.service.query(query, cancelled),
+                              lambda contacts: self._show_query_results(query, contacts, keep_position),
+                              delay_ms=delay_ms)
+    
+    def _show_query_results(self, query: ContactQuery, contacts, keep_position: bool = False):
+        # Show matching contacts
+        self.view.set_rows(contacts, keep_position=keep_position)
+        
+        if contacts is self.contact_list:
+            self.set_status(f"Total contacts: {len(contacts)}")
+        elif query.name and query.fuzzy:
+            self.set_status(f"Found {len(contacts)} contacts, closest first")
+        elif query.name:
+            self.set_status(f"Found {len(contacts)} contacts")
+        elif query.sort:
+            self.set_status(f"Showing {len(contacts)} contacts by {query.sort}"
+                            f"{', descending' if query.descending else ''}")
         else:
-            filtered_contacts = [
-                contact for contact in contacts
-                if contact.contact_type == filter_type
-            ]
-        
-        # Add filtered contacts to treeview
-        for contact in filtered_contacts:
-            self.tree.insert('', 'end', values=(
-                contact.name,
-                contact.phone,
-                contact.email,
-                contact.contact_type
-            ))
-        
-        self.status_var.set(f"Showing {len(filtered_contacts)} contacts")
+            self.set_status(f"Showing {len(contacts)} contacts")
+    
+    def update_type_counts(self):
+        """Show per-type contact counts in the filter combobox"""
+        counts = self.service.type_counts()
+        labels = [f"All ({len(self.contact_list)})"]
+        labels += [f"{t} ({counts.get(t, 0)})" for t in self.contact_types]
+        self.filter_combo.configure(values=labels)
+        
+        # Relabel the current choice so its count stays current too
+        current = self.current_query().contact_type
+        self.filter_var.set(labels[0] if current is None
+                            else f"{current} ({counts.get(current, 0)})")
+    
+    @staticmethod
+    def _row_values(contact):
+        """Treeview values for one contact"""
+        return (
+            contact.name,
+            contact.phone,
+            contact.email,
+            contact.contact_type
+        )
+    
+    def _on_render(self, ms: float):
+        """Remember how long the last treeview render took"""
+        self.frame_ms = ms
+    
+    def set_status(self, message: str):
+        """Show a status bar message, with the frame time in debug mode"""
+        if self.debug:
+            message = f"{message} | frame {self.frame_ms:.2f} ms"
+        self.status_var.set(message)
+
+    IO_FILETYPES = [("CSV", "*.csv"), ("vCard", "*.vcf *.vcard"),
+                    ("JSON lines", "*.jsonl *.json *.txt"), ("Binary contacts", "*.cbin"), ("All files", "*.*")]
+    
+    def import_contacts(self):
+        """Stream a CSV, vCard, JSON-lines or binary file into the contact list"""
+        path = filedialog.askopenfilename(title="Import Contacts", filetypes=self.IO_FILETYPES)
+        if not path:
+            return
+        
+        self.scheduler.cancel()
+        steps = iter_import(path, self.service)
+        
+        def on_step(stats):
+            return stats.progress, f"{stats.read} rows read, {stats.imported} imported"
+        
+        def on_done(stats):
+            # Lazy mode re-indexes the categories the import rewrote
+            self.service.reload_changed()
+            self.update_type_counts()
+            self.run_query(delay_ms=0)
+            message = stats.summary()
+            if stats.errors:
+                line_num, error = stats.errors[0]
+                message += f"\nFirst rejected row: line {line_num}: {error}"
+            messagebox.showinfo("Import Complete", message)
+        
+        self._run_with_progress("Importing Contacts", steps, on_step, on_done)
+    
+    def export_contacts(self):
+        """Stream the contacts currently shown to a CSV, vCard, JSON-lines or binary file"""
+        path = filedialog.asksaveasfilename(title="Export Contacts", defaultextension='.csv',
+                                            filetypes=self.IO_FILETYPES)
+        if not path:
+            return
+        
+        contacts = self.view.rows
+        total = len(contacts)
+        steps = iter_export(path, contacts)
+        
+        def on_step(count):
+            return (count / total if total else 1.0), f"{count} of {total} contacts written"
+        
+        def on_done(count):
+            self.set_status(f"Exported {count} contacts to {os.path.basename(path)}")
+        
+        self._run_with_progress("Exporting Contacts", steps, on_step, on_done)
+    
+    def show_duplicate_report(self):
+        """List contacts sharing a phone number or email, in any category"""
+        try:
+            groups = self.service.duplicate_report()
+        except ContactError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        lines = []
+        for group in groups:
+            marker = "  (across types)" if group.cross_type else ""
+            lines.append(f"{group.field} {group.value}{marker}")
+            lines += [f"    {c.name:<30} {c.phone:<12} {c.email:<32} {c.contact_type}"
+                      for c in group.contacts]
+        
+        self.show_text("Duplicate Report",
+                       '\n'.join(lines) if lines else "No contacts share a phone number or email.")
+        
+        cross_type = sum(1 for group in groups if group.cross_type)
+        self.set_status(f"{len(groups)} shared phone numbers or emails, {cross_type} across types")
+    
+    def _run_with_progress(self, title: str, steps, on_step, on_done):
+        """Drive a step generator from root.after, showing a progress bar.
+        
+        on_step(item) returns (fraction done, label text); on_done gets the last item.
+        """
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        label_var = tk.StringVar(value="Starting...")
+        ttk.Label(dialog, textvariable=label_var, padding=10).pack(fill='x')
+        progress = ttk.Progressbar(dialog, length=320, maximum=100, mode='determinate')
+        progress.pack(fill='x', padx=10, pady=(0, 10))
+        
+        def step(last=None):
+            try:
+                item = next(steps)
+            except StopIteration:
+                dialog.destroy()
+                on_done(last)
+                return
+            except Exception as e:
+                dialog.destroy()
+                messagebox.showerror("Error", f"{title} failed: {e}")
+                self.refresh_contact_display()
+                return
+            fraction, text = on_step(item)
+            progress['value'] = fraction * 100
+            label_var.set(text)
+            # Yield to the event loop between batches so the window stays responsive
+            self.root.after(1, step, item)
+        
+        self.root.after(1, step)
+    
+    def show_text(self, title: str, content: str):
+        """A read-only text window, e.g. for reports"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.transient(self.root)
+        text = tk.Text(dialog, width=100, height=30, font=('Courier', 10))
+        scrollbar = ttk.Scrollbar(dialog, orient='vertical', command=text.yview)
+        text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        text.pack(side='left', fill='both', expand=True)
+        # One insert: far faster than a line at a time for large reports
+        text.insert('end', content)
+        text.configure(state='disabled')
+        return dialog, text
+    
+    def show_stats(self):
+        """Timing spans and counters, redrawn while open, with JSON export and profiling"""
+        if self.stats_dialog is not None and self.stats_dialog.winfo_exists():
+            self.stats_dialog.lift()
+            return
+        dialog, text = self.show_text("Performance Stats", metrics.report())
+        text.configure(height=20)
+        self.stats_dialog = dialog
+        
+        buttons = ttk.Frame(dialog)
+        buttons.pack(side='bottom', fill='x', before=text, pady=5)
+        ttk.Button(buttons, text="Export JSON...", command=self.export_stats).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Reset", command=metrics.reset).pack(side='left', padx=5)
+        profile_label = tk.StringVar()
+        
+        def toggle_profiling():
+            self.toggle_profiling()
+            profile_label.set("Stop Profiling" if self.profiler.active else "Start Profiling")
+        
+        ttk.Button(buttons, textvariable=profile_label, command=toggle_profiling).pack(side='left', padx=5)
+        profile_label.set("Stop Profiling" if self.profiler.active else "Start Profiling")
+        
+        def redraw():
+            if not dialog.winfo_exists():
+                return
+            text.configure(state='normal')
+            text.delete('1.0', 'end')
+            text.insert('end', metrics.report())
+            text.configure(state='disabled')
+            dialog.after(self.STATS_MS, redraw)
+        
+        dialog.after(self.STATS_MS, redraw)
+    
+    def export_stats(self):
+        """Save the current spans and counters as JSON"""
+        path = filedialog.asksaveasfilename(title="Export Stats", defaultextension='.json',
+                                            filetypes=[("JSON", "*.json"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            metrics.export(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export stats: {e}")
+            return
+        self.set_status(f"Stats exported to {os.path.basename(path)}")
+    
+    def toggle_profiling(self):
+        """Start a cProfile/tracemalloc capture, or stop it and show the report"""
+        if self.profiler.active:
+            self.show_text("Profile", self.profiler.stop())
+            self.set_status("Profiling stopped")
+        else:
+            self.profiler.start()
+            self.set_status("Profiling... stop it from the stats panel to see the report")
+    
+    def on_close(self):
+        """Save queued edits before the window goes; if they cannot be saved, ask first"""
+        try:
+            self.storage.flush()
+        except Exception as e:
+            pending = getattr(self.storage, 'pending', 0)
+            if not messagebox.askyesno(
+                    "Changes Not Saved",
+                    f"{pending or 'Some'} changes could not be saved: {e}\n\n"
+                    "Close anyway and lose them? Choose No to keep the window open; "
+                    "saving is retried in the background."):
+                return
+        self.root.destroy()
+
+    def close(self):
+        """Stop background queries and close the storage backend, writing any queued changes.
+
+        Raises if the queued changes cannot be written.
+        """
+        try:
+            self.root.after_cancel(self._poll_id)
+            if self._durability_id is not None:
+                self.root.after_cancel(self._durability_id)
+        except tk.TclError:
+            # The window is already destroyed, and its timers with it
+            pass
+        try:
+            if self.profiler.active:
+                self.profiler.stop()
+            self.scheduler.shutdown()
+        finally:
+            self.service.close()
+
+STORAGE_BACKENDS = {
+    'files': lambda directory: JsonLinesStorage(directory),
+    'journal': lambda directory: JournalStorage(directory),
+    'sqlite': lambda directory: SqliteStorage(os.path.join(directory, 'contacts.db')),
+}
+
+
+def run_bulk_io(args, storage):
+    """Headless --import / --export"""
+    service = ContactService(storage, feed=ChangeFeed(storage.directory))
+    service.load()
+    store = service.store
+    
+    if args.import_path:
+        stats = None
+        for stats in iter_import(args.import_path, service, fmt=args.format):
+            print(f"\r{stats.progress:6.1%}  {stats.read} rows  {stats.rows_per_second:,.0f} rows/sec",
+                  end='', flush=True)
+        print()
+        print(stats.summary())
+        for line_num, error in stats.errors[:10]:
+            print(f"  line {line_num}: {error}")
+    
+    if args.export_path:
+        start = time.perf_counter()
+        count = 0
+        for count in iter_export(args.export_path, store, fmt=args.format):
+            print(f"\r{count} contacts written", end='', flush=True)
+        seconds = time.perf_counter() - start
+        print()
+        print(f"Exported {count} contacts at {count / seconds if seconds else 0:,.0f} rows/sec")
+
+
+def run_sync(args, storage):
+    """Headless --sync-with: exchange the changes of two contact directories"""
+    local = ContactService(storage, feed=ChangeFeed(storage.directory))
+    other_storage = STORAGE_BACKENDS[args.storage](args.sync_with)
+    other = ContactService(other_storage, feed=ChangeFeed(other_storage.directory))
+    try:
+        local.load()
+        other.load()
+        pulled, sent = local.sync(other)
+    finally:
+        local.close()
+        other.close()
+    print(f"Pulled {pulled.pulled} changes from {args.sync_with} ({pulled.changed} contacts changed here), "
+          f"sent {sent.pulled} ({sent.changed} contacts changed there)")
+
+
+def run_server(args, storage):
+    """Headless --serve: the HTTP/JSON API until interrupted"""
+    service = ContactService(storage, feed=ChangeFeed(storage.directory))
+    # Serves until it exits, as the GUI keeps its contacts until it closes
+    seconds = service.load(freeze_gc=True)
+    print(f"Loaded {len(service)} contacts in {seconds:.2f} s")
+    server = ContactServer(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}/contacts (Ctrl+C to stop)")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        service.close()
 
-    def debug_files(self):
-        """Debug function to check file contents"""
-        print("\n=== DEBUG: File Contents ===")
-        for contact_type in self.contact_types:
-            filename = f"contacts/{contact_type}.txt"
-            if os.path.exists(filename):
-                print(f"\n--- {contact_type.upper()} ({filename}) ---")
-                try:
-                    with open(filename, 'r') as f:
-                        content = f.read()
-                        if content.strip():
-                            for line_num, line in enumerate(content.split('\n'), 1):
-                                if line.strip():
-                                    try:
-                                        contact = json.loads(line.strip())
-                                        print(f"Line {line_num}: {contact}")
-                                    except json.JSONDecodeError:
-                                        print(f"Line {line_num}: Invalid JSON - {line}")
-                        else:
-                            print("File is empty")
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-            else:
-                print(f"\n--- {contact_type.upper()} ---")
-                print("File does not exist")
-        print("=== END DEBUG ===\n")
 
 def main():
+    parser = argparse.ArgumentParser(description="Contact Management System")
+    parser.add_argument('--storage', choices=sorted(STORAGE_BACKENDS), default='files',
+                        help="'files' rewrites contacts/<type>.txt on every change, "
+                             "'journal' appends to contacts/journal.log, "
+                             "'sqlite' uses the indexed contacts/contacts.db")
+    parser.add_argument('--debug', action='store_true',
+                        help="log every timing span and show the treeview frame time in the status bar")
+    parser.add_argument('--lazy', action='store_true',
+                        help="keep contacts in the category files and page them in as they are shown "
+                             "(--storage files only), for data sets too large to load")
+    parser.add_argument('--compression', choices=['none'] + sorted(COMPRESSIONS),
+                        help="write the category files block-compressed with per-block checksums "
+                             "(--storage files only), converting existing ones first; 'none' converts "
+                             "them back to plain JSON lines")
+    parser.add_argument('--sync-writes', action='store_true',
+                        help="write each change to the files before the GUI continues, instead of "
+                             "queueing it for a background writer")
+    parser.add_argument('--stats', metavar='FILE',
+                        help="write timing spans and counters to this JSON file on exit")
+    parser.add_argument('--migrate-from', choices=sorted(STORAGE_BACKENDS),
+                        help="copy every contact from this backend into --storage and exit")
+    parser.add_argument('--import', dest='import_path', metavar='FILE',
+                        help="import contacts from a CSV, vCard, JSON-lines or binary (.cbin) file and exit")
+    parser.add_argument('--export', dest='export_path', metavar='FILE',
+                        help="export every contact to a CSV, vCard, JSON-lines or binary (.cbin) file and exit")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="file format for --import/--export (default: from the extension)")
+    parser.add_argument('--sync-with', metavar='DIR',
+                        help="exchange the changes made since the last sync with another contacts "
+                             "directory (same --storage), last change wins, and exit")
+    parser.add_argument('--serve', action='store_true',
+                        help="serve the contacts as an HTTP/JSON API instead of opening the GUI")
+    parser.add_argument('--host', default='127.0.0.1', help="address for --serve")
+    parser.add_argument('--port', type=int, default=8765, help="port for --serve")
+    args = parser.parse_args()
+    
+    # Quiet by default: only warnings and errors reach stderr
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.stats:
+        atexit.register(metrics.export, args.stats)
+    
+    if args.lazy and args.storage != 'files':
+        parser.error("--lazy needs --storage files")
+    if args.compression and args.storage != 'files':
+        parser.error("--compression needs --storage files")
+    storage = STORAGE_BACKENDS[args.storage]('contacts')
+    if args.compression:
+        storage.compression = None if args.compression == 'none' else args.compression
+        converted = storage.convert()
+        if converted:
+            print(f"Converted {converted} category files to {args.compression}")
+    
+    if args.migrate_from:
+        if args.migrate_from == args.storage:
+            parser.error("--migrate-from must differ from --storage")
+        source = STORAGE_BACKENDS[args.migrate_from]('contacts')
+        try:
+            copied = migrate(source, storage)
+        finally:
+            source.close()
+            storage.close()
+        print(f"Migrated {copied} contacts from {args.migrate_from} to {args.storage}")
+        return
+    
+    if args.import_path or args.export_path:
+        try:
+            run_bulk_io(args, storage)
+        finally:
+            storage.close()
+        return
+    
+    if args.sync_with:
+        run_sync(args, storage)
+        return
+    
+    if args.serve:
+        run_server(args, storage)
+        return
+    
+    if not args.lazy and not args.sync_writes:
+        # Edits return at once; closing the app below writes whatever is still queued
+        storage = WriteBehindStorage(storage)
+    
     root = tk.Tk()
-    app = ContactManager(root)
-    root.mainloop()
+    app = ContactManager(root, storage, debug=args.debug, lazy=args.lazy,
+                         feed=ChangeFeed(storage.directory))
+    try:
+        root.mainloop()
+    finally:
+        try:
+            app.close()
+        except Exception as e:
+            # The window is gone by now, so the terminal is the one place left to say it
+            raise SystemExit(f"Could not save all changes: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Optional, Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from contact_service import ContactError, ContactNotFoundError, ContactService, DuplicateContactError
+from contact_store import SORT_COLUMNS, ContactQuery
+from instrumentation import metrics
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_PAGE = 1000
+# Seconds between checks for contact files changed by another process
+POLL_SECONDS = 1.0
+
+Response = Tuple[int, object]
+
+logger = logging.getLogger(__name__)
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ContactServer:
+    """HTTP/JSON API over a ContactService, on asyncio streams.
+
+    Endpoints (all bodies and responses are JSON):
+
+    * ``GET /contacts?q=&type=&fuzzy=&sort=&order=&offset=&limit=`` a page of
+      matching contacts in name order (closest first with fuzzy=1, or by
+      sort=name|phone|email|type, order=desc to reverse), with the total count
+    * ``GET /contacts/lookup?name=&phone=`` one contact
+    * ``GET /contacts/by-phone?phone=`` and ``GET /contacts/by-email?email=``
+      every contact with that number (any format) or email
+    * ``POST /contacts`` add ``{"name", "phone", "email", "type"}``
+    * ``PUT /contacts?name=&phone=`` replace that contact with the body
+    * ``DELETE /contacts?name=&phone=``
+    * ``GET /types`` contact count per type
+    * ``GET /duplicates?cross_type=1`` contacts sharing a phone or email,
+      optionally only across types
+    * ``GET /stats`` (or ``GET /metrics``) timing spans and counters, query_cache_*
+      included, see instrumentation.Metrics
+
+    Connections are kept alive. Each request runs on a thread pool, so a
+    slow search or file write never blocks the event loop; searches share
+    the store's read lock and run side by side, changes are serialized by
+    the service. Every POLL_SECONDS the service reloads categories another
+    process (a GUI, a second server) has changed.
+    """
+    def __init__(self, service: ContactService, host: str = '127.0.0.1', port: int = 8765,
+                 workers: int = 8):
+        self.service = service
+        self.host = host
+        self.port = port
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='request')
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._poller: Optional[asyncio.Task] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._poller = asyncio.get_running_loop().create_task(self._poll_changes())
+        return self._server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        if self._server is not None:
+            self._server.close()
+        self._executor.shutdown(wait=True)
+
+    async def _poll_changes(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            try:
+                changed = await loop.run_in_executor(self._executor, self.service.reload_changed)
+            except Exception as e:
+                logger.warning("Error reloading changed contacts: %s", e)
+                continue
+            if changed:
+                logger.info("Reloaded %s contacts changed by another process", ', '.join(changed))
+
+    # HTTP
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    await self._respond(writer, e.status, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await loop.run_in_executor(
+                    self._executor, self.dispatch, method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(HTTPStatus.BAD_REQUEST, "incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "headers too large")
+        if len(head) > MAX_HEADER_BYTES:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "headers too large")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "malformed request line")
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if line:
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "malformed Content-Length")
+        if length < 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "malformed Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        body = json.dumps(payload).encode('utf-8')
+        reason = HTTPStatus(status).phrase
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+            + body)
+        await writer.drain()
+
+    # Routes, run on the worker threads
+
+    def dispatch(self, method: str, target: str, body: bytes) -> Response:
+        """Handle one request, returns (status, JSON payload)"""
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route = (method, url.path.rstrip('/') or '/')
+        try:
+            if route == ('GET', '/contacts'):
+                return self._list(params)
+            if route == ('GET', '/contacts/lookup'):
+                return self._lookup(params)
+            if route == ('GET', '/contacts/by-phone'):
+                return self._reverse_lookup(params, 'phone', self.service.lookup_by_phone)
+            if route == ('GET', '/contacts/by-email'):
+                return self._reverse_lookup(params, 'email', self.service.lookup_by_email)
+            if route == ('GET', '/duplicates'):
+                return self._duplicates(params)
+            if route == ('POST', '/contacts'):
+                return self._add(self._json(body))
+            if route == ('PUT', '/contacts'):
+                return self._update(params, self._json(body))
+            if route == ('DELETE', '/contacts'):
+                return self._delete(params)
+            if route == ('GET', '/types'):
+                return HTTPStatus.OK, self.service.type_counts()
+            if route in (('GET', '/stats'), ('GET', '/metrics')):
+                return HTTPStatus.OK, metrics.snapshot()
+            if url.path.rstrip('/') in ('/contacts', '/contacts/lookup', '/contacts/by-phone',
+                                        '/contacts/by-email', '/types', '/duplicates', '/stats', '/metrics'):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"{method} not allowed"}
+            return HTTPStatus.NOT_FOUND, {'error': f"no route for {url.path}"}
+        except HttpError as e:
+            return e.status, {'error': str(e)}
+        except DuplicateContactError as e:
+            return HTTPStatus.CONFLICT, {'error': str(e)}
+        except ContactNotFoundError as e:
+            return HTTPStatus.NOT_FOUND, {'error': str(e)}
+        except ContactError as e:
+            return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+        except Exception:
+            logger.exception("Error handling %s %s", method, target)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "internal error"}
+
+    @staticmethod
+    def _json(body: bytes) -> Dict:
+        try:
+            data = json.loads(body or b'{}')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        return data
+
+    @staticmethod
+    def _fields(data: Dict) -> Tuple[str, str, str, str]:
+        return tuple(str(data.get(field) or '').strip() for field in ('name', 'phone', 'email', 'type'))
+
+    @staticmethod
+    def _key(params: Dict[str, str]) -> Tuple[str, str]:
+        if 'name' not in params or 'phone' not in params:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "name and phone are required")
+        return params['name'], params['phone']
+
+    @staticmethod
+    def _int(params: Dict[str, str], key: str, default: int) -> int:
+        try:
+            return max(0, int(params.get(key, default)))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{key} must be a number")
+
+    @staticmethod
+    def _flag(params: Dict[str, str], key: str) -> bool:
+        return params.get(key, '').lower() in ('1', 'true', 'yes')
+
+    def _list(self, params: Dict[str, str]) -> Response:
+        sort = params.get('sort') or None
+        if sort is not None and sort not in SORT_COLUMNS:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        query = ContactQuery(name=params.get('q', '').strip().lower(),
+                             contact_type=params.get('type') or None,
+                             fuzzy=self._flag(params, 'fuzzy'),
+                             sort=sort,
+                             descending=params.get('order', '').lower() == 'desc')
+        offset = self._int(params, 'offset', 0)
+        limit = min(self._int(params, 'limit', 100), MAX_PAGE)
+        # The result is a live view: page through it before any change lands
+        with self.service.store.lock.read():
+            contacts = self.service.query(query)
+            total = len(contacts)
+            page = [self.service.to_record(contacts[i])
+                    for i in range(offset, min(offset + limit, total))]
+        return HTTPStatus.OK, {'total': total, 'offset': offset, 'contacts': page}
+
+    def _lookup(self, params: Dict[str, str]) -> Response:
+        contact = self.service.find(*self._key(params))
+        if contact is None:
+            raise ContactNotFoundError("Contact not found!")
+        return HTTPStatus.OK, self.service.to_record(contact)
+
+    def _reverse_lookup(self, params: Dict[str, str], field: str, lookup) -> Response:
+        if not params.get(field, '').strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{field} is required")
+        contacts = lookup(params[field])
+        return HTTPStatus.OK, {'contacts': [self.service.to_record(contact) for contact in contacts]}
+
+    def _duplicates(self, params: Dict[str, str]) -> Response:
+        groups = self.service.duplicate_report(self._flag(params, 'cross_type'))
+        return HTTPStatus.OK, {'groups': [
+            {'field': group.field, 'value': group.value,
+             'contacts': [self.service.to_record(contact) for contact in group.contacts]}
+            for group in groups]}
+
+    def _add(self, data: Dict) -> Response:
+        contact = self.service.add(*self._fields(data))
+        return HTTPStatus.CREATED, self.service.to_record(contact)
+
+    def _update(self, params: Dict[str, str], data: Dict) -> Response:
+        contact = self.service.update(*self._key(params), *self._fields(data))
+        return HTTPStatus.OK, self.service.to_record(contact)
+
+    def _delete(self, params: Dict[str, str]) -> Response:
+        deleted = self.service.delete(*self._key(params))
+        return HTTPStatus.OK, {'deleted': deleted}
@@ -0,0 +1,553 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Iterable, List, Sequence, Tuple
+
+from change_feed import ChangeFeed, Key
+from contact_store import (ContactNode, ContactQuery, ContactStore, DuplicateGroup, gc_paused, sort_contacts,
+                           validate_contact, validate_contact_type)
+from instrumentation import metrics
+from paged_store import PagedContactStore
+from storage import Change, ContactStorage, JsonLinesStorage, Record, make_record
+
+logger = logging.getLogger(__name__)
+
+
+class ContactError(Exception):
+    """A rejected change; the message is meant to be shown to the user as is"""
+
+
+class DuplicateContactError(ContactError):
+    """A contact with the same name and phone is already stored"""
+
+
+class ContactNotFoundError(ContactError):
+    """The contact to change is not stored"""
+
+
+@dataclass
+class Operation:
+    """One undoable change as (old, new) contact pairs, see storage.Change"""
+    label: str
+    changes: List[Change]
+
+    def inverse(self) -> 'Operation':
+        return Operation(self.label, [(new, old) for old, new in reversed(self.changes)])
+
+
+@dataclass
+class SyncResult:
+    """What one pull from another store's change feed brought in"""
+    # Entries read from the other feed (the latest per contact), baseline ones included
+    pulled: int
+    # Contacts added, changed or deleted here
+    changed: int
+    # The other feed's seq this store is now up to date with
+    watermark: int
+
+
+@dataclass
+class BatchResult:
+    """An applied operation and the store nodes it removed and added"""
+    operation: Operation
+    removed: List[ContactNode]
+    added: List[ContactNode]
+
+
+class OperationLog:
+    """Undo and redo stacks of applied operations, most recent last.
+
+    Operations hold the full old and new contacts, so undo and redo are
+    applied from memory without re-reading any file.
+    """
+    def __init__(self, limit: int = 100):
+        self.limit = limit
+        self.undo_stack: List[Operation] = []
+        self.redo_stack: List[Operation] = []
+
+    def record(self, operation: Operation):
+        """A new change: it can be undone, and nothing undone can be redone any more"""
+        if not operation.changes:
+            return
+        self.undo_stack.append(operation)
+        del self.undo_stack[:-self.limit]
+        self.redo_stack.clear()
+
+
+class ContactService:
+    """Contacts without a GUI: validation, add/update/delete, search and storage.
+
+    The Tk ContactManager and the HTTP server are both thin clients of
+    this class. Changes are serialized by a service-wide lock, which also
+    covers the storage write, while the in-memory store is only locked for
+    writing while it changes, so searches keep running during file I/O.
+
+    Every change is recorded in ``history`` for undo and redo. Changes to
+    many contacts (``delete_many``, ``retype_many``, ``edit_many``) are one
+    batch: one store update and one ``storage.apply_batch`` call, which
+    rewrites each affected category file once.
+
+    With a ChangeFeed every saved change is also appended to the feed,
+    and ``pull`` / ``sync`` exchange only the changes made since the last
+    sync with another store.
+    """
+    def __init__(self, storage: ContactStorage, contact_types: Optional[List[str]] = None,
+                 feed: Optional[ChangeFeed] = None):
+        self.storage = storage
+        self.feed = feed
+        # Shared with the storage unless given, so both know types added later
+        self.contact_types = list(contact_types) if contact_types else storage.contact_types
+        self.store = ContactStore()
+        self._write_lock = threading.Lock()
+        self.history = OperationLog()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def load(self, freeze_gc: bool = False) -> float:
+        """Load every stored contact, returns the seconds it took; see
+        ContactStore.bulk_load for freeze_gc"""
+        start = time.perf_counter()
+        with metrics.span('load'):
+            # Sorted records build the store in one pass instead of one insert each
+            self.store.bulk_load(self.storage.load_sorted(), freeze_gc)
+        metrics.count('contacts_loaded', len(self.store))
+        return time.perf_counter() - start
+
+    def close(self):
+        """Close the storage (raises if it could not save everything) and the feed"""
+        try:
+            self.storage.close()
+        finally:
+            if self.feed is not None:
+                self.feed.close()
+
+    def reload_changed(self) -> List[str]:
+        """Pick up categories another process changed since we last read
+        them, returns those types (usually none). Cheap enough to poll.
+        """
+        changed = self.storage.changed_types()
+        if not changed:
+            return []
+        with self._write_lock:
+            for contact_type in changed:
+                self.store.replace_type(contact_type, self.storage.load_type(contact_type))
+        return changed
+
+    # Reads
+
+    def validate(self, name: str, phone: str, email: str, contact_type: str) -> Optional[str]:
+        """The input form's rules, returns the error message or None"""
+        return validate_contact(name, phone, email, contact_type, self.contact_types)
+
+    def exists(self, name: str, phone: str) -> bool:
+        """Duplicate check, answered by the backend index when it has one"""
+        if self.storage.indexed:
+            return self.storage.find(name, phone) is not None
+        return self.store.find(name, phone) is not None
+
+    def find(self, name: str, phone: str) -> Optional[ContactNode]:
+        return self.store.find(name, phone)
+
+    def lookup_by_phone(self, phone: str) -> List[ContactNode]:
+        """Who owns this number? Any formatting of the number matches"""
+        return self.store.lookup_by_phone(phone)
+
+    def lookup_by_email(self, email: str) -> List[ContactNode]:
+        return self.store.lookup_by_email(email)
+
+    def duplicate_report(self, cross_type_only: bool = False) -> List[DuplicateGroup]:
+        """Contacts sharing a phone number or email, see ContactStore.duplicate_report"""
+        return self.store.duplicate_report(cross_type_only)
+
+    def query(self, query: ContactQuery, cancel_event: Optional[threading.Event] = None) -> Sequence[ContactNode]:
+        """Contacts matching query, in name order or by query.sort.
+
+        Read under ``store.lock.read()`` when the result is used after a
+        possible change, e.g. to page through it. Setting cancel_event
+        stops a search that scans files (lazy mode) with an empty result.
+        """
+        # A type filter alone is timed apart from name searches
+        with metrics.span('search' if query.name else 'filter'):
+            if self.storage.indexed and (query.name or query.contact_type) and not query.fuzzy:
+                # Let the backend's name and type indexes answer the query
+                records = self.storage.search(query.name, query.contact_type)
+                metrics.count('rows_scanned', len(records))
+                nodes = [ContactNode(r['name'], r['phone'], r['email'], r['type']) for r in records]
+                if query.sort is None or (query.sort == 'name' and not query.descending):
+                    return nodes
+                return sort_contacts(nodes, query.sort, query.descending)
+            # Per-type partitions and name indexes kept by the contact store
+            return self._query_store(query, cancel_event)
+
+    def _query_store(self, query: ContactQuery, cancel_event: Optional[threading.Event]) -> Sequence[ContactNode]:
+        return self.store.query(query)
+
+    def type_counts(self) -> Dict[str, int]:
+        """Number of contacts per known type, zero for types nobody has yet"""
+        counts = self.store.type_counts()
+        return {contact_type: counts.get(contact_type, 0) for contact_type in self.contact_types}
+
+    def add_contact_type(self, contact_type: str) -> str:
+        """Register a user-defined contact type, returns its name as stored;
+        raises ContactError if the name is rejected"""
+        contact_type = contact_type.strip().lower()
+        error = validate_contact_type(contact_type, self.contact_types)
+        if error:
+            raise ContactError(error)
+        with self._write_lock:
+            try:
+                self.storage.add_contact_type(contact_type)
+            except OSError as e:
+                raise ContactError(f"Could not save contact types: {e}")
+            if contact_type not in self.contact_types:
+                self.contact_types.append(contact_type)
+        return contact_type
+
+    @staticmethod
+    def to_record(contact: ContactNode) -> Record:
+        return make_record(contact.name, contact.phone, contact.email, contact.contact_type)
+
+    # Changes
+
+    def _check(self, name: str, phone: str, email: str, contact_type: str):
+        error = self.validate(name, phone, email, contact_type)
+        if error:
+            raise ContactError(error)
+
+    def add(self, name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        """Validate and store a new contact, raises ContactError if it is rejected"""
+        self._check(name, phone, email, contact_type)
+        with self._write_lock:
+            if self.exists(name, phone):
+                raise DuplicateContactError("Contact with this name and phone number already exists!")
+            node = self.store.insert(name, phone, email, contact_type)
+            record = make_record(name, phone, email, contact_type)
+            try:
+                with metrics.span('save'):
+                    self.storage.add(record)
+            except Exception as e:
+                self.store.delete(name, phone)
+                raise ContactError(f"Could not save contact to file: {e}")
+            self._record([(None, record)])
+            self.history.record(Operation(f"add {name}", [(None, record)]))
+        return node
+
+    def add_many(self, records: List[Record]):
+        """Store new contacts already validated and checked for duplicates, as one
+        undoable batch (bulk_io.iter_import calls this once per batch).
+
+        Raises ContactError, with none of them added, if they cannot be saved.
+        """
+        with self._write_lock:
+            for record in records:
+                self.store.insert(record['name'], record['phone'], record['email'], record['type'])
+            try:
+                with metrics.span('save'):
+                    self.storage.add_many(records)
+            except Exception as e:
+                for record in records:
+                    self.store.delete(record['name'], record['phone'])
+                raise ContactError(f"Could not save contacts to file: {e}")
+            changes = [(None, record) for record in records]
+            self._record(changes)
+            self.history.record(Operation(f"import {len(records)} contacts", changes))
+
+    def update(self, old_name: str, old_phone: str,
+               name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        """Replace the contact stored as (old_name, old_phone), returns the new node"""
+        self._check(name, phone, email, contact_type)
+        with self._write_lock:
+            old = self.store.find(old_name, old_phone)
+            if old is None:
+                raise ContactNotFoundError("Contact not found!")
+            if (name.strip(), phone.strip()) != (old.name.strip(), old.phone.strip()) and self.exists(name, phone):
+                raise DuplicateContactError("Contact with this name and phone number already exists!")
+            old_record = self.to_record(old)
+            self.store.delete(old_name, old_phone)
+            node = self.store.insert(name, phone, email, contact_type)
+            record = make_record(name, phone, email, contact_type)
+            # One storage call, so backends can apply it as a single operation
+            try:
+                with metrics.span('save'):
+                    self.storage.update(old_name, old_phone, old.contact_type, record)
+            except Exception as e:
+                self.store.delete(name, phone)
+                self.store.insert(old.name, old.phone, old.email, old.contact_type)
+                raise ContactError(f"Could not save contact to file: {e}")
+            self._record([(old_record, record)])
+            self.history.record(Operation(f"update {name}", [(old_record, record)]))
+        return node
+
+    def delete(self, name: str, phone: str) -> bool:
+        """Delete a contact, returns False if the storage did not have it.
+
+        Raises ContactError if the contact is not loaded at all.
+        """
+        with self._write_lock, metrics.span('delete'):
+            node = self.store.find(name, phone)
+            if node is None:
+                raise ContactNotFoundError("Contact not found!")
+            self.store.delete(name, phone)
+            record = self.to_record(node)
+            self.history.record(Operation(f"delete {node.name}", [(record, None)]))
+            deleted = self.storage.delete(name, phone, node.contact_type)
+            self._record([(record, None)])
+            return deleted
+
+    # Batches
+
+    def _records(self, keys: Iterable[Tuple[str, str]]) -> List[Record]:
+        """The stored contacts for (name, phone) keys, each once"""
+        records = []
+        seen = set()
+        for name, phone in keys:
+            key = (name.strip(), phone.strip())
+            if key in seen:
+                continue
+            node = self.store.find(*key)
+            if node is None:
+                raise ContactNotFoundError(f"Contact '{name}' not found!")
+            # By key, not node: a paged store may hand out a new node for the same row
+            seen.add(key)
+            records.append(self.to_record(node))
+        return records
+
+    def _check_batch(self, changes: List[Change]):
+        """Reject a batch with an invalid contact, an unknown old one or a duplicate"""
+        removed = set()
+        for old, _ in changes:
+            if old is not None:
+                key = (old['name'].strip(), old['phone'].strip())
+                if self.store.find(*key) is None:
+                    raise ContactNotFoundError(f"Contact '{old['name']}' not found!")
+                removed.add(key)
+        added = set()
+        for _, new in changes:
+            if new is None:
+                continue
+            self._check(new['name'], new['phone'], new['email'], new['type'])
+            key = (new['name'].strip(), new['phone'].strip())
+            if key in added or (key not in removed and self.store.find(*key) is not None):
+                raise DuplicateContactError(
+                    f"Contact '{new['name']}' with this phone number already exists!")
+            added.add(key)
+
+    def _record(self, changes: List[Change]):
+        """Append saved changes to the change feed, if there is one"""
+        if self.feed is None:
+            return
+        try:
+            self.feed.record(changes)
+        except OSError as e:
+            # The change is saved: only other stores miss it until a full sync
+            logger.error("Error recording %d changes in the change feed: %s", len(changes), e)
+
+    def _apply(self, operation: Operation, record: bool = True) -> BatchResult:
+        """Apply an operation to the store and then the storage; caller holds _write_lock.
+        Changes pulled from another store are not recorded again (record=False)."""
+        with gc_paused():
+            self._check_batch(operation.changes)
+            removed, added = self.store.apply_changes(operation.changes)
+            try:
+                with metrics.span('save'):
+                    self.storage.apply_batch(operation.changes)
+            except Exception as e:
+                self.store.apply_changes(operation.inverse().changes)
+                raise ContactError(f"Could not save changes to file: {e}")
+        if record:
+            self._record(operation.changes)
+        return BatchResult(operation, removed, added)
+
+    def apply(self, label: str, changes: List[Change]) -> BatchResult:
+        """Apply (old, new) contact pairs as one undoable batch"""
+        with self._write_lock:
+            result = self._apply(Operation(label, changes))
+            self.history.record(result.operation)
+        return result
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]) -> BatchResult:
+        """Delete the contacts stored as (name, phone) keys"""
+        with self._write_lock, metrics.span('delete'):
+            records = self._records(keys)
+            result = self._apply(Operation(f"delete {len(records)} contacts",
+                                           [(record, None) for record in records]))
+            self.history.record(result.operation)
+        return result
+
+    def retype_many(self, keys: Iterable[Tuple[str, str]], contact_type: str) -> BatchResult:
+        """Move contacts to another type"""
+        return self.edit_many(keys, contact_type=contact_type)
+
+    def edit_many(self, keys: Iterable[Tuple[str, str]], email: Optional[str] = None,
+                  contact_type: Optional[str] = None) -> BatchResult:
+        """Set the email and/or type of many contacts; None keeps each one's own"""
+        with self._write_lock:
+            changes = []
+            for old in self._records(keys):
+                new = make_record(old['name'], old['phone'],
+                                  old['email'] if email is None else email,
+                                  old['type'] if contact_type is None else contact_type)
+                if new != old:
+                    changes.append((old, new))
+            label = f"move {len(changes)} contacts to {contact_type}" if email is None \
+                else f"edit {len(changes)} contacts"
+            result = self._apply(Operation(label, changes))
+            self.history.record(result.operation)
+        return result
+
+    # Sync
+
+    def _stored(self, key: Key) -> Optional[Record]:
+        node = self.store.find(*key)
+        return self.to_record(node) if node is not None else None
+
+    def pull(self, source: 'ContactService') -> SyncResult:
+        """Apply the changes another store made (or pulled) since our last pull
+        from it; of two versions of a contact the later one wins.
+
+        Only the other feed's entries after our watermark are read, the
+        latest per contact, so the cost grows with the changes, not with
+        the contacts. The first pull from a store also compares the
+        contacts it stored before its feed recorded them (a full scan).
+        Raises ContactError if the changes cannot be saved; nothing is
+        applied then and the next pull tries again.
+        """
+        if self.feed is None or source.feed is None:
+            raise ContactError("Syncing needs a change feed on both stores")
+        with metrics.span('sync'):
+            since = self.feed.watermark(source.feed.node)
+            watermark = source.feed.refresh()
+            if since is not None and since > watermark:
+                # The other store's feed was started over: compare everything again
+                since = None
+            entries = source.feed.changes_since(since or 0, self.feed.node)
+            if since is None:
+                with source.store.lock.read():
+                    entries = source.feed.baseline(source.to_record(node) for node in source.store) + entries
+            for contact_type in sorted({e.record['type'] for e in entries if e.record is not None}):
+                if contact_type not in self.contact_types:
+                    self.add_contact_type(contact_type)
+            with self._write_lock, self.feed.locked():
+                changes, accepted = self.feed.resolve(entries, self._stored, source.feed.node)
+                if changes:
+                    self._apply(Operation(f"sync {len(changes)} contacts", changes), record=False)
+                self.feed.append(accepted)
+                self.feed.set_watermark(source.feed.node, watermark)
+        metrics.count('contacts_synced', len(changes))
+        return SyncResult(len(entries), len(changes), watermark)
+
+    def sync(self, other: 'ContactService') -> Tuple[SyncResult, SyncResult]:
+        """Exchange changes both ways, returns (pulled here, pulled there)"""
+        return self.pull(other), other.pull(self)
+
+    def undo(self) -> Optional[BatchResult]:
+        """Revert the most recent change, None if there is nothing to undo"""
+        with self._write_lock:
+            if not self.history.undo_stack:
+                return None
+            operation = self.history.undo_stack[-1]
+            result = self._apply(operation.inverse())
+            self.history.redo_stack.append(self.history.undo_stack.pop())
+        return result
+
+    def redo(self) -> Optional[BatchResult]:
+        """Re-apply the most recently undone change, None if there is none"""
+        with self._write_lock:
+            if not self.history.redo_stack:
+                return None
+            operation = self.history.redo_stack[-1]
+            result = self._apply(operation)
+            self.history.undo_stack.append(self.history.redo_stack.pop())
+        return result
+
+
+class PagedContactService(ContactService):
+    """ContactService in lazy mode: contacts stay in the category files.
+
+    The store is a PagedContactStore, which indexes the files (or reuses
+    their saved indexes) instead of loading them, and reads pages of
+    contacts through an LRU cache as they are shown or searched. Changes
+    go to the storage first and the touched categories are re-indexed
+    after. Only the JSON-lines files can be paged, since they are sorted
+    by name on disk.
+    """
+    def __init__(self, storage: JsonLinesStorage, contact_types: Optional[List[str]] = None,
+                 max_pages: int = 256, feed: Optional[ChangeFeed] = None):
+        super().__init__(storage, contact_types, feed)
+        self.store = PagedContactStore(storage.directory, self.contact_types, max_pages)
+
+    def load(self, freeze_gc: bool = False) -> float:
+        """Index the category files, returns the seconds it took; freeze_gc is
+        ignored, as no contacts are loaded"""
+        start = time.perf_counter()
+        with metrics.span('load'):
+            self.storage.recover()
+            self.store.open()
+        return time.perf_counter() - start
+
+    def reload_changed(self) -> List[str]:
+        if not self.store.loaded:
+            return []
+        with self._write_lock:
+            changed = self.store.changed_types()
+            self.store.refresh(changed)
+        return changed
+
+    def exists(self, name: str, phone: str) -> bool:
+        return self.store.find(name, phone) is not None
+
+    def _query_store(self, query: ContactQuery, cancel_event: Optional[threading.Event]) -> Sequence[ContactNode]:
+        if query.sort not in (None, 'name') or query.descending:
+            # The category files are only in ascending name order
+            raise ContactError("Lazy mode only lists contacts by name; start without --lazy to sort")
+        return self.store.query(query, cancel_event)
+
+    def duplicate_report(self, cross_type_only: bool = False) -> List[DuplicateGroup]:
+        raise ContactError("The duplicate report needs every contact in memory; start without --lazy")
+
+    def add_contact_type(self, contact_type: str) -> str:
+        contact_type = super().add_contact_type(contact_type)
+        self.store.add_contact_type(contact_type)
+        return contact_type
+
+    def _loaded(self):
+        if not self.store.loaded:
+            raise ContactError("Contacts are still being indexed, try again in a moment")
+
+    def add(self, name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        self._loaded()
+        try:
+            return super().add(name, phone, email, contact_type)
+        finally:
+            self.store.refresh()
+
+    def add_many(self, records: List[Record]):
+        self._loaded()
+        try:
+            super().add_many(records)
+        finally:
+            self.store.refresh()
+
+    def update(self, old_name: str, old_phone: str,
+               name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        self._loaded()
+        try:
+            return super().update(old_name, old_phone, name, phone, email, contact_type)
+        finally:
+            self.store.refresh()
+
+    def delete(self, name: str, phone: str) -> bool:
+        self._loaded()
+        try:
+            return super().delete(name, phone)
+        finally:
+            self.store.refresh()
+
+    def _apply(self, operation: Operation, record: bool = True) -> BatchResult:
+        self._loaded()
+        try:
+            return super()._apply(operation, record)
+        finally:
+            self.store.refresh()
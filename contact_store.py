@@ -0,0 +1,1208 @@
+import bisect
+import gc
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import chain, filterfalse
+from operator import attrgetter, itemgetter
+from typing import Callable, Collection, Optional, Dict, List, Set, Tuple, Iterable, Iterator, Sequence, Union
+
+from instrumentation import metrics
+from search_index import NameSearchIndex, SearchResult
+
+
+@contextmanager
+def gc_paused():
+    """Pause the garbage collector while creating many objects that stay alive,
+    which would otherwise trigger repeated full collections that find nothing"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+SortKey = Tuple[str, int]
+# (old contact dict, new contact dict); None on one side adds or deletes
+Change = Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]
+
+# Columns the contact list can be sorted by, see ContactQuery.sort
+SORT_COLUMNS = ('name', 'phone', 'email', 'type')
+
+
+def validate_contact(name: str, phone: str, email: str, contact_type: str,
+                     contact_types: Optional[List[str]] = None) -> Optional[str]:
+    """Check one contact against the input rules, returns the error message or None"""
+    # Check required fields
+    if not name:
+        return "Name is required!"
+
+    if not phone:
+        return "Phone number is required!"
+
+    if not contact_type:
+        return "Contact type is required!"
+
+    if contact_types is not None and contact_type not in contact_types:
+        return f"Unknown contact type '{contact_type}'!"
+
+    # Validate phone number
+    if len(phone) != 10 or not phone.isdigit():
+        return "Phone number must be exactly 10 digits!"
+
+    # Validate email if provided
+    if email and '@' not in email:
+        return "Email must contain '@' symbol!"
+
+    return None
+
+
+def validate_contact_type(contact_type: str, contact_types: List[str]) -> Optional[str]:
+    """Check the name of a new contact type, returns the error message or None"""
+    if not contact_type:
+        return "Type name is required!"
+
+    if contact_type in contact_types:
+        return f"Contact type '{contact_type}' already exists!"
+
+    # The name is used in file names, e.g. contacts/<type>.txt
+    if len(contact_type) > 32 or not re.fullmatch(r'[a-z][a-z0-9_]*', contact_type):
+        return "Type name must be a lowercase letter followed by up to 31 letters, digits or '_'!"
+
+    return None
+
+
+def normalize_phone(phone: str) -> str:
+    """Digits only, without a country or trunk prefix: '+91 98450-12345' -> '9845012345'"""
+    phone = str(phone).strip()
+    if not phone.isdigit():
+        phone = ''.join(ch for ch in phone if ch.isdigit())
+    return phone[-10:] if len(phone) > 10 else phone
+
+
+def normalize_email(email: str) -> str:
+    """Case-insensitive email key, '' for no email"""
+    email = str(email).strip()
+    key = email.lower()
+    # Most emails are already lowercase: keep the contact's own string then
+    return email if key == email else key
+
+
+def collation_key(value: str) -> str:
+    """Case-insensitive sort key of a phone, email or contact type"""
+    key = value.casefold()
+    # Phones, types and most emails are already folded: keep the contact's own string then
+    return value if key == value else key
+
+
+def _name_key(node: 'ContactNode') -> str:
+    # Store and paged nodes carry the lowercase name first in their sort_key
+    return node.sort_key[0] if node.sort_key is not None else node.name.lower()
+
+
+# Per column, the key contacts are sorted by, ties keeping their order
+COLUMN_KEYS: Dict[str, Callable[['ContactNode'], str]] = {
+    'name': _name_key,
+    'phone': lambda node: collation_key(node.phone),
+    'email': lambda node: collation_key(node.email),
+    'type': lambda node: collation_key(node.contact_type),
+}
+
+
+def sort_contacts(contacts: Iterable['ContactNode'], column: str, descending: bool = False) -> List['ContactNode']:
+    """Contacts sorted by one of SORT_COLUMNS; equal values keep their order
+    (name order for query results), also when descending"""
+    return sorted(contacts, key=COLUMN_KEYS[column], reverse=descending)
+
+
+class _Top:
+    """Sorts after everything, to bisect past every key starting with a value"""
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_TOP = _Top()
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer.
+
+    Writers take priority: once a writer is waiting, new readers wait
+    behind it, so a steady stream of searches cannot starve an add. Both
+    sides are re-entrant, and the writing thread may also call ``read()``.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # Read depth per reading thread
+        self._readers: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            # Already exclusive
+            yield
+            return
+        with self._cond:
+            if me not in self._readers:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers[me] -= 1
+                if not self._readers[me]:
+                    del self._readers[me]
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                if me in self._readers:
+                    raise RuntimeError("cannot upgrade a read lock to a write lock")
+                self._writers_waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class ContactNode:
+    """Node for linked list implementation"""
+    # No per-node __dict__: a store holds millions of these
+    __slots__ = ('name', 'phone', 'email', 'contact_type', 'next', 'sort_key')
+
+    def __init__(self, name: str, phone: str, email: str, contact_type: str):
+        self.name = name
+        self.phone = phone
+        self.email = email
+        # One shared string per type instead of a copy per contact
+        self.contact_type = sys.intern(contact_type)
+        self.next: Optional['ContactNode'] = None
+        # (lowercase name, insertion sequence), assigned by ContactStore
+        self.sort_key: Optional[SortKey] = None
+
+
+class ContactLinkedList:
+    """Linked list to store contacts in alphabetical order"""
+    def __init__(self):
+        self.head: Optional[ContactNode] = None
+
+    def insert(self, name: str, phone: str, email: str, contact_type: str):
+        """Insert contact in alphabetical order"""
+        new_node = ContactNode(name, phone, email, contact_type)
+
+        if not self.head or self.head.name.lower() > name.lower():
+            new_node.next = self.head
+            self.head = new_node
+            return
+
+        current = self.head
+        while current.next and current.next.name.lower() < name.lower():
+            current = current.next
+
+        new_node.next = current.next
+        current.next = new_node
+
+    def delete(self, name: str, phone: str) -> bool:
+        """Delete contact by name and phone"""
+        if not self.head:
+            return False
+
+        # Convert to strings and strip for comparison
+        search_name = str(name).strip()
+        search_phone = str(phone).strip()
+
+        # Check head node
+        if (str(self.head.name).strip() == search_name and
+            str(self.head.phone).strip() == search_phone):
+            self.head = self.head.next
+            return True
+
+        current = self.head
+        while current.next:
+            if (str(current.next.name).strip() == search_name and
+                str(current.next.phone).strip() == search_phone):
+                current.next = current.next.next
+                return True
+            current = current.next
+
+        return False
+
+    def find(self, name: str, phone: str) -> Optional[ContactNode]:
+        """Find contact by name and phone"""
+        current = self.head
+        while current:
+            # Convert to strings and strip for comparison
+            if (str(current.name).strip() == str(name).strip() and
+                str(current.phone).strip() == str(phone).strip()):
+                return current
+            current = current.next
+        return None
+
+    def get_all_contacts(self) -> List[ContactNode]:
+        """Get all contacts as a list"""
+        contacts = []
+        current = self.head
+        while current:
+            contacts.append(current)
+            current = current.next
+        return contacts
+
+
+class SortedContactList:
+    """Contacts kept in sort_key order, split into small sorted buckets.
+
+    Each bucket holds at most ``2 * load`` nodes, so an insert or delete
+    costs a bisect over the bucket maxima plus a short list shift instead
+    of a walk over every contact. Given a key function, contacts are kept
+    in that key's order instead; keys must be unique and never change.
+    """
+    def __init__(self, load: int = 512, key: Optional[Callable[['ContactNode'], tuple]] = None):
+        self._load = load
+        self._key_of = key or attrgetter('sort_key')
+        self._keys: List[List[SortKey]] = []
+        self._nodes: List[List[ContactNode]] = []
+        self._maxes: List[SortKey] = []
+        self._len = 0
+        # Prefix counts per bucket for positional access, rebuilt lazily
+        self._offsets: Optional[List[int]] = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return chain.from_iterable(self._nodes)
+
+    def add(self, node: ContactNode):
+        """Insert a node at its sorted position"""
+        key = self._key_of(node)
+        self._len += 1
+        self._offsets = None
+
+        if not self._maxes:
+            self._keys.append([key])
+            self._nodes.append([node])
+            self._maxes.append(key)
+            return
+
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            # Larger than everything, goes at the end of the last bucket
+            pos -= 1
+            self._keys[pos].append(key)
+            self._nodes[pos].append(node)
+            self._maxes[pos] = key
+        else:
+            keys = self._keys[pos]
+            idx = bisect.bisect_left(keys, key)
+            keys.insert(idx, key)
+            self._nodes[pos].insert(idx, node)
+
+        if len(self._keys[pos]) > 2 * self._load:
+            self._split(pos)
+
+    def remove(self, node: ContactNode) -> bool:
+        """Remove a node, returns False if it is not in the list"""
+        key = self._key_of(node)
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return False
+
+        keys = self._keys[pos]
+        idx = bisect.bisect_left(keys, key)
+        if idx == len(keys) or self._nodes[pos][idx] is not node:
+            return False
+
+        del keys[idx]
+        del self._nodes[pos][idx]
+        self._len -= 1
+        self._offsets = None
+
+        if not keys:
+            del self._keys[pos]
+            del self._nodes[pos]
+            del self._maxes[pos]
+        else:
+            self._maxes[pos] = keys[-1]
+        return True
+
+    def remove_many(self, nodes: Collection[ContactNode]):
+        """Remove many nodes, filtering each bucket once instead of one shift per node"""
+        if len(nodes) * 64 < self._len:
+            for node in nodes:
+                self.remove(node)
+            return
+        is_removed = set(nodes).__contains__
+        key_of = self._key_of
+        kept_keys, kept_nodes = [], []
+        for bucket in self._nodes:
+            bucket = list(filterfalse(is_removed, bucket))
+            if bucket:
+                kept_nodes.append(bucket)
+                kept_keys.append(list(map(key_of, bucket)))
+        self._len -= sum(map(len, self._nodes)) - sum(map(len, kept_nodes))
+        self._nodes = kept_nodes
+        self._keys = kept_keys
+        self._maxes = [keys[-1] for keys in kept_keys]
+        self._offsets = None
+
+    def add_many(self, nodes: Collection[ContactNode]):
+        """Insert many nodes, walking the buckets once in key order instead of one bisect of maxes per node"""
+        if len(nodes) < 64 or not self._maxes:
+            for node in nodes:
+                self.add(node)
+            return
+        maxes = self._maxes
+        last = len(maxes) - 1
+        pos = 0
+        lo = 0
+        for key, node in sorted(zip(map(self._key_of, nodes), nodes), key=itemgetter(0)):
+            if maxes[pos] < key:
+                while pos < last and maxes[pos] < key:
+                    pos += 1
+                lo = 0
+            keys = self._keys[pos]
+            if pos == last and maxes[pos] < key:
+                maxes[pos] = key
+            lo = bisect.bisect_left(keys, key, lo)
+            keys.insert(lo, key)
+            self._nodes[pos].insert(lo, node)
+            lo += 1
+        self._len += len(nodes)
+        self._offsets = None
+
+        load = self._load
+        for pos in reversed(range(len(maxes))):
+            keys = self._keys[pos]
+            if len(keys) > 2 * load:
+                nodes = self._nodes[pos]
+                starts = range(0, len(keys), load)
+                self._keys[pos:pos + 1] = [keys[i:i + load] for i in starts]
+                self._nodes[pos:pos + 1] = [nodes[i:i + load] for i in starts]
+                self._maxes[pos:pos + 1] = [keys[min(i + load, len(keys)) - 1] for i in starts]
+
+    def build(self, nodes: List[ContactNode]):
+        """Replace the contents with nodes that are already in key order"""
+        load = self._load
+        self._nodes = [nodes[i:i + load] for i in range(0, len(nodes), load)]
+        self._keys = [list(map(self._key_of, bucket)) for bucket in self._nodes]
+        self._maxes = [keys[-1] for keys in self._keys]
+        self._len = len(nodes)
+        self._offsets = None
+
+    def __getitem__(self, index: int) -> ContactNode:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("contact index out of range")
+        offsets = self._get_offsets()
+        pos = bisect.bisect_right(offsets, index) - 1
+        return self._nodes[pos][index - offsets[pos]]
+
+    def index(self, node: ContactNode) -> int:
+        """Position of a node in sorted order"""
+        key = self._key_of(node)
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos < len(self._maxes):
+            idx = bisect.bisect_left(self._keys[pos], key)
+            if idx < len(self._keys[pos]) and self._nodes[pos][idx] is node:
+                return self._get_offsets()[pos] + idx
+        raise ValueError("contact is not in the list")
+
+    def key_at(self, index: int):
+        """The key of the node at a position (0 <= index < len)"""
+        offsets = self._get_offsets()
+        pos = bisect.bisect_right(offsets, index) - 1
+        return self._keys[pos][index - offsets[pos]]
+
+    def bisect_left(self, key) -> int:
+        """Position of the first node whose key is not below key"""
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._get_offsets()[pos] + bisect.bisect_left(self._keys[pos], key)
+
+    def _get_offsets(self) -> List[int]:
+        if self._offsets is None:
+            offsets = []
+            total = 0
+            for bucket in self._nodes:
+                offsets.append(total)
+                total += len(bucket)
+            self._offsets = offsets
+        return self._offsets
+
+    def _split(self, pos: int):
+        half = self._load
+        keys = self._keys[pos]
+        nodes = self._nodes[pos]
+        self._keys[pos:pos + 1] = [keys[:half], keys[half:]]
+        self._nodes[pos:pos + 1] = [nodes[:half], nodes[half:]]
+        self._maxes[pos:pos + 1] = [keys[half - 1], keys[-1]]
+
+
+class ContactView(Sequence):
+    """Read-only, live view of a sorted contact list.
+
+    Handed out instead of a copied list, so listing a million contacts
+    costs nothing until rows are actually read.
+    """
+    __slots__ = ('_contacts',)
+
+    def __init__(self, contacts: SortedContactList):
+        self._contacts = contacts
+
+    def __len__(self) -> int:
+        return len(self._contacts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._contacts[i] for i in range(*index.indices(len(self)))]
+        return self._contacts[index]
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return iter(self._contacts)
+
+    def index(self, node: ContactNode, *args) -> int:
+        return self._contacts.index(node)
+
+
+class DescendingView(Sequence):
+    """Read-only, live view of a sorted contact list backwards by the first
+    item of its keys (the name, or a column's value), contacts with an
+    equal value keeping their ascending order, as a stable sort would.
+
+    Each row costs two bisects to find its run of equal values, so the
+    view is as cheap to page through as the list itself.
+    """
+    __slots__ = ('_contacts',)
+
+    def __init__(self, contacts: SortedContactList):
+        self._contacts = contacts
+
+    def __len__(self) -> int:
+        return len(self._contacts)
+
+    def _run(self, position: int) -> Tuple[int, int]:
+        """Ascending positions [start, end) of the run of equal values around position"""
+        value = self._contacts.key_at(position)[0]
+        return self._contacts.bisect_left((value,)), self._contacts.bisect_left((value, _TOP))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        size = len(self._contacts)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("contact index out of range")
+        # Runs come in reverse, so the run holding the index-th row from the
+        # end holds this one, at the same offset from the run's other side
+        start, end = self._run(size - 1 - index)
+        return self._contacts[start + index - (size - end)]
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        contacts = self._contacts
+        run: List[ContactNode] = []
+        value = None
+        for keys, nodes in zip(reversed(contacts._keys), reversed(contacts._nodes)):
+            for key, node in zip(reversed(keys), reversed(nodes)):
+                if run and key[0] != value:
+                    yield from reversed(run)
+                    run = []
+                value = key[0]
+                run.append(node)
+        yield from reversed(run)
+
+    def index(self, node: ContactNode, *args) -> int:
+        position = self._contacts.index(node)
+        start, end = self._run(position)
+        return len(self._contacts) - end + position - start
+
+
+class ChainedView(Sequence):
+    """Contact sequences shown one after the other, e.g. each type's contacts
+    in type order. Valid until the next change to any of them."""
+    __slots__ = ('_parts', '_starts', '_len')
+
+    def __init__(self, parts: Iterable[Sequence]):
+        self._parts = [part for part in parts if len(part)]
+        self._starts = []
+        total = 0
+        for part in self._parts:
+            self._starts.append(total)
+            total += len(part)
+        self._len = total
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("contact index out of range")
+        pos = bisect.bisect_right(self._starts, index) - 1
+        return self._parts[pos][index - self._starts[pos]]
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return chain.from_iterable(self._parts)
+
+    def index(self, node: ContactNode, *args) -> int:
+        for start, part in zip(self._starts, self._parts):
+            try:
+                return start + part.index(node)
+            except ValueError:
+                continue
+        raise ValueError("contact is not in the list")
+
+
+@dataclass(frozen=True)
+class ContactQuery:
+    """What the contact list should show: a name substring and/or one contact type.
+
+    With fuzzy, name words may contain typos and results come closest first.
+    sort names one of SORT_COLUMNS to order the results by instead, ties
+    in name order (None keeps name or closeness order).
+    """
+    name: str = ''
+    contact_type: Optional[str] = None
+    fuzzy: bool = False
+    sort: Optional[str] = None
+    descending: bool = False
+
+
+class QueryCache:
+    """Recent query results, least recently used first, within ``max_bytes``.
+
+    Each result is stored with the generation of the contacts it came
+    from (ContactStore.generation_of) and only returned while that is
+    unchanged, so a change to one type leaves results for other types
+    cached. Sizes are estimates of the lists a result holds, not counting
+    the contacts, which the store keeps anyway. Results are shared by
+    every caller and must not be modified.
+    """
+    # Rough cost of an entry's key, tuple and dict slot
+    ENTRY_BYTES = 256
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # query -> (generation, result, bytes)
+        self._entries: 'OrderedDict[ContactQuery, Tuple[int, Sequence, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def result_bytes(cls, result: Sequence) -> int:
+        if isinstance(result, SearchResult):
+            # The matching names and a running count per name
+            return cls.ENTRY_BYTES + 2 * sys.getsizeof(result.names) + 32 * len(result.names)
+        return cls.ENTRY_BYTES + sys.getsizeof(result)
+
+    def get(self, query: ContactQuery, generation: int) -> Optional[Sequence]:
+        """The cached result of query if it is still current, else None"""
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is not None:
+                if entry[0] == generation:
+                    self._entries.move_to_end(query)
+                    self.hits += 1
+                    metrics.count('query_cache_hits')
+                    return entry[1]
+                # Its contacts changed since
+                del self._entries[query]
+                self._bytes -= entry[2]
+            self.misses += 1
+        metrics.count('query_cache_misses')
+        return None
+
+    def put(self, query: ContactQuery, generation: int, result: Sequence):
+        size = self.result_bytes(result)
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(query, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[query] = (generation, result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, freed) = self._entries.popitem(last=False)
+                self._bytes -= freed
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.count('query_cache_evictions', evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Hits, misses and evictions so far, and the entries and bytes held now"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+
+class ReverseIndex:
+    """Contacts by a normalized field (phone or email), for reverse lookups.
+
+    Almost every value belongs to one contact, so a value maps straight to
+    its node and only values shared by several contacts pay for a list.
+    Empty values (no email) are not indexed.
+    """
+    __slots__ = ('field', 'normalize', '_entries')
+
+    def __init__(self, field: str, normalize: Callable[[str], str]):
+        self.field = field
+        self.normalize = normalize
+        self._entries: Dict[str, Union[ContactNode, List[ContactNode]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, node: ContactNode):
+        key = self.normalize(getattr(node, self.field))
+        if not key:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = node
+        elif isinstance(entry, list):
+            entry.append(node)
+        else:
+            self._entries[key] = [entry, node]
+
+    def remove(self, node: ContactNode):
+        key = self.normalize(getattr(node, self.field))
+        entry = self._entries.get(key)
+        if entry is node:
+            del self._entries[key]
+        elif isinstance(entry, list):
+            entry.remove(node)
+            if len(entry) == 1:
+                self._entries[key] = entry[0]
+
+    def get(self, value: str) -> List[ContactNode]:
+        """Contacts whose field normalizes like value, in name order"""
+        entry = self._entries.get(self.normalize(value))
+        if entry is None:
+            return []
+        if isinstance(entry, list):
+            return sorted(entry, key=attrgetter('sort_key'))
+        return [entry]
+
+    def shared(self) -> Iterator[Tuple[str, List[ContactNode]]]:
+        """(value, contacts in name order) for every value held by several contacts"""
+        for key, entry in self._entries.items():
+            if isinstance(entry, list):
+                yield key, sorted(entry, key=attrgetter('sort_key'))
+
+
+@dataclass
+class DuplicateGroup:
+    """Contacts sharing one phone number or email"""
+    field: str
+    value: str
+    contacts: List[ContactNode]
+
+    @property
+    def cross_type(self) -> bool:
+        """Whether the contacts are filed under different types"""
+        return len({contact.contact_type for contact in self.contacts}) > 1
+
+
+class TypePartition:
+    """The contacts of one type, with their own sorted list and name index"""
+    def __init__(self):
+        self.contacts = SortedContactList()
+        self.search_index = NameSearchIndex()
+
+    def __len__(self) -> int:
+        return len(self.contacts)
+
+    def add(self, node: ContactNode):
+        self.contacts.add(node)
+        self.search_index.add(node)
+
+    def remove(self, node: ContactNode):
+        self.contacts.remove(node)
+        self.search_index.remove(node)
+
+    def add_many(self, nodes: List[ContactNode]):
+        self.contacts.add_many(nodes)
+        for node in nodes:
+            self.search_index.add(node)
+
+    def remove_many(self, nodes: List[ContactNode]):
+        self.contacts.remove_many(nodes)
+        self.search_index.remove_many(nodes)
+
+    def build(self, nodes: List[ContactNode], gram_cache: Optional[Dict[str, Set[str]]] = None):
+        self.contacts.build(nodes)
+        self.search_index.build(nodes, gram_cache)
+
+
+class ContactStore:
+    """Contact store with sorted name order and a hash index on (name, phone).
+
+    Drop-in replacement for ContactLinkedList: insert, delete and find no
+    longer scan every contact. A NameSearchIndex is kept in sync on every
+    insert and delete for the live search box, and every contact type has a
+    TypePartition so a typed query only touches that type's contacts.
+    Reverse indexes on the normalized phone and email answer "who owns
+    this number?" and find contacts sharing one across types.
+
+    Changes hold ``lock.write()`` and searches ``lock.read()``, so searches
+    from the GUI's query worker and from server connections run alongside
+    each other and only wait for writes.
+
+    Every change bumps ``generation`` and the generation of each type it
+    touched, which is how ``query_cache`` knows which results are stale.
+    """
+    QUERY_CACHE_BYTES = 32 * 1024 * 1024
+
+    def __init__(self):
+        self.lock = ReadWriteLock()
+        self._sorted = SortedContactList()
+        self.search_index = NameSearchIndex()
+        self._partitions: Dict[str, TypePartition] = {}
+        self._index: Dict[Tuple[str, str], ContactNode] = {}
+        # Extra nodes sharing a (name, phone) key, e.g. loaded from two files
+        self._duplicates: Dict[Tuple[str, str], List[ContactNode]] = {}
+        self._by_phone = ReverseIndex('phone', normalize_phone)
+        self._by_email = ReverseIndex('email', normalize_email)
+        self._seq = 0
+        # Contacts in phone or email order, built the first time the list is
+        # sorted by that column and kept up to date from then on
+        self._columns: Dict[str, SortedContactList] = {}
+        self._columns_lock = threading.Lock()
+        # Bumped on every change, and per type on changes to that type
+        self.generation = 0
+        self._generations: Dict[str, int] = {}
+        self.query_cache = QueryCache(self.QUERY_CACHE_BYTES)
+
+    @staticmethod
+    def _key(name: str, phone: str) -> Tuple[str, str]:
+        return str(name).strip(), str(phone).strip()
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return iter(self._sorted)
+
+    def __getitem__(self, index: int) -> ContactNode:
+        return self._sorted[index]
+
+    def index(self, node: ContactNode) -> int:
+        """Position of a contact in name order"""
+        return self._sorted.index(node)
+
+    def insert(self, name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        """Insert contact in alphabetical order"""
+        node = ContactNode(name, phone, email, contact_type)
+        key = self._key(name, phone)
+
+        with self.lock.write():
+            self._link(node, key)
+            self._sorted.add(node)
+            self.search_index.add(node)
+            self._partition(contact_type).add(node)
+            for column in self._columns.values():
+                column.add(node)
+            self._changed([contact_type])
+        return node
+
+    def _link(self, node: ContactNode, key: Tuple[str, str]):
+        """Give a new node its sort key and enter it in the hash and reverse indexes"""
+        node.sort_key = (self.search_index.shared_name(node.name.lower()), self._seq)
+        self._seq += 1
+        if key in self._index:
+            self._duplicates.setdefault(key, []).append(node)
+        else:
+            self._index[key] = node
+        self._by_phone.add(node)
+        self._by_email.add(node)
+
+    def _changed(self, contact_types: Collection[str]):
+        """Bump the generations of a change to these types; the caller holds the write lock"""
+        if not contact_types:
+            return
+        self.generation += 1
+        generations = self._generations
+        for contact_type in contact_types:
+            generations[contact_type] = generations.get(contact_type, 0) + 1
+
+    def generation_of(self, contact_type: Optional[str]) -> int:
+        """Changes so far to one type's contacts, or to any contact for None"""
+        if contact_type is None:
+            return self.generation
+        return self._generations.get(contact_type, 0)
+
+    def _partition(self, contact_type: str) -> TypePartition:
+        partition = self._partitions.get(contact_type)
+        if partition is None:
+            partition = self._partitions[contact_type] = TypePartition()
+        return partition
+
+    def _insert_records(self, records: Iterable[Dict[str, str]]) -> List[ContactNode]:
+        """Insert contact dicts as one batch; the caller holds the write lock"""
+        nodes = []
+        by_type: Dict[str, List[ContactNode]] = {}
+        for record in records:
+            node = ContactNode(record['name'], record['phone'], record['email'], record['type'])
+            self._link(node, self._key(node.name, node.phone))
+            nodes.append(node)
+            by_type.setdefault(node.contact_type, []).append(node)
+
+        self._sorted.add_many(nodes)
+        for node in nodes:
+            self.search_index.add(node)
+        for contact_type, nodes_of_type in by_type.items():
+            self._partition(contact_type).add_many(nodes_of_type)
+        for column in self._columns.values():
+            column.add_many(nodes)
+        self._changed(by_type)
+        return nodes
+
+    def load(self, records: Iterable[Dict[str, str]]):
+        """Insert contact dicts as read from storage"""
+        for contact in records:
+            self.insert(
+                contact['name'],
+                contact['phone'],
+                contact['email'],
+                contact['type']
+            )
+
+    def bulk_load(self, records: Iterable[Dict[str, str]], freeze_gc: bool = False):
+        """Load contact dicts that arrive in name order (case-insensitive).
+
+        The sorted list, name index and partitions are built in one pass
+        instead of by one insert per contact. Contacts with equal names keep
+        their arrival order, exactly as ``load`` would order them. Falls
+        back to ``load`` when the store already has contacts.
+
+        The garbage collector is paused meanwhile: the million new objects
+        would otherwise trigger repeated full collections that find nothing.
+        With freeze_gc, every object alive afterwards is frozen out of later
+        collections (``gc.freeze``), which would otherwise scan every contact
+        again whenever a batch change allocates enough new objects. That is
+        process-wide and never undone, so only an application that keeps
+        what it has loaded for good should ask for it.
+        """
+        if len(self):
+            self.load(records)
+            return
+
+        with gc_paused():
+            self._bulk_load(records)
+            if freeze_gc:
+                gc.freeze()
+
+    def _bulk_load(self, records: Iterable[Dict[str, str]]):
+        with self.lock.write():
+            nodes: List[ContactNode] = []
+            by_type: Dict[str, List[ContactNode]] = {}
+            index = self._index
+            by_phone = self._by_phone
+            by_email = self._by_email
+            seq = self._seq
+            previous = None
+            for contact in records:
+                name = contact['name']
+                node = ContactNode(name, contact['phone'], contact['email'], contact['type'])
+                lower = name.lower()
+                # Equal names arrive together, so they can share one lowercase string
+                if lower == previous:
+                    lower = previous
+                previous = lower
+                node.sort_key = (lower, seq)
+                seq += 1
+
+                key = self._key(name, node.phone)
+                if key in index:
+                    self._duplicates.setdefault(key, []).append(node)
+                else:
+                    index[key] = node
+                by_phone.add(node)
+                by_email.add(node)
+                nodes.append(node)
+                nodes_of_type = by_type.get(node.contact_type)
+                if nodes_of_type is None:
+                    by_type[node.contact_type] = [node]
+                else:
+                    nodes_of_type.append(node)
+            self._seq = seq
+
+            # Timsort only checks the order when the records really are sorted
+            nodes.sort(key=attrgetter('sort_key'))
+            self._sorted.build(nodes)
+            self._columns = {}
+            self._changed(by_type)
+            self.query_cache.clear()
+            gram_cache: Dict[str, Set[str]] = {}
+            self.search_index.build(nodes, gram_cache)
+            for contact_type, nodes_of_type in by_type.items():
+                nodes_of_type.sort(key=attrgetter('sort_key'))
+                partition = self._partitions[contact_type] = TypePartition()
+                partition.build(nodes_of_type, gram_cache)
+
+    def delete(self, name: str, phone: str) -> bool:
+        """Delete contact by name and phone"""
+        with self.lock.write():
+            node = self._index.get(self._key(name, phone))
+            if node is None:
+                return False
+            self._remove_nodes([node])
+        return True
+
+    def _remove_nodes(self, nodes: List[ContactNode]):
+        """Unlink nodes, promoting a duplicate of a key whose indexed node goes"""
+        by_type: Dict[str, List[ContactNode]] = {}
+        for node in nodes:
+            key = self._key(node.name, node.phone)
+            duplicates = self._duplicates.get(key)
+            if self._index.get(key) is node:
+                if duplicates:
+                    self._index[key] = duplicates.pop(0)
+                else:
+                    del self._index[key]
+            else:
+                duplicates.remove(node)
+            if duplicates is not None and not duplicates:
+                del self._duplicates[key]
+            self._by_phone.remove(node)
+            self._by_email.remove(node)
+            by_type.setdefault(node.contact_type, []).append(node)
+
+        self._sorted.remove_many(nodes)
+        self.search_index.remove_many(nodes)
+        for contact_type, nodes_of_type in by_type.items():
+            self._partitions[contact_type].remove_many(nodes_of_type)
+        for column in self._columns.values():
+            column.remove_many(nodes)
+        self._changed(by_type)
+
+    def _find_record(self, record: Dict[str, str]) -> Optional[ContactNode]:
+        """The node stored for a record, preferring an exact match among duplicates"""
+        key = self._key(record['name'], record['phone'])
+        node = self._index.get(key)
+        if node is None or (node.contact_type == record['type'] and node.email == record['email']):
+            return node
+        for duplicate in self._duplicates.get(key, ()):
+            if duplicate.contact_type == record['type'] and duplicate.email == record['email']:
+                return duplicate
+        return node
+
+    def apply_changes(self, changes: Iterable[Change]) -> Tuple[List[ContactNode], List[ContactNode]]:
+        """Apply (old, new) contact dicts as one batch under one write lock.
+
+        Every old contact is removed first (unknown ones are skipped), then
+        every new one is inserted. Returns (removed nodes, added nodes).
+        The garbage collector is paused meanwhile, as in ``bulk_load``.
+        """
+        changes = list(changes)
+        with gc_paused(), self.lock.write():
+            removed = []
+            seen = set()
+            for old, _ in changes:
+                if old is None:
+                    continue
+                node = self._find_record(old)
+                if node is not None and id(node) not in seen:
+                    seen.add(id(node))
+                    removed.append(node)
+            self._remove_nodes(removed)
+            added = self._insert_records(new for _, new in changes if new is not None)
+        return removed, added
+
+    def replace_type(self, contact_type: str, records: Iterable[Dict[str, str]]) -> Tuple[int, int]:
+        """Make the contacts of one type match records, e.g. after another
+        process rewrote that category file. Only the difference is applied,
+        so unchanged contacts keep their nodes. Returns (removed, added).
+        """
+        wanted = Counter((r['name'], r['phone'], r['email']) for r in records
+                         if r['type'] == contact_type)
+        with self.lock.write():
+            partition = self._partitions.get(contact_type)
+            stale = []
+            for node in list(partition.contacts) if partition is not None else []:
+                fields = (node.name, node.phone, node.email)
+                if wanted[fields] > 0:
+                    wanted[fields] -= 1
+                else:
+                    stale.append(node)
+            self._remove_nodes(stale)
+            added = self._insert_records(
+                {'name': name, 'phone': phone, 'email': email, 'type': contact_type}
+                for (name, phone, email), count in wanted.items() for _ in range(count))
+        return len(stale), len(added)
+
+    def find(self, name: str, phone: str) -> Optional[ContactNode]:
+        """Find contact by name and phone"""
+        return self._index.get(self._key(name, phone))
+
+    def lookup_by_phone(self, phone: str) -> List[ContactNode]:
+        """Contacts with this phone number in any format, in name order"""
+        with self.lock.read():
+            return self._by_phone.get(phone)
+
+    def lookup_by_email(self, email: str) -> List[ContactNode]:
+        """Contacts with this email (case-insensitive), in name order"""
+        with self.lock.read():
+            return self._by_email.get(email)
+
+    def duplicate_report(self, cross_type_only: bool = False) -> List[DuplicateGroup]:
+        """Groups of contacts sharing a phone number or an email, phones first.
+
+        With cross_type_only, only groups spanning several contact types,
+        e.g. the same number filed under both friend and colleague.
+        """
+        with self.lock.read():
+            groups = [DuplicateGroup(index.field, value, contacts)
+                      for index in (self._by_phone, self._by_email)
+                      for value, contacts in sorted(index.shared(), key=itemgetter(0))]
+        if cross_type_only:
+            groups = [group for group in groups if group.cross_type]
+        return groups
+
+    def get_all_contacts(self) -> ContactView:
+        """Get all contacts as a read-only view in name order"""
+        return ContactView(self._sorted)
+
+    def search(self, term: str) -> SearchResult:
+        """Contacts whose name contains term (case-insensitive), in name order"""
+        with self.lock.read():
+            return self.search_index.search(term)
+
+    def query(self, query: ContactQuery) -> Sequence[ContactNode]:
+        """Contacts matching a ContactQuery, in name order or query.sort's.
+
+        A typed query is answered from that type's partition only; with no
+        name term the result is a live sorted view (the store itself when
+        there is no type either). Fuzzy results are ranked by typos first.
+        Without a name term, sorted results are views over the indexes too;
+        search results are sorted on their precomputed keys. Results that
+        had to be computed are kept in ``query_cache`` until their type (or
+        for an untyped query, any contact) changes.
+        """
+        with self.lock.read():
+            if not query.name and (query.contact_type is None or query.sort in (None, 'name', 'type')):
+                # Live views of the indexes: nothing to compute or cache
+                return self._query(query)
+            generation = self.generation_of(query.contact_type)
+            result = self.query_cache.get(query, generation)
+            if result is None:
+                result = self._query(query)
+                self.query_cache.put(query, generation, result)
+            return result
+
+    def _query(self, query: ContactQuery) -> Sequence[ContactNode]:
+        """query without the cache; the caller holds a read lock"""
+        if query.contact_type is None:
+            if not query.name:
+                return self if query.sort is None else self._sort_all(query.sort, query.descending)
+            search_index = self.search_index
+        else:
+            partition = self._partitions.get(query.contact_type)
+            if partition is None:
+                return []
+            if not query.name:
+                if query.sort is None:
+                    return ContactView(partition.contacts)
+                return self._sort_type(partition, query.contact_type, query.sort, query.descending)
+            search_index = partition.search_index
+        if query.fuzzy:
+            result = search_index.fuzzy_search(query.name)
+        else:
+            result = search_index.search(query.name)
+        if query.sort is None or (query.sort == 'name' and not query.fuzzy and not query.descending):
+            return result
+        return sort_contacts(result, query.sort, query.descending)
+
+    def _column_index(self, column: str) -> SortedContactList:
+        """Every contact in phone or email order, ties in name order; caller holds a read lock"""
+        index = self._columns.get(column)
+        if index is not None:
+            return index
+        # Readers may ask at once: one builds, the others wait for it
+        with self._columns_lock:
+            index = self._columns.get(column)
+            if index is None:
+                value = COLUMN_KEYS[column]
+                index = SortedContactList(key=lambda node: (value(node), node.sort_key))
+                with gc_paused():
+                    # A stable sort of the name-ordered contacts on the column alone
+                    # gives the key order, comparing strings instead of tuples
+                    index.build(sorted(self._sorted, key=value))
+                self._columns[column] = index
+        return index
+
+    def _sort_all(self, column: str, descending: bool) -> Sequence[ContactNode]:
+        if column == 'name':
+            return DescendingView(self._sorted) if descending else self
+        if column == 'type':
+            # Each type's partition is already in name order
+            types = sorted(self._partitions, key=collation_key, reverse=descending)
+            return ChainedView(ContactView(self._partitions[contact_type].contacts) for contact_type in types)
+        index = self._column_index(column)
+        return DescendingView(index) if descending else ContactView(index)
+
+    def _sort_type(self, partition: TypePartition, contact_type: str, column: str,
+                   descending: bool) -> Sequence[ContactNode]:
+        if column == 'type' or (column == 'name' and not descending):
+            return ContactView(partition.contacts)
+        if column == 'name':
+            return DescendingView(partition.contacts)
+        if column in self._columns or len(partition) * 8 > len(self):
+            # A large share of the contacts: one pass over the column's index beats sorting them
+            nodes = [node for node in self._column_index(column) if node.contact_type == contact_type]
+            return sort_contacts(nodes, column, descending) if descending else nodes
+        return sort_contacts(partition.contacts, column, descending)
+
+    def type_counts(self) -> Dict[str, int]:
+        """Number of contacts per type, without scanning"""
+        with self.lock.read():
+            return {contact_type: len(partition)
+                    for contact_type, partition in self._partitions.items()}
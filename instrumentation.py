@@ -0,0 +1,169 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class RollingHistogram:
+    """Durations of one span: all-time count and total, percentiles over the
+    last ``size`` samples so they follow what the program is doing now"""
+    def __init__(self, size: int = 1000):
+        self.samples: deque = deque(maxlen=size)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, ms: float):
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def percentile(fraction: float) -> float:
+            return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(percentile(0.5), 3),
+            'p95_ms': round(percentile(0.95), 3),
+            'p99_ms': round(percentile(0.99), 3),
+            'max_ms': round(ordered[-1], 3) if ordered else 0.0,
+        }
+
+
+class Metrics:
+    """Timing spans and counters shared by the store, storage, service and GUI.
+
+    Spans (load, save, delete, search, filter, refresh) keep a
+    RollingHistogram each; counters add up work done (rows scanned, bytes
+    written, tree items inserted). Recording is a dict update under a
+    lock, cheap enough to stay on all the time. Each span is also logged
+    at DEBUG level, with lazy formatting, so it costs nothing more unless
+    debug logging is switched on.
+    """
+    def __init__(self, histogram_size: int = 1000):
+        self.histogram_size = histogram_size
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.spans: Dict[str, RollingHistogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the block as one sample of span name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, ms: float):
+        """Add one duration (milliseconds) measured by the caller"""
+        with self._lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = RollingHistogram(self.histogram_size)
+            histogram.add(ms)
+        logger.debug("%s took %.2f ms", name, ms)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.spans = {}
+            self.counters = {}
+
+    def snapshot(self) -> Dict:
+        """Every span summary and counter, as JSON-ready dicts"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'seconds': round(time.time() - self.started, 3),
+                'spans': {name: histogram.summary() for name, histogram in sorted(self.spans.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def export(self, path: str):
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    def report(self) -> str:
+        """The snapshot as a plain-text table"""
+        snapshot = self.snapshot()
+        lines = [f"{'span':<12} {'count':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)"]
+        for name, s in snapshot['spans'].items():
+            lines.append(f"{name:<12} {s['count']:>8} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} "
+                         f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+        lines.append("")
+        lines += [f"{name:<24} {value:>14,}" for name, value in snapshot['counters'].items()]
+        return '\n'.join(lines)
+
+
+# The process-wide instance everything records into
+metrics = Metrics()
+
+
+class ProfileCapture:
+    """Opt-in cProfile and tracemalloc capture, started and stopped on demand.
+
+    cProfile sees only the thread that called ``start`` (the Tk thread in
+    the GUI); tracemalloc sees allocations from every thread.
+    """
+    def __init__(self, frames: int = 1):
+        self.frames = frames
+        self._profile: Optional[cProfile.Profile] = None
+        self._traced = False
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self):
+        if self.active:
+            return
+        # Someone else may be tracing already; leave their session running afterwards
+        self._traced = not tracemalloc.is_tracing()
+        if self._traced:
+            tracemalloc.start(self.frames)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, limit: int = 25) -> str:
+        """Stop capturing, returns the top functions and allocation sites as text"""
+        if not self.active:
+            return ""
+        self._profile.disable()
+        # Before formatting anything, so the report's own allocations stay out of it
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        if self._traced:
+            tracemalloc.stop()
+
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        self._profile = None
+        current = sum(stat.size for stat in snapshot.statistics('filename'))
+        out.write(f"\nTraced memory: {current / 1024 / 1024:.1f} MiB, top allocation sites:\n")
+        for stat in snapshot.statistics('lineno')[:limit]:
+            out.write(f"  {stat}\n")
+        return out.getvalue()
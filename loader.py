@@ -0,0 +1,100 @@
+import heapq
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from typing import Optional, Dict, List, Tuple, Iterator
+
+from blockfile import CorruptBlockError, compression_of, content_size, iter_blocks, open_category
+from codec import RecordCodec, get_codec
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, str]
+
+# Below this many bytes in total, starting worker processes costs more than it saves
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+Row = Tuple[str, str, str, str, str]
+
+
+def parse_category_file(filename: str, codec: Optional[RecordCodec] = None) -> Tuple[List[Row], int]:
+    """Parse one category file into sorted (lowercase name, name, phone, email, type) rows.
+
+    Runs in a worker process, so it returns plain tuples (cheap to pickle)
+    and the number of lines that could not be parsed, counting those of
+    corrupt blocks in a compressed file.
+    """
+    codec = codec or get_codec()
+    decode = codec.decode
+    rows: List[Row] = []
+    errors = 0
+    if not os.path.exists(filename):
+        return rows, errors
+    if compression_of(filename) is not None:
+        corrupt: List[CorruptBlockError] = []
+        with open_category(filename) as reader:
+            for _, lines in iter_blocks(reader, corrupt):
+                for line in lines:
+                    if not line or line.isspace():
+                        continue
+                    fields = decode(line)
+                    if fields is None:
+                        errors += 1
+                    else:
+                        rows.append((fields[0].lower(),) + fields)
+        for error in corrupt:
+            logger.error("Skipped contacts: %s", error)
+            errors += max(error.lines, 1)
+    else:
+        with open(filename, 'r') as f:
+            for line in f:
+                if line.isspace():
+                    continue
+                fields = decode(line)
+                if fields is None:
+                    errors += 1
+                else:
+                    rows.append((fields[0].lower(),) + fields)
+    # Files are written sorted, so this is a single linear pass
+    rows.sort(key=itemgetter(0))
+    return rows, errors
+
+
+class CategoryFileLoader:
+    """Parse category files in parallel and merge them into one name-ordered stream.
+
+    Each file is parsed and sorted on its own (in a process pool when there
+    is enough data and more than one CPU), then the sorted runs are combined
+    with a k-way merge. Contacts with equal names keep file order, then line
+    order, which is the order a sequential load would insert them in.
+    """
+    def __init__(self, filenames: List[str], workers: Optional[int] = None,
+                 codec: Optional[RecordCodec] = None):
+        self.filenames = filenames
+        self.workers = workers
+        self.codec = codec or get_codec()
+        # Unparseable lines seen by the last load
+        self.errors = 0
+
+    def _worker_count(self) -> int:
+        workers = self.workers or os.cpu_count() or 1
+        workers = min(workers, len(self.filenames))
+        total = sum(map(content_size, self.filenames))
+        return workers if total >= PARALLEL_MIN_BYTES else 1
+
+    def _parse_all(self) -> List[Tuple[List[Row], int]]:
+        workers = self._worker_count()
+        if workers <= 1:
+            return [parse_category_file(name, self.codec) for name in self.filenames]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(parse_category_file, self.filenames, repeat(self.codec)))
+
+    def load(self) -> Iterator[Record]:
+        """Every contact of every file as a record, in case-insensitive name order"""
+        results = self._parse_all()
+        self.errors = sum(errors for _, errors in results)
+        runs = [rows for rows, _ in results]
+        for _, name, phone, email, contact_type in heapq.merge(*runs, key=itemgetter(0)):
+            yield {'name': name, 'phone': phone, 'email': email, 'type': contact_type}
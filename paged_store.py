@@ -0,0 +1,746 @@
+import bisect
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from operator import attrgetter
+from typing import Callable, Optional, Dict, Iterable, Iterator, List, Tuple
+
+from blockfile import BlockReader, CorruptBlockError, iter_blocks, open_category
+from codec import get_codec, loads
+from contact_store import ContactNode, ContactQuery, ReadWriteLock, normalize_email, normalize_phone
+from instrumentation import metrics
+from storage import Change, ShardMap, atomic_write_lines, file_stamp
+
+logger = logging.getLogger(__name__)
+
+# Rows per page: the unit of reading, parsing and caching
+PAGE_SIZE = 256
+# Bytes read at a time when a search scans a category file
+SCAN_CHUNK = 1 << 20
+
+Page = Tuple[List[ContactNode], List[str]]
+
+# Any codec reads any category file; the default is the fastest installed
+_codec = get_codec()
+
+
+def _sort_name(line: bytes) -> str:
+    fields = _codec.decode(line.decode('utf-8', 'replace'))
+    return fields[0].lower() if fields is not None else ''
+
+
+class PageCache:
+    """Least recently used pages of every category file, at most ``max_pages``.
+
+    This is the only place lazy mode keeps contacts, so it bounds their
+    memory however large the files are.
+    """
+    def __init__(self, max_pages: int = 256):
+        self.max_pages = max_pages
+        self._pages: 'OrderedDict[Tuple[int, int], Page]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def get(self, key: Tuple[int, int], load: Callable[[], Page]) -> Page:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+        # Parsed outside the lock; two threads may both load a page, once
+        page = load()
+        metrics.count('pages_loaded')
+        with self._lock:
+            self._pages[key] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+
+class CategoryPages:
+    """One category file (a shard of it, see storage.ShardMap), read a page at a time.
+
+    The file is already sorted by name, so its order needs no index; what
+    is kept is sparse: the byte offset and lowercase name of the first
+    row of every page (``PAGE_SIZE`` rows). Row i is found by seeking to
+    its page, name lookups bisect the first names and then one page.
+
+    The file stays open, so when the storage replaces it (every write
+    does, atomically) this object keeps reading the version it indexed;
+    the store opens a new CategoryPages for the new file. The index is
+    saved next to the file (``.<type>.pages.json`` for ``<type>.txt``)
+    and reused while the file is unchanged, so a restart reads no contact
+    at all.
+    """
+    _generations = itertools.count()
+
+    def __init__(self, path: str, contact_type: str, rank: int, cache: PageCache,
+                 page_size: int = PAGE_SIZE):
+        self.path = path
+        directory, name = os.path.split(path)
+        self.index_path = os.path.join(directory, f".{os.path.splitext(name)[0]}.pages.json")
+        self.contact_type = contact_type
+        # Position among the store's categories, breaks ties between equal names
+        self.rank = rank
+        self.cache = cache
+        self.page_size = page_size
+        # Distinguishes this file version's pages in the shared cache
+        self.generation = next(self._generations)
+        self.count = 0
+        self.offsets = array('Q', [0])
+        self.first_names: List[str] = []
+        # Whitespace-only lines, which are not rows; files we write have none
+        self.blank_lines = 0
+        # Plain-file byte ranges of corrupt blocks, left out of every read
+        self.skipped: List[Tuple[int, int]] = []
+        self.stamp: Optional[List[int]] = None
+        self._lock = threading.Lock()
+        self._file = None
+        try:
+            # Compressed files read as their plain lines, decompressing only the blocks read
+            self._file = open_category(self.path)
+        except FileNotFoundError:
+            return
+        stat = os.fstat(self._file.fileno())
+        self.stamp = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        if not self._read_index():
+            with metrics.span('index'):
+                self._scan()
+            self._write_index()
+
+    def __len__(self) -> int:
+        return self.count
+
+    # Offset index
+
+    def _read_index(self) -> bool:
+        try:
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+            if saved['stamp'] != self.stamp or saved['page_size'] != self.page_size:
+                return False
+            offsets = array('Q', saved['offsets'])
+            first_names = saved['first_names']
+            count = saved['count']
+            blank_lines = saved['blank_lines']
+            skipped = [(start, end) for start, end in saved.get('skipped', [])]
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring page index %s: %s", self.index_path, e)
+            return False
+        self.offsets, self.first_names, self.count, self.blank_lines = offsets, first_names, count, blank_lines
+        self.skipped = skipped
+        if skipped:
+            logger.error("Skipped contacts: %d corrupt block(s) in %s", len(skipped), self.path)
+        return True
+
+    def _scan(self):
+        """Read the whole file once for the offset and name of every page's first row"""
+        offsets = array('Q')
+        first_names = []
+        count = blank_lines = 0
+        page_size = self.page_size
+        skipped = []
+        for position, line in self._lines(skipped):
+            if line.isspace():
+                blank_lines += 1
+            else:
+                if count % page_size == 0:
+                    offsets.append(position)
+                    first_names.append(_sort_name(line))
+                count += 1
+        # The end of the last page
+        offsets.append(self._file.seek(0, os.SEEK_END))
+        metrics.count('rows_scanned', count)
+        self.offsets, self.first_names, self.count, self.blank_lines = offsets, first_names, count, blank_lines
+        self.skipped = skipped
+
+    def _lines(self, skipped: List[Tuple[int, int]]) -> Iterator[Tuple[int, bytes]]:
+        """(offset, line) of every line, leaving out corrupt blocks and adding their ranges to skipped"""
+        self._file.seek(0)
+        if not isinstance(self._file, BlockReader):
+            position = 0
+            for line in self._file:
+                yield position, line
+                position += len(line)
+            return
+        corrupt: List[CorruptBlockError] = []
+        for block, lines in iter_blocks(self._file, corrupt):
+            position = self._file.span(block)[0]
+            for text in lines:
+                line = text.encode('utf-8') + b'\n'
+                yield position, line
+                position += len(line)
+        for error in corrupt:
+            logger.error("Skipped contacts: %s", error)
+            # A cut-off tail is past the end already; a bad block is dropped from reads
+            if error.block < len(self._file):
+                skipped.append(self._file.span(error.block))
+
+    def _write_index(self):
+        saved = {'stamp': self.stamp, 'page_size': self.page_size, 'count': self.count,
+                 'blank_lines': self.blank_lines, 'offsets': self.offsets.tolist(),
+                 'first_names': self.first_names, 'skipped': self.skipped}
+        try:
+            atomic_write_lines(self.index_path, [json.dumps(saved)])
+        except OSError as e:
+            logger.error("Error writing page index %s: %s", self.index_path, e)
+
+    def unchanged(self) -> bool:
+        """Whether the file on disk is still the version this object indexed"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.stamp is None
+        return self.stamp == [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    # Pages
+
+    def _read(self, start: int, end: int) -> bytes:
+        """The bytes from start to end, less any corrupt block between them"""
+        chunks = []
+        with self._lock:
+            for skip_start, skip_end in self.skipped:
+                if skip_end <= start or skip_start >= end:
+                    continue
+                # Blocks end at line ends, so what is left is still whole lines
+                if skip_start > start:
+                    self._file.seek(start)
+                    chunks.append(self._file.read(skip_start - start))
+                start = skip_end
+            if start < end:
+                self._file.seek(start)
+                chunks.append(self._file.read(end - start))
+        return b''.join(chunks)
+
+    def _parse(self, lines: List[bytes]) -> List[Optional[Dict]]:
+        # One JSON array per page: a single parser call instead of one per line
+        try:
+            records = loads(b'[' + b','.join(lines) + b']')
+            if len(records) == len(lines):
+                return records
+        except ValueError:
+            pass
+        records = []
+        for line in lines:
+            try:
+                records.append(loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+
+    def _load_page(self, page: int) -> Page:
+        data = self._read(self.offsets[page], self.offsets[page + 1])
+        lines = data.split(b'\n')
+        lines = [line for line in lines if line and not line.isspace()] if self.blank_lines \
+            else [line for line in lines if line]
+        nodes = []
+        names = []
+        row = page * self.page_size
+        for line, record in zip(lines, self._parse(lines)):
+            try:
+                node = ContactNode(record['name'], record['phone'], record.get('email', ''),
+                                   record.get('type', self.contact_type))
+            except (KeyError, TypeError, AttributeError):
+                # Keep the row (and so every row number after it), showing what is there
+                node = ContactNode(line.decode('utf-8', 'replace').strip(), '', '', self.contact_type)
+            name = node.name.lower()
+            node.sort_key = (name, self.rank, row)
+            nodes.append(node)
+            names.append(name)
+            row += 1
+        return nodes, names
+
+    def page(self, page: int) -> Page:
+        return self.cache.get((self.generation, page), lambda: self._load_page(page))
+
+    def node(self, row: int) -> ContactNode:
+        nodes, _ = self.page(row // self.page_size)
+        return nodes[row % self.page_size]
+
+    def name(self, row: int) -> str:
+        """Lowercase name of a row"""
+        _, names = self.page(row // self.page_size)
+        return names[row % self.page_size]
+
+    def bounds(self, name: str) -> Tuple[int, int]:
+        """Least and most rows that can sort before name, from the page index alone"""
+        page = bisect.bisect_left(self.first_names, name)
+        if not page:
+            return 0, 0
+        return (page - 1) * self.page_size, min(page * self.page_size, self.count)
+
+    def bisect(self, name: str, right: bool = False) -> int:
+        """Rows whose lowercase name sorts before name (or also equal to it, with right)"""
+        find = bisect.bisect_right if right else bisect.bisect_left
+        page = find(self.first_names, name) - 1
+        if page < 0:
+            return 0
+        _, names = self.page(page)
+        return page * self.page_size + find(names, name)
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        # Straight from the file: a full pass would only flush the cache
+        for page in range(len(self.first_names)):
+            yield from self._load_page(page)[0]
+
+    # Search
+
+    def search(self, term: str, cancel_event: Optional[threading.Event] = None) -> Optional[array]:
+        """Rows whose name contains term (lowercase), None if cancelled.
+
+        The file is read in large chunks and only lines whose raw bytes
+        contain the term are parsed, so memory stays at one chunk and most
+        of the work is a byte search.
+        """
+        rows = array('I')
+        # ASCII terms appear verbatim in the JSON line; others may be escaped there
+        encoded = json.dumps(term)[1:-1]
+        needle = encoded.encode('ascii') if encoded == term else None
+        row = 0
+        position, end = self.offsets[0], self.offsets[-1]
+        carry = b''
+        while position < end:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            chunk = self._read(position, min(position + SCAN_CHUNK, end))
+            # Short of the chunk size where it skipped a corrupt block
+            position = min(position + SCAN_CHUNK, end)
+            # Whole lines only; the rest waits for the next chunk
+            data = carry + chunk
+            cut = data.rfind(b'\n') + 1 if position < end else len(data)
+            block, carry = data[:cut], data[cut:]
+            if not block:
+                continue
+            lines = block.split(b'\n')
+            if block.endswith(b'\n'):
+                lines.pop()
+            if needle is not None and needle not in block.lower():
+                row += len(lines) if not self.blank_lines else sum(1 for line in lines if line.strip())
+                continue
+            for line in lines:
+                if self.blank_lines and not line.strip():
+                    continue
+                if (needle is None or needle in line.lower()) and term in _sort_name(line):
+                    rows.append(row)
+                row += 1
+        metrics.count('rows_scanned', row)
+        return rows
+
+
+class CategoryShards:
+    """A category as its shard files one after the other, each a CategoryPages.
+
+    Shards hold consecutive name ranges, so row i of the category is row
+    ``i - starts[j]`` of shard j, and a name is only looked up in the
+    shard whose range holds it. Offers the same reads as CategoryPages.
+    """
+    def __init__(self, directory: str, contact_type: str, rank: int, cache: PageCache,
+                 page_size: int = PAGE_SIZE):
+        self.contact_type = contact_type
+        self.rank = rank
+        self.manifest_path = ShardMap.manifest_path(directory, contact_type)
+        # Stamped before reading, so a split racing us shows up in unchanged()
+        self.manifest_stamp = file_stamp(self.manifest_path)
+        self.shard_map = ShardMap.read(directory, contact_type)
+        self.shards = [CategoryPages(path, contact_type, rank, cache, page_size)
+                       for path in self.shard_map.paths()]
+        # First category row of each shard
+        self.starts = list(itertools.accumulate([0] + [shard.count for shard in self.shards[:-1]]))
+        self.count = sum(shard.count for shard in self.shards)
+        self.first_names = [name for shard in self.shards for name in shard.first_names]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def unchanged(self) -> bool:
+        return (file_stamp(self.manifest_path) == self.manifest_stamp
+                and all(shard.unchanged() for shard in self.shards))
+
+    def _locate(self, row: int) -> Tuple[CategoryPages, int]:
+        # bisect_right skips empty shards, which start where the next one does
+        i = bisect.bisect_right(self.starts, row) - 1
+        return self.shards[i], row - self.starts[i]
+
+    def node(self, row: int) -> ContactNode:
+        shard, row = self._locate(row)
+        return shard.node(row)
+
+    def name(self, row: int) -> str:
+        shard, row = self._locate(row)
+        return shard.name(row)
+
+    def bounds(self, name: str) -> Tuple[int, int]:
+        i = self.shard_map.find(name)
+        low, high = self.shards[i].bounds(name)
+        return self.starts[i] + low, self.starts[i] + high
+
+    def bisect(self, name: str, right: bool = False) -> int:
+        i = self.shard_map.find(name)
+        return self.starts[i] + self.shards[i].bisect(name, right)
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return itertools.chain.from_iterable(self.shards)
+
+    def search(self, term: str, cancel_event: Optional[threading.Event] = None) -> Optional[array]:
+        rows = array('I')
+        for shard, start in zip(self.shards, self.starts):
+            found = shard.search(term, cancel_event)
+            if found is None:
+                return None
+            rows.extend(start + row for row in found)
+        return rows
+
+
+class CategoryRows(Sequence):
+    """Rows of one category in name order: all of them, or the ones listed in ``rows``"""
+    def __init__(self, category: CategoryShards, rows: Optional[array] = None):
+        self.category = category
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return self.category.count if self.rows is None else len(self.rows)
+
+    def base(self, index: int) -> int:
+        """Row in the category"""
+        return index if self.rows is None else self.rows[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row out of range")
+        return self.category.node(self.base(index))
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        if self.rows is None:
+            return iter(self.category)
+        return map(self.category.node, self.rows)
+
+    def name(self, index: int) -> str:
+        return self.category.name(self.base(index))
+
+    def count_before(self, name: str, right: bool = False) -> int:
+        """Rows named before name (or also equal to it, with right)"""
+        row = self.category.bisect(name, right)
+        return row if self.rows is None else bisect.bisect_left(self.rows, row)
+
+    def bounds(self, name: str) -> Tuple[int, int]:
+        """Least and most rows that can sort before name, without reading a page"""
+        low, high = self.category.bounds(name)
+        if self.rows is None:
+            return low, high
+        return bisect.bisect_left(self.rows, low), bisect.bisect_left(self.rows, high)
+
+    def position(self, name: str, phone: str) -> Optional[int]:
+        """Index of the contact (name, phone), None if it is not here"""
+        lowered = name.lower()
+        for index in range(self.count_before(lowered), self.count_before(lowered, right=True)):
+            node = self[index]
+            if node.name.strip() == name and node.phone.strip() == phone:
+                return index
+        return None
+
+    def index(self, node: ContactNode, *args) -> int:
+        index = self.position(node.name.strip(), node.phone.strip())
+        if index is None:
+            raise ValueError(f"{node.name} is not in the list")
+        return index
+
+
+class MergedRows(Sequence):
+    """Several CategoryRows as one name-ordered sequence, never materialized.
+
+    Equal names order by category, then by row. Row i is located in two
+    steps: the page indexes (first name of every page, in memory) narrow
+    each category down to a page or two, then a binary search over the
+    ranks its rows would have in the merge reads only those pages. Nearby
+    rows (scrolling) step a cursor from the last row read instead.
+    """
+    # Rows a cursor steps over before a fresh binary search is cheaper
+    STEP_LIMIT = 64
+
+    def __init__(self, runs: Iterable[CategoryRows]):
+        self._lock = threading.Lock()
+        self._set_runs(runs)
+
+    def _set_runs(self, runs: Iterable[CategoryRows]):
+        runs = [run for run in runs if len(run)]
+        with self._lock:
+            self.runs = runs
+            self._length = sum(map(len, runs))
+            # (index, position in each run) of the last row read
+            self._cursor: Optional[Tuple[int, List[int]]] = None
+            self._samples: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[ContactNode]:
+        return heapq.merge(*self.runs, key=attrgetter('sort_key'))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        with self._lock:
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError("row out of range")
+            positions = self._seek(index)
+            self._cursor = (index, positions)
+            run = self._smallest(positions)
+            return self.runs[run][positions[run]]
+
+    def _seek(self, index: int) -> List[int]:
+        if self._cursor is not None:
+            last, positions = self._cursor
+            if 0 <= index - last <= self.STEP_LIMIT:
+                positions = list(positions)
+                for _ in range(index - last):
+                    positions[self._smallest(positions)] += 1
+                return positions
+            if 0 < last - index <= self.STEP_LIMIT:
+                positions = list(positions)
+                for _ in range(last - index):
+                    positions[self._largest_before(positions)] -= 1
+                return positions
+        return self._locate(index)
+
+    def _smallest(self, positions: List[int]) -> int:
+        """The run holding the next row after positions"""
+        return min((run.category.node(run.base(position)).sort_key, i)
+                   for i, (run, position) in enumerate(zip(self.runs, positions))
+                   if position < len(run))[1]
+
+    def _largest_before(self, positions: List[int]) -> int:
+        """The run holding the row before positions"""
+        return max((run.category.node(run.base(position - 1)).sort_key, i)
+                   for i, (run, position) in enumerate(zip(self.runs, positions))
+                   if position > 0)[1]
+
+    def _others_before(self, run: int, name: str) -> List[int]:
+        """Rows of every run merged before a row of run named name (equal names of earlier runs first)"""
+        return [other.count_before(name, right=i < run) if i != run else 0
+                for i, other in enumerate(self.runs)]
+
+    def _narrow(self, index: int) -> List[Tuple[int, int]]:
+        """Range of positions in each run that holds the merge's row index, from the page indexes alone"""
+        if self._samples is None:
+            self._samples = sorted({name for run in self.runs for name in run.category.first_names})
+        samples = self._samples
+
+        def bounds(name: str) -> List[Tuple[int, int]]:
+            return [run.bounds(name) for run in self.runs]
+
+        # Last page name with surely no more than index rows before it
+        low, high = 0, len(samples)
+        while low < high:
+            middle = (low + high) // 2
+            if sum(most for _, most in bounds(samples[middle])) <= index:
+                low = middle + 1
+            else:
+                high = middle
+        floor = bounds(samples[low - 1]) if low else [(0, 0)] * len(self.runs)
+        # First page name with surely more than index rows before it
+        high = len(samples)
+        while low < high:
+            middle = (low + high) // 2
+            if sum(least for least, _ in bounds(samples[middle])) > index:
+                high = middle
+            else:
+                low = middle + 1
+        ceiling = bounds(samples[low]) if low < len(samples) else [(len(run), len(run)) for run in self.runs]
+        return [(least, min(most + 1, len(run)))
+                for run, (least, _), (_, most) in zip(self.runs, floor, ceiling)]
+
+    def _locate(self, index: int) -> List[int]:
+        """Positions in each run after the first index rows of the merge"""
+        for i, (run, (start, end)) in enumerate(zip(self.runs, self._narrow(index))):
+            low, high = start, end
+            # Last position of this run whose merged rank is at most index
+            while low < high:
+                middle = (low + high) // 2
+                if middle + sum(self._others_before(i, run.name(middle))) <= index:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low > start:
+                positions = self._others_before(i, run.name(low - 1))
+                if low - 1 + sum(positions) == index:
+                    positions[i] = low - 1
+                    return positions
+        raise IndexError("row out of range")
+
+    def index(self, node: ContactNode, *args) -> int:
+        """Position of the contact (name, phone) in the merge"""
+        name, phone = node.name.strip(), node.phone.strip()
+        for i, run in enumerate(self.runs):
+            position = run.position(name, phone)
+            if position is not None:
+                return position + sum(self._others_before(i, run.name(position)))
+        raise ValueError(f"{node.name} is not in the list")
+
+
+class PagedContactStore(MergedRows):
+    """The contact store of lazy mode: category files paged in as rows are read.
+
+    Holds one CategoryShards per type (a sparse offset index per shard
+    file) and an LRU PageCache shared by all, so memory does not grow
+    with the files.
+    The store itself is the merged, name-ordered list of all contacts.
+    Searches scan the files on a worker thread and keep only matching row
+    numbers. Changes are written by the storage backend first; then
+    ``refresh`` re-indexes the categories they touched (``insert``,
+    ``delete`` and ``apply_changes`` only note which, and return nodes
+    describing the change; ``find`` already sees inserted contacts).
+
+    Relies on the category files being sorted by name, as JsonLinesStorage
+    keeps them. Fuzzy search is answered as a plain substring search.
+    """
+    def __init__(self, directory: str, contact_types: List[str], max_pages: int = 256,
+                 page_size: int = PAGE_SIZE):
+        super().__init__([])
+        self.directory = directory
+        self.contact_types = list(contact_types)
+        self.page_size = page_size
+        self.cache = PageCache(max_pages)
+        self.categories: Dict[str, CategoryShards] = {}
+        # Taken for writing while categories are swapped; queries read under it
+        self.lock = ReadWriteLock()
+        self.loaded = False
+        self._dirty = set()
+        # Inserted but not yet re-indexed, by (name, phone): find sees them meanwhile
+        self._pending: Dict[Tuple[str, str], ContactNode] = {}
+
+    def open(self):
+        """Index (or reuse the saved index of) every category file"""
+        self._reopen(self.contact_types)
+        self.loaded = True
+
+    def _reopen(self, contact_types: Iterable[str]):
+        categories = {contact_type: CategoryShards(self.directory, contact_type,
+                                                   self.contact_types.index(contact_type),
+                                                   self.cache, self.page_size)
+                      for contact_type in contact_types if contact_type in self.contact_types}
+        with self.lock.write():
+            self._pending = {key: node for key, node in self._pending.items()
+                             if node.contact_type not in categories}
+            self.categories.update(categories)
+            self._set_runs(CategoryRows(self.categories[contact_type])
+                           for contact_type in self.contact_types if contact_type in self.categories)
+
+    def refresh(self, contact_types: Optional[Iterable[str]] = None):
+        """Re-index categories the storage rewrote (default: those changed through this store)"""
+        if contact_types is None:
+            contact_types, self._dirty = self._dirty, set()
+        if contact_types:
+            self._reopen(contact_types)
+
+    def add_contact_type(self, contact_type: str):
+        if contact_type not in self.contact_types:
+            self.contact_types.append(contact_type)
+        if self.loaded:
+            self._reopen([contact_type])
+
+    def changed_types(self) -> List[str]:
+        """Categories whose files are no longer the version indexed"""
+        return [contact_type for contact_type, category in self.categories.items()
+                if not category.unchanged()]
+
+    # Changes, applied by the storage and picked up by refresh
+
+    def _node(self, name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        node = ContactNode(name, phone, email, contact_type)
+        rank = self.contact_types.index(contact_type) if contact_type in self.contact_types else -1
+        node.sort_key = (name.lower(), rank, -1)
+        return node
+
+    def insert(self, name: str, phone: str, email: str, contact_type: str) -> ContactNode:
+        node = self._node(name, phone, email, contact_type)
+        self._pending[(str(name).strip(), str(phone).strip())] = node
+        self._dirty.add(contact_type)
+        return node
+
+    def delete(self, name: str, phone: str) -> bool:
+        if self._pending.pop((str(name).strip(), str(phone).strip()), None) is not None:
+            return True
+        node = self.find(name, phone)
+        if node is None:
+            return False
+        self._dirty.add(node.contact_type)
+        return True
+
+    def apply_changes(self, changes: Iterable[Change]) -> Tuple[List[ContactNode], List[ContactNode]]:
+        removed, added = [], []
+        for old, new in changes:
+            if old is not None:
+                node = self.find(old['name'], old['phone'])
+                if node is not None:
+                    removed.append(node)
+                self._dirty.add(old['type'])
+            if new is not None:
+                added.append(self._node(new['name'], new['phone'], new['email'], new['type']))
+                self._dirty.add(new['type'])
+        return removed, added
+
+    # Reads
+
+    def find(self, name: str, phone: str) -> Optional[ContactNode]:
+        name, phone = str(name).strip(), str(phone).strip()
+        pending = self._pending.get((name, phone))
+        if pending is not None:
+            return pending
+        for run in self.runs:
+            position = run.position(name, phone)
+            if position is not None:
+                return run[position]
+        return None
+
+    def query(self, query: ContactQuery, cancel_event: Optional[threading.Event] = None):
+        """Contacts matching a ContactQuery, in name order; scans the files for a name"""
+        with self.lock.read():
+            if query.contact_type is None:
+                if not query.name:
+                    return self
+                categories = [self.categories[t] for t in self.contact_types if t in self.categories]
+            else:
+                category = self.categories.get(query.contact_type)
+                if category is None:
+                    return []
+                if not query.name:
+                    return CategoryRows(category)
+                categories = [category]
+        runs = []
+        for category in categories:
+            rows = category.search(query.name.lower(), cancel_event)
+            if rows is None:
+                return []
+            runs.append(CategoryRows(category, rows))
+        return runs[0] if len(runs) == 1 else MergedRows(runs)
+
+    def type_counts(self) -> Dict[str, int]:
+        return {contact_type: category.count for contact_type, category in self.categories.items()}
+
+    def _scan(self, matches: Callable[[ContactNode], bool]) -> List[ContactNode]:
+        return [node for node in self if matches(node)]
+
+    def lookup_by_phone(self, phone: str) -> List[ContactNode]:
+        """Contacts with this phone number in any format; reads every file"""
+        key = normalize_phone(phone)
+        return self._scan(lambda node: normalize_phone(node.phone) == key) if key else []
+
+    def lookup_by_email(self, email: str) -> List[ContactNode]:
+        key = normalize_email(email)
+        return self._scan(lambda node: normalize_email(node.email) == key) if key else []
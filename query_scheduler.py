@@ -0,0 +1,97 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueryScheduler:
+    """Debounced, cancellable background queries for the Tk GUI.
+
+    ``submit`` waits ``delay_ms`` for the user to stop typing, then runs the
+    query on a worker thread. A newer submit supersedes everything before
+    it: a debounce that has not fired is cancelled, a query still waiting
+    for the worker is skipped, and a query already running has its cancel
+    event set and its result discarded. Finished results are picked up by
+    a ``root.after`` poll, so callbacks always run on the Tk thread.
+    """
+    def __init__(self, root, delay_ms: int = 150, poll_ms: int = 10, workers: int = 1):
+        self.root = root
+        self.delay_ms = delay_ms
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+        self._results: 'queue.Queue' = queue.Queue()
+        self._generation = 0
+        self._after_id: Optional[str] = None
+        self._cancel_event: Optional[threading.Event] = None
+        self._in_flight = 0
+        self._polling = False
+
+    def submit(self, query: Callable[[threading.Event], object],
+               on_result: Callable[[object], None], delay_ms: Optional[int] = None):
+        """Schedule query(cancel_event) on the worker, then on_result(result) on the Tk thread"""
+        self.cancel()
+        generation = self._generation
+        delay = self.delay_ms if delay_ms is None else delay_ms
+        self._after_id = self.root.after(delay, self._start, generation, query, on_result)
+
+    def cancel(self):
+        """Drop the pending query and discard any result still on its way"""
+        self._generation += 1
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+            self._cancel_event = None
+
+    def _start(self, generation: int, query, on_result):
+        self._after_id = None
+        if generation != self._generation:
+            return
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
+        self._in_flight += 1
+        self._executor.submit(self._run, generation, cancel_event, query, on_result)
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _run(self, generation: int, cancel_event: threading.Event, query, on_result):
+        """Worker thread: run the query unless it was superseded while queued"""
+        if cancel_event.is_set():
+            self._results.put(None)
+            return
+        try:
+            result = query(cancel_event)
+        except Exception:
+            logger.exception("Error running query")
+            self._results.put(None)
+            return
+        self._results.put((generation, cancel_event, on_result, result))
+
+    def _poll(self):
+        """Tk thread: deliver finished results that are still current"""
+        while True:
+            try:
+                item = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._in_flight -= 1
+            if item is None:
+                continue
+            generation, cancel_event, on_result, result = item
+            if generation == self._generation and not cancel_event.is_set():
+                on_result(result)
+
+        if self._in_flight:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+    def shutdown(self):
+        """Cancel outstanding work and stop the worker threads"""
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,476 @@
+import bisect
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+from itertools import accumulate, chain, filterfalse, islice
+from typing import Optional, Dict, Iterable, List, Set, Tuple
+
+from instrumentation import metrics
+
+
+def trigrams(text: str) -> Set[str]:
+    """Every 3-character substring of text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bigrams(text: str) -> Set[str]:
+    """Every 2-character substring of text"""
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def max_edits(length: int) -> int:
+    """Typos tolerated in a search word of this length"""
+    if length <= 3:
+        return 0
+    return 1 if length <= 7 else 2
+
+
+def prefix_distance(term: str, word: str, limit: int) -> int:
+    """Fewest edits turning term into a prefix of word, or limit + 1 if more.
+
+    Levenshtein distance where swapping two adjacent characters counts as
+    one edit (optimal string alignment), and the rest of word is free, so
+    'jonh' is 1 edit from 'johnson'.
+    """
+    if limit == 0:
+        return 0 if word.startswith(term) else 1
+    word = word[:len(term) + limit]
+    before = None
+    row = list(range(len(word) + 1))
+    for i, char in enumerate(term, 1):
+        current = [i]
+        for j, other in enumerate(word, 1):
+            cost = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + (char != other))
+            if (before is not None and j > 1 and char == word[j - 2]
+                    and term[i - 2] == other):
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, row = row, current
+    return min(min(row), limit + 1)
+
+
+class SearchResult(Sequence):
+    """Lazy, read-only list of the contacts behind a sorted list of matching names.
+
+    Only the name list and a running count per name are built up front;
+    contacts are looked up when indexed, so a virtual list showing a few
+    rows of a huge result never materializes the rest. The result keeps
+    each name's contact list as it was: the index only appends to those
+    lists and replaces them on any other change, so a result still on
+    screen after an edit shows the contacts from before it.
+    """
+    def __init__(self, names: List[str], nodes_by_name: Dict[str, List]):
+        self.names = names
+        # A name removed since it matched has no contacts left
+        self._lists = [nodes_by_name.get(name, ()) for name in names]
+        self._ends = list(accumulate(map(len, self._lists)))
+
+    def __len__(self) -> int:
+        return self._ends[-1] if self._ends else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("search result index out of range")
+        position = bisect.bisect_right(self._ends, index)
+        start = self._ends[position - 1] if position else 0
+        return self._lists[position][index - start]
+
+    def __iter__(self):
+        # Up to each list's length when the result was made, not what was appended since
+        counts = map(int.__sub__, self._ends, chain((0,), self._ends))
+        return chain.from_iterable(map(islice, self._lists, counts))
+
+
+class WordIndex:
+    """The distinct words of indexed names, for typo-tolerant search.
+
+    Every word gets an id, a posting of the name ids containing it and is
+    itself posted under the bigrams of ``'$' + word``. One edit changes at
+    most 3 bigrams (a swap of two letters), so a search word can only be
+    within d edits of a word's prefix if they share all but 3*d of its
+    bigrams; counting shared bigrams narrows the vocabulary to a few
+    candidates before any edit distance is computed. Bigrams rather
+    than trigrams, because search words are short: with trigrams a single
+    typo in a 4-letter word would leave nothing to filter on.
+    """
+    def __init__(self):
+        self._word_ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        self._grams: Dict[str, array] = {}
+        self._names: List[array] = []
+
+    def add_name(self, name_id: int, name: str):
+        for word in set(name.split()):
+            word_id = self._word_ids.get(word)
+            if word_id is None:
+                word_id = self._word_ids[word] = len(self._words)
+                self._words.append(word)
+                self._names.append(array('I'))
+                for gram in bigrams('$' + word):
+                    postings = self._grams.get(gram)
+                    if postings is None:
+                        self._grams[gram] = array('I', (word_id,))
+                    else:
+                        postings.append(word_id)
+            self._names[word_id].append(name_id)
+
+    def matches(self, term: str) -> List[Tuple[int, int]]:
+        """(edits, word id) of every word that term starts within max_edits of"""
+        limit = max_edits(len(term))
+        grams = bigrams('$' + term)
+        needed = len(grams) - 3 * limit
+        if needed > 0:
+            counts = Counter(chain.from_iterable(self._grams.get(gram, ()) for gram in grams))
+            candidates = [word_id for word_id, count in counts.items() if count >= needed]
+        else:
+            # Too few distinct bigrams to filter on (e.g. 'aaaa')
+            candidates = range(len(self._words))
+        words = self._words
+        found = []
+        for word_id in candidates:
+            edits = prefix_distance(term, words[word_id], limit)
+            if edits <= limit:
+                found.append((edits, word_id))
+        return found
+
+    def names(self, word_id: int) -> array:
+        """Ids of the names containing a word (removed names included)"""
+        return self._names[word_id]
+
+
+class NameSearchIndex:
+    """Substring index over lowercase contact names.
+
+    Names are indexed once per distinct lowercase spelling:
+
+    * ``_nodes_by_name`` maps a lowercase name to its contacts, in the
+      store's sort_key order; a list is only appended to in place, other
+      changes replace it, so SearchResults keep the lists they hold
+    * ``_postings`` is a trigram inverted index from each 3-character
+      substring to the ids of the names containing it, kept in compact
+      ``array('I')`` lists rather than sets of strings
+    * ``_sorted_names`` is the sorted array of distinct names, used to
+      scan for 1-2 character terms and to order large result sets; it is
+      replaced, never changed in place, since searches iterate it
+
+    A name keeps its id after its last contact is removed; the stale
+    postings are skipped by searches and dropped when the postings are
+    rebuilt, once dead ids outnumber live ones.
+
+    The last query's matching names are kept, so extending the search term
+    (typing one more character) only re-checks the previous results.
+
+    ``fuzzy_search`` matches each search word against the start of a word
+    in the name with a few typos allowed, through a WordIndex built on
+    first use and kept up to date from then on. Its recent results are
+    kept in an LRU cache until the next change.
+    """
+    # Pending new names are insorted one by one up to this many, beyond
+    # that they are appended and the array is re-sorted in one go
+    INSORT_LIMIT = 64
+    # Dead name ids tolerated before the postings are rebuilt
+    MIN_DEAD_IDS = 1024
+    # Fuzzy query results kept for repeated searches
+    FUZZY_CACHE_SIZE = 128
+
+    def __init__(self):
+        self._nodes_by_name: Dict[str, List] = {}
+        self._postings: Dict[str, array] = {}
+        self._name_ids: Dict[str, int] = {}
+        self._id_names: List[str] = []
+        self._sorted_names: List[str] = []
+        self._pending_names: List[str] = []
+        # Bumped on every change, so cached query results can be validated
+        self.generation = 0
+        # (generation, term, matching names) of the last query, replaced as
+        # one tuple because concurrent searches may read and write it
+        self._last: Tuple[int, str, List[str]] = (-1, '', [])
+        # Searches only read, apart from merging pending names and
+        # building the word index
+        self._merge_lock = threading.Lock()
+        self._words: Optional[WordIndex] = None
+        # term -> (generation, ranked names), least recently used first
+        self._fuzzy_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def shared_name(self, name: str) -> str:
+        """The indexed string equal to name, so equal sort keys share one string"""
+        name_id = self._name_ids.get(name)
+        return name if name_id is None else self._id_names[name_id]
+
+    def _add_name(self, name: str, grams: Optional[Set[str]] = None):
+        """Give a new distinct name an id and post it under its trigrams"""
+        name_id = self._name_ids.get(name)
+        if name_id is not None:
+            # Removed earlier, its postings are still in place
+            return
+        name_id = self._name_ids[name] = len(self._id_names)
+        self._id_names.append(name)
+        if self._words is not None:
+            self._words.add_name(name_id, name)
+        for gram in grams if grams is not None else trigrams(name):
+            postings = self._postings.get(gram)
+            if postings is None:
+                self._postings[gram] = array('I', (name_id,))
+            else:
+                postings.append(name_id)
+
+    def add(self, node):
+        """Index a contact, node.sort_key[0] is its lowercase name"""
+        name = node.sort_key[0]
+        nodes = self._nodes_by_name.get(name)
+        if nodes is None:
+            self._nodes_by_name[name] = [node]
+            self._add_name(name)
+            self._pending_names.append(name)
+        elif nodes[-1].sort_key <= node.sort_key:
+            nodes.append(node)
+        else:
+            nodes = nodes.copy()
+            nodes.insert(bisect.bisect_right([n.sort_key for n in nodes], node.sort_key), node)
+            self._nodes_by_name[name] = nodes
+        self.generation += 1
+
+    def build(self, nodes: List, gram_cache: Optional[Dict[str, Set[str]]] = None):
+        """Replace the contents with contacts that are already in sort_key order.
+
+        ``gram_cache`` maps names to their trigrams; pass the same dict when
+        building several indexes over the same names to compute them once.
+        """
+        if gram_cache is None:
+            gram_cache = {}
+        self._postings = {}
+        self._name_ids = {}
+        self._id_names = []
+        self._words = None
+        nodes_by_name: Dict[str, List] = {}
+        names: List[str] = []
+        for node in nodes:
+            name = node.sort_key[0]
+            same_name = nodes_by_name.get(name)
+            if same_name is None:
+                nodes_by_name[name] = [node]
+                names.append(name)
+                grams = gram_cache.get(name)
+                if grams is None:
+                    grams = gram_cache[name] = trigrams(name)
+                self._add_name(name, grams)
+            else:
+                same_name.append(node)
+
+        self._nodes_by_name = nodes_by_name
+        # Names arrive in order, so the distinct-name array is already sorted
+        self._sorted_names = names
+        self._pending_names = []
+        self.generation += 1
+
+    def remove(self, node):
+        """Drop a contact from the index"""
+        self.remove_many((node,))
+
+    def remove_many(self, nodes: Iterable):
+        """Drop many contacts at once, filtering each name's list and the name array once"""
+        by_name: Dict[str, Set] = {}
+        for node in nodes:
+            by_name.setdefault(node.sort_key[0], set()).add(node)
+        emptied = set()
+        for name, removed in by_name.items():
+            same_name = self._nodes_by_name.get(name)
+            if not same_name:
+                continue
+            if len(removed) == 1:
+                same_name = same_name.copy()
+                try:
+                    same_name.remove(*removed)
+                except ValueError:
+                    continue
+            else:
+                same_name = list(filterfalse(removed.__contains__, same_name))
+            self._nodes_by_name[name] = same_name
+            self.generation += 1
+            if not same_name:
+                del self._nodes_by_name[name]
+                emptied.add(name)
+        if not emptied:
+            return
+
+        names = self._names()
+        if len(emptied) <= self.INSORT_LIMIT:
+            names = names.copy()
+            for name in emptied:
+                position = bisect.bisect_left(names, name)
+                if position < len(names) and names[position] == name:
+                    del names[position]
+            self._sorted_names = names
+        else:
+            self._sorted_names = [name for name in names if name not in emptied]
+        dead = len(self._id_names) - len(self._nodes_by_name)
+        if dead > max(self.MIN_DEAD_IDS, len(self._nodes_by_name)):
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        """Re-number the live names and drop the postings of removed ones"""
+        self._postings = {}
+        self._name_ids = {}
+        self._id_names = []
+        self._words = None
+        for name in self._nodes_by_name:
+            self._add_name(name)
+
+    def _names(self) -> List[str]:
+        """The sorted distinct-name array, with pending names merged in"""
+        if self._pending_names:
+            with self._merge_lock:
+                pending = self._pending_names
+                # A new array, as other searches may be iterating the old one
+                names = self._sorted_names.copy()
+                if len(pending) <= self.INSORT_LIMIT:
+                    for name in pending:
+                        bisect.insort(names, name)
+                else:
+                    # Timsort merges the sorted run and the new tail in near-linear time
+                    names.extend(pending)
+                    names.sort()
+                self._sorted_names = names
+                self._pending_names = []
+        return self._sorted_names
+
+    def search_names(self, term: str) -> List[str]:
+        """Sorted distinct lowercase names containing term"""
+        term = term.lower()
+        names = self._names()
+        if not term:
+            return names
+
+        last_generation, last_term, last_names = self._last
+        if last_generation == self.generation and last_term and last_term in term:
+            # The user extended the previous term: narrow its results
+            metrics.count('rows_scanned', len(last_names))
+            matches = [name for name in last_names if term in name]
+        elif len(term) < 3:
+            metrics.count('rows_scanned', len(names))
+            matches = [name for name in names if term in name]
+        else:
+            matches = self._trigram_matches(term, names)
+
+        self._last = (self.generation, term, matches)
+        return matches
+
+    def _trigram_matches(self, term: str, names: List[str]) -> List[str]:
+        smallest = None
+        for gram in trigrams(term):
+            postings = self._postings.get(gram)
+            if not postings:
+                return []
+            if smallest is None or len(postings) < len(smallest):
+                smallest = postings
+
+        # Every match is among the names holding the rarest trigram; the
+        # substring test covers the other trigrams and skips removed names
+        metrics.count('rows_scanned', len(smallest))
+        nodes_by_name = self._nodes_by_name
+        candidates = {name for name in map(self._id_names.__getitem__, smallest)
+                      if term in name and name in nodes_by_name}
+
+        if len(candidates) * 8 < len(names):
+            return sorted(candidates)
+        # Large result: walking the sorted array beats sorting the candidates
+        return [name for name in names if name in candidates]
+
+    def search(self, term: str) -> SearchResult:
+        """Contacts whose name contains term (case-insensitive), in name order"""
+        return SearchResult(self.search_names(term), self._nodes_by_name)
+
+    def _word_index(self) -> WordIndex:
+        """The word index, built from the live names on first use"""
+        if self._words is None:
+            with self._merge_lock:
+                if self._words is None:
+                    words = WordIndex()
+                    # Removed names too: one re-added later keeps its old id
+                    for name_id, name in enumerate(self._id_names):
+                        words.add_name(name_id, name)
+                    self._words = words
+        return self._words
+
+    def fuzzy_search_names(self, term: str) -> List[str]:
+        """Distinct lowercase names matching term with typos, best first.
+
+        Every word of term must start a word of the name within
+        ``max_edits`` typos; names rank by the total typos, then by name.
+        Names containing term exactly rank first, as in ``search_names``.
+        """
+        term = ' '.join(term.lower().split())
+        if not term:
+            return self._names()
+
+        with self._cache_lock:
+            cached = self._fuzzy_cache.get(term)
+            if cached is not None and cached[0] == self.generation:
+                self._fuzzy_cache.move_to_end(term)
+                self.cache_hits += 1
+                return cached[1]
+            self.cache_misses += 1
+
+        generation = self.generation
+        names = self._rank(term)
+        with self._cache_lock:
+            self._fuzzy_cache[term] = (generation, names)
+            self._fuzzy_cache.move_to_end(term)
+            while len(self._fuzzy_cache) > self.FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.popitem(last=False)
+        return names
+
+    def _rank(self, term: str) -> List[str]:
+        words = self._word_index()
+        edits_by_name: Optional[Dict[int, int]] = None
+        for search_word in term.split():
+            edits_by_word: Dict[int, int] = {}
+            for edits, word_id in sorted(words.matches(search_word)):
+                # Best matches first, so setdefault keeps each name's fewest edits
+                for name_id in words.names(word_id):
+                    edits_by_word.setdefault(name_id, edits)
+            if edits_by_name is None:
+                edits_by_name = edits_by_word
+            else:
+                edits_by_name = {name_id: edits + edits_by_word[name_id]
+                                 for name_id, edits in edits_by_name.items()
+                                 if name_id in edits_by_word}
+            if not edits_by_name:
+                break
+
+        # Group names by typo count, dropping removed names
+        metrics.count('rows_scanned', len(edits_by_name or ()))
+        nodes_by_name = self._nodes_by_name
+        id_names = self._id_names
+        ranks: Dict[int, Set[str]] = {0: set(self.search_names(term))}
+        for name_id, edits in (edits_by_name or {}).items():
+            name = id_names[name_id]
+            if name in nodes_by_name:
+                ranks.setdefault(edits, set()).add(name)
+
+        names = self._names()
+        ranked: List[str] = []
+        seen: Set[str] = set()
+        for edits in sorted(ranks):
+            group = ranks[edits] - seen
+            seen |= group
+            if len(group) * 8 < len(names):
+                ranked += sorted(group)
+            else:
+                # Large group: walking the sorted array beats sorting it
+                ranked += [name for name in names if name in group]
+        return ranked
+
+    def fuzzy_search(self, term: str) -> SearchResult:
+        """Contacts whose name matches term with a few typos, best matches first"""
+        return SearchResult(self.fuzzy_search_names(term), self._nodes_by_name)
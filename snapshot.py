@@ -0,0 +1,147 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Optional, Dict, List, Iterable
+
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, str]
+
+# Layout, all integers little-endian uint32:
+#
+#   magic (8 bytes) | version | meta length | meta (JSON: source file stamps)
+#   contact count | string count | string data length
+#   string table: one byte length per string, then the UTF-8 data of all strings
+#   four columns (name, phone, email, type) of string ids, one per contact
+#
+# Contacts are stored in name order, so loading needs no sorting and no
+# JSON parsing; every distinct string (types, empty emails, common names)
+# is stored once.
+MAGIC = b'CNTSNAP\x00'
+VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_COUNTS = struct.Struct('<III')
+FIELDS = ('name', 'phone', 'email', 'type')
+
+Stamps = Dict[str, Optional[List[int]]]
+
+
+def source_stamps(filenames: Iterable[str]) -> Stamps:
+    """Size and modification time of each source file, None if it is missing"""
+    stamps: Stamps = {}
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            stamps[os.path.basename(filename)] = None
+            continue
+        stamps[os.path.basename(filename)] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def _uint32_array(values: Iterable[int]) -> bytes:
+    column = array('I', values)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_snapshot(path: str, records: Iterable[Record], stamps: Stamps):
+    """Write records (already in name order) and the stamps of the files they came from"""
+    string_ids: Dict[str, int] = {}
+    columns: List[List[int]] = [[], [], [], []]
+    for record in records:
+        for column, field in zip(columns, FIELDS):
+            value = record[field]
+            string_id = string_ids.get(value)
+            if string_id is None:
+                string_id = string_ids[value] = len(string_ids)
+            column.append(string_id)
+
+    encoded = [value.encode('utf-8') for value in string_ids]
+    data = b''.join(encoded)
+    meta = json.dumps({'sources': stamps}).encode('utf-8')
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(meta)))
+        f.write(meta)
+        f.write(_COUNTS.pack(len(columns[0]), len(encoded), len(data)))
+        f.write(_uint32_array(map(len, encoded)))
+        f.write(data)
+        for column in columns:
+            f.write(_uint32_array(column))
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.count('bytes_written', f.tell())
+    os.replace(temp, path)
+
+
+def read_snapshot(path: str, stamps: Optional[Stamps] = None) -> Optional[List[Record]]:
+    """Records from a snapshot, or None if it is missing, damaged or out of date.
+
+    With ``stamps``, the snapshot is only used if it was written from source
+    files of exactly that size and modification time.
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _read(mm, stamps)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning("Ignoring snapshot %s: %s", path, e)
+        return None
+
+
+def _read_uint32(mm: mmap.mmap, offset: int, count: int) -> array:
+    column = array('I')
+    column.frombytes(mm[offset:offset + 4 * count])
+    if len(column) != count:
+        raise ValueError("truncated snapshot")
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def _read(mm: mmap.mmap, stamps: Optional[Stamps]) -> Optional[List[Record]]:
+    magic, version, meta_length = _HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a contact snapshot")
+    offset = _HEADER.size
+    meta = json.loads(mm[offset:offset + meta_length])
+    if stamps is not None and meta.get('sources') != stamps:
+        return None
+    offset += meta_length
+
+    count, string_count, data_length = _COUNTS.unpack_from(mm, offset)
+    offset += _COUNTS.size
+    lengths = _read_uint32(mm, offset, string_count)
+    offset += 4 * string_count
+    data = mm[offset:offset + data_length]
+    offset += data_length
+    if len(data) != data_length:
+        raise ValueError("truncated snapshot")
+
+    ends = list(accumulate(lengths))
+    starts = [0] + ends[:-1]
+    if data.isascii():
+        # One decode for the whole table; byte offsets are character offsets
+        text = data.decode('ascii')
+        strings = [text[start:end] for start, end in zip(starts, ends)]
+    else:
+        strings = [data[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+
+    columns = []
+    for _ in FIELDS:
+        columns.append(_read_uint32(mm, offset, count))
+        offset += 4 * count
+    names, phones, emails, types = (map(strings.__getitem__, column) for column in columns)
+    return [{'name': name, 'phone': phone, 'email': email, 'type': contact_type}
+            for name, phone, email, contact_type in zip(names, phones, emails, types)]
+
@@ -0,0 +1,1137 @@
+import bisect
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): only one instance should use a directory
+    fcntl = None
+
+from blockfile import COMPRESSIONS, CorruptBlockError, compression_of, content_size, iter_lines, write_blocks
+from codec import RecordCodec, get_codec
+from instrumentation import metrics
+from loader import CategoryFileLoader
+from snapshot import read_snapshot, source_stamps, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, str]
+# (old, new) contact of one change in a batch: old None for an add, new None for a delete
+Change = Tuple[Optional[Record], Optional[Record]]
+
+CONTACT_TYPES = ['college', 'family', 'colleague', 'friend', 'neighbour', 'relatives']
+# User-defined contact types of a data directory, replacing CONTACT_TYPES there
+TYPES_NAME = 'types.json'
+# A category shard is split once it grows past this many bytes
+SHARD_BYTES = 512 * 1024
+
+
+def make_record(name: str, phone: str, email: str, contact_type: str) -> Record:
+    """Build the dict written for one contact line"""
+    return {
+        'name': name,
+        'phone': phone,
+        'email': email,
+        'type': contact_type
+    }
+
+
+def fsync_directory(directory: str):
+    """Make renames inside directory durable (no-op where directories can't be opened)"""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_lines_durably(filename: str, lines: Iterable[str], compression: Optional[str] = None):
+    """Write lines to a file that is complete and fsynced, but not yet in place.
+
+    With a compression (see blockfile.COMPRESSIONS) the lines are written
+    as a compressed category file instead of plain text.
+    """
+    if compression is not None:
+        with open(filename, 'wb') as f:
+            write_blocks(f, lines, compression)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.count('bytes_written', f.tell())
+        return
+    with open(filename, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.count('bytes_written', f.tell())
+
+
+def atomic_write_lines(filename: str, lines: Iterable[str], compression: Optional[str] = None):
+    """Replace a file via temp file + fsync + os.replace, so a crash leaves old or new, never half"""
+    temp = filename + '.tmp'
+    write_lines_durably(temp, lines, compression)
+    os.replace(temp, filename)
+    fsync_directory(os.path.dirname(filename) or '.')
+
+
+def file_stamp(filename: str) -> Optional[Tuple[int, int, int]]:
+    """Inode, size and mtime of a file, None if it is missing"""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def load_contact_types(directory: str) -> List[str]:
+    """The contact types of a data directory: CONTACT_TYPES unless ``types.json`` lists others"""
+    path = os.path.join(directory, TYPES_NAME)
+    try:
+        with open(path, 'r') as f:
+            contact_types = json.load(f)['types']
+    except FileNotFoundError:
+        return list(CONTACT_TYPES)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error("Error reading contact types from %s: %s", path, e)
+        return list(CONTACT_TYPES)
+    return [str(contact_type) for contact_type in contact_types]
+
+
+def save_contact_types(directory: str, contact_types: List[str]):
+    os.makedirs(directory, exist_ok=True)
+    atomic_write_lines(os.path.join(directory, TYPES_NAME), [json.dumps({'types': contact_types})])
+
+
+def _write_snapshot(filename: str, records: List[Record], codec: RecordCodec):
+    """Write a sorted category file via a temp file so readers never see half of it"""
+    records.sort(key=lambda x: x['name'].lower())
+    atomic_write_lines(filename, (codec.encode_record(record) for record in records))
+
+
+class ContactStorage:
+    """Interface between ContactManager and where contacts are persisted.
+
+    Backends with ``indexed = True`` also answer find and search queries
+    themselves, so the GUI does not have to scan its in-memory list.
+    """
+    indexed = False
+    # Set by every backend: where its files live, and the contact types
+    # in use there (CONTACT_TYPES or those in ``types.json``)
+    directory: str
+    contact_types: List[str]
+
+    def load(self) -> Iterable[Record]:
+        """Return every stored contact"""
+        raise NotImplementedError
+
+    def load_sorted(self) -> Iterable[Record]:
+        """Every stored contact in case-insensitive name order, for ContactStore.bulk_load.
+
+        Contacts with equal names keep their ``load`` order.
+        """
+        return sorted(self.load(), key=lambda x: x['name'].lower())
+
+    def add(self, record: Record):
+        """Persist a new contact"""
+        raise NotImplementedError
+
+    def add_many(self, records: Iterable[Record]):
+        """Persist several new contacts"""
+        for record in records:
+            self.add(record)
+
+    def delete(self, name: str, phone: str, contact_type: str) -> bool:
+        """Remove a contact, returns False if it was not stored"""
+        raise NotImplementedError
+
+    def update(self, old_name: str, old_phone: str, old_type: str, record: Record):
+        """Replace one contact with another"""
+        self.delete(old_name, old_phone, old_type)
+        self.add(record)
+
+    def apply_batch(self, changes: List[Change]):
+        """Apply many adds, deletes and updates as one operation"""
+        for old, new in changes:
+            if old is not None:
+                self.delete(old['name'], old['phone'], old['type'])
+        self.add_many(new for _, new in changes if new is not None)
+
+    def find(self, name: str, phone: str) -> Optional[Record]:
+        """Look up a contact by name and phone (indexed backends only)"""
+        raise NotImplementedError
+
+    def changed_types(self) -> List[str]:
+        """Contact types changed by another process since the last load or call"""
+        return []
+
+    def load_type(self, contact_type: str) -> List[Record]:
+        """Every stored contact of one type"""
+        return [record for record in self.load() if record['type'] == contact_type]
+
+    def search(self, term: str = '', contact_type: Optional[str] = None) -> List[Record]:
+        """Contacts whose name contains term, optionally of one type, in name order
+        (indexed backends only)"""
+        raise NotImplementedError
+
+    def add_contact_type(self, contact_type: str):
+        """Register a user-defined type in ``types.json``, keeping any another instance added"""
+        for known in load_contact_types(self.directory) + [contact_type]:
+            if known not in self.contact_types:
+                self.contact_types.append(known)
+        save_contact_types(self.directory, self.contact_types)
+
+    def flush(self):
+        """Make every write so far durable"""
+
+    def close(self):
+        """Flush and release files or connections"""
+        self.flush()
+
+
+class ShardMap:
+    """The shard files of one category and the name range each holds.
+
+    Shard i holds the contacts whose lowercase name sorts from ``lows[i]``
+    up to, not including, ``lows[i + 1]``, so the shards in order are the
+    category in name order and contacts with equal names share a shard.
+    The first shard is always ``<type>.txt``; while the category has no
+    other, there is no ``.<type>.shards.json`` manifest, which is how
+    directories written before sharding look.
+    """
+    def __init__(self, directory: str, contact_type: str, lows: Optional[List[str]] = None,
+                 files: Optional[List[str]] = None, next_id: int = 1):
+        self.directory = directory
+        self.contact_type = contact_type
+        self.lows = lows or ['']
+        self.files = files or [f"{contact_type}.txt"]
+        # Shard files are never renamed or reused, later ones get the next id
+        self.next_id = next_id
+
+    @staticmethod
+    def manifest_path(directory: str, contact_type: str) -> str:
+        return os.path.join(directory, f".{contact_type}.shards.json")
+
+    @classmethod
+    def read(cls, directory: str, contact_type: str) -> 'ShardMap':
+        path = cls.manifest_path(directory, contact_type)
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            return cls(directory, contact_type, [low for low, _ in saved['shards']],
+                       [name for _, name in saved['shards']], saved['next_id'])
+        except FileNotFoundError:
+            return cls(directory, contact_type)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Error reading shard manifest %s, using %s.txt alone: %s", path, contact_type, e)
+            return cls(directory, contact_type)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def paths(self) -> List[str]:
+        return [os.path.join(self.directory, name) for name in self.files]
+
+    def find(self, name: str) -> int:
+        """The shard holding lowercase name"""
+        return bisect.bisect_right(self.lows, name) - 1
+
+    def new_file(self) -> str:
+        name = f"{self.contact_type}.{self.next_id}.txt"
+        self.next_id += 1
+        return name
+
+    def lines(self) -> List[str]:
+        return [json.dumps({'shards': [[low, name] for low, name in zip(self.lows, self.files)],
+                            'next_id': self.next_id})]
+
+
+class JsonLinesStorage(ContactStorage):
+    """One JSON line per contact in sorted category files.
+
+    Each category is one or more shards (see ShardMap): ``<type>.txt``,
+    then ``<type>.<n>.txt`` files holding later name ranges. A change
+    reads and rewrites only the shards its names fall in. A shard that
+    grows past ``shard_bytes`` is split into halves at name boundaries,
+    one that shrinks below a quarter of it is merged into a neighbour, so
+    a write costs about the same however large the category grows.
+
+    ``load_sorted`` parses the shard files in parallel, merges them with a
+    streaming k-way merge and leaves a binary snapshot (``.snapshot.bin``)
+    behind; while no file has changed since, later starts read the
+    snapshot instead of parsing JSON.
+
+    Several processes may share the directory:
+
+    * every change re-reads its shards under an exclusive ``fcntl``
+      lock on ``.<type>.lock`` and replaces them atomically (temp file,
+      fsync, ``os.replace``), so a crash or a second instance can neither
+      truncate a file nor lose another instance's change
+    * a change spanning several files (an update that moves a contact to
+      another type, a multi-type batch, a split or merge of shards) is a
+      transaction: all new files are written first, then a
+      ``.txn-*.json`` manifest naming them, then they are renamed into
+      place and files no longer used are removed. A manifest left by a
+      crash is rolled forward before the next read or write
+    * ``changed_types`` reports the categories another process rewrote,
+      by polling size and mtime, so only those need reloading
+
+    With a ``compression`` (zlib, gzip or lzma) the files written are
+    block-compressed with a CRC per block (see blockfile.py), keeping
+    their names. Every reader tells the formats apart by their first
+    bytes, so a directory may mix both; ``convert`` rewrites the files
+    still in the other format. A block failing its check is logged and
+    skipped on load, and any write to its file fails instead of dropping
+    the contacts in it.
+    """
+    SNAPSHOT_NAME = '.snapshot.bin'
+    TXN_PREFIX = '.txn-'
+
+    def __init__(self, directory: str = 'contacts', contact_types: Optional[List[str]] = None,
+                 workers: Optional[int] = None, shard_bytes: int = SHARD_BYTES,
+                 codec: Optional[RecordCodec] = None, compression: Optional[str] = None):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', use one of {', '.join(COMPRESSIONS)}")
+        self.directory = directory
+        self.contact_types = list(contact_types or load_contact_types(directory))
+        # Reads and writes the contact lines (see codec.py)
+        self.codec = codec or get_codec()
+        # How category files are written: None for plain JSON lines
+        self.compression = compression
+        # Processes used to parse the category files (default: one per CPU)
+        self.workers = workers
+        self.shard_bytes = shard_bytes
+        # Without fcntl this at least keeps threads of one process apart
+        self._thread_lock = threading.Lock()
+        # Stamps of each category's shard manifest and files as of our last read or write
+        self._stamps: Dict[str, Tuple] = {}
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+    def shards(self, contact_type: str) -> ShardMap:
+        return ShardMap.read(self.directory, contact_type)
+
+    # Locking and transactions
+
+    @contextmanager
+    def _locked(self, contact_types: Iterable[str]):
+        """Hold the exclusive lock of each category, taken in sorted order to avoid deadlocks"""
+        with self._thread_lock:
+            lock_files = []
+            try:
+                for contact_type in sorted(set(contact_types)):
+                    lock_file = open(os.path.join(self.directory, f".{contact_type}.lock"), 'a')
+                    lock_files.append(lock_file)
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+            finally:
+                # Closing the file releases its lock
+                for lock_file in reversed(lock_files):
+                    lock_file.close()
+
+    def _commit(self, contact_types: Iterable[str], changes: Dict[str, List[str]],
+                removes: List[str] = ()):
+        """Replace files (path -> lines) together, then delete removes; caller holds the locks"""
+        if len(changes) == 1 and not removes:
+            filename, lines = next(iter(changes.items()))
+            atomic_write_lines(filename, lines, self._compression_for(filename))
+        else:
+            renames = []
+            for filename, lines in changes.items():
+                write_lines_durably(filename + '.txn', lines, self._compression_for(filename))
+                renames.append([filename + '.txn', filename])
+            manifest = self._manifest_path(contact_types)
+            atomic_write_lines(manifest, [json.dumps({'types': sorted(set(contact_types)),
+                                                      'renames': renames, 'removes': list(removes)})])
+            # Committed: from here on a crash is rolled forward by recover()
+            self._roll_forward(manifest, renames, removes)
+        for contact_type in contact_types:
+            self._stamps[contact_type] = self._stamp(contact_type)
+
+    def _compression_for(self, filename: str) -> Optional[str]:
+        # Shard manifests are hidden files and stay plain JSON
+        return None if os.path.basename(filename).startswith('.') else self.compression
+
+    def _manifest_path(self, contact_types: Iterable[str]) -> str:
+        return os.path.join(self.directory, f"{self.TXN_PREFIX}{'+'.join(sorted(set(contact_types)))}.json")
+
+    def _roll_forward(self, manifest: str, renames: List[List[str]], removes: Iterable[str] = ()):
+        for temp, target in renames:
+            if os.path.exists(temp):
+                os.replace(temp, target)
+        for filename in removes:
+            if os.path.exists(filename):
+                os.remove(filename)
+        fsync_directory(self.directory)
+        os.remove(manifest)
+
+    def recover(self):
+        """Finish transactions a crashed process committed but did not apply"""
+        for name in os.listdir(self.directory):
+            if not (name.startswith(self.TXN_PREFIX) and name.endswith('.json')):
+                continue
+            manifest = os.path.join(self.directory, name)
+            try:
+                with open(manifest, 'r') as f:
+                    txn = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            with self._locked(txn['types']):
+                # The writer may still have been running and finished meanwhile
+                if os.path.exists(manifest):
+                    logger.warning("Rolling forward interrupted transaction %s", name)
+                    self._roll_forward(manifest, txn['renames'], txn.get('removes', []))
+
+    # Change detection
+
+    def _stamp(self, contact_type: str) -> Tuple:
+        # Every commit replaces the files it changes, so a new inode alone gives it away
+        shards = self.shards(contact_type)
+        return tuple(file_stamp(filename) for filename in
+                     [ShardMap.manifest_path(self.directory, contact_type)] + shards.paths())
+
+    def changed_types(self) -> List[str]:
+        """Categories whose files changed since our last read or write of them"""
+        changed = []
+        for contact_type in self.contact_types:
+            stamp = self._stamp(contact_type)
+            if stamp != self._stamps.get(contact_type):
+                changed.append(contact_type)
+        return changed
+
+    def load_type(self, contact_type: str) -> List[Record]:
+        # Stamp first: a write landing after it is caught by the next poll
+        self._stamps[contact_type] = self._stamp(contact_type)
+        records = []
+        # Shards hold consecutive name ranges, so one after the other they are in order
+        for filename in self.shards(contact_type).paths():
+            corrupt: List[CorruptBlockError] = []
+            for line in self._read_lines(filename, corrupt):
+                record = self.codec.decode_record(line)
+                if record is not None:
+                    records.append(record)
+            for error in corrupt:
+                logger.error("Skipped contacts: %s", error)
+        return records
+
+    def _read_lines(self, filename: str, corrupt: Optional[List[CorruptBlockError]] = None) -> List[str]:
+        """The non-blank lines of a category file; a corrupt block raises
+        CorruptBlockError unless corrupt collects it (see blockfile.iter_lines)"""
+        lines = []
+        if os.path.exists(filename):
+            try:
+                lines = [line.strip() for line in iter_lines(filename, corrupt) if line.strip()]
+            except CorruptBlockError:
+                # Rewriting the file would drop the block's contacts for good
+                raise
+            except Exception as e:
+                logger.error("Error reading %s: %s", filename, e)
+        return lines
+
+    def load(self) -> Iterator[Record]:
+        self.recover()
+        for contact_type in self.contact_types:
+            self._stamps[contact_type] = self._stamp(contact_type)
+            for filename in self.shards(contact_type).paths():
+                if not os.path.exists(filename):
+                    continue
+                corrupt: List[CorruptBlockError] = []
+                try:
+                    for line in iter_lines(filename, corrupt):
+                        if line.strip():
+                            record = self.codec.decode_record(line.strip())
+                            if record is not None:
+                                yield record
+                except Exception as e:
+                    logger.error("Error loading contacts from %s: %s", filename, e)
+                for error in corrupt:
+                    logger.error("Skipped contacts: %s", error)
+
+    def load_sorted(self) -> Iterable[Record]:
+        self.recover()
+        manifests = [ShardMap.manifest_path(self.directory, contact_type) for contact_type in self.contact_types]
+        filenames = [filename for contact_type in self.contact_types
+                     for filename in self.shards(contact_type).paths()]
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+        # Stamped before parsing, so a write racing the load invalidates the snapshot
+        stamps = source_stamps(manifests + filenames)
+        self._stamps = {contact_type: self._stamp(contact_type) for contact_type in self.contact_types}
+
+        records = read_snapshot(snapshot_path, stamps)
+        if records is not None:
+            return records
+
+        loader = CategoryFileLoader(filenames, self.workers, self.codec)
+        records = list(loader.load())
+        if not loader.errors:
+            try:
+                write_snapshot(snapshot_path, records, stamps)
+            except OSError as e:
+                logger.error("Error writing snapshot %s: %s", snapshot_path, e)
+        return records
+
+    # Writes
+
+    def add(self, record: Record):
+        self.add_many([record])
+
+    def _merge_lines(self, lines: List[str], new_contacts: List[Record]) -> List[str]:
+        """Merge new contacts into a shard's sorted lines.
+
+        The file is already sorted by name, so only the new contacts are
+        sorted and then merged with the existing lines, which are kept
+        unchanged (existing contacts stay first among equal names).
+        """
+        # Read existing lines with their sort key
+        existing = []
+        decode = self.codec.decode
+        for line in lines:
+            fields = decode(line)
+            if fields is not None:
+                existing.append((fields[0].lower(), line))
+            else:
+                # Not a contact (damaged or edited by hand): kept in place, never dropped
+                logger.warning("Keeping unreadable line in a category file: %.80s", line)
+                existing.append((existing[-1][0] if existing else '', line))
+        # Already sorted unless edited by hand, then this is one cheap pass
+        existing.sort(key=itemgetter(0))
+
+        # Sort new contacts by name (case-insensitive)
+        new_contacts.sort(key=lambda x: x['name'].lower())
+        added = [(contact['name'].lower(), self.codec.encode_record(contact))
+                 for contact in new_contacts]
+
+        return [line for _, line in heapq.merge(existing, added, key=itemgetter(0))]
+
+    def _remove_line(self, lines: List[str], name: str, phone: str) -> bool:
+        """Drop the contact (name, phone) from lines, returns whether it was there"""
+        search_name = str(name).strip()
+        search_phone = str(phone).strip()
+        decode = self.codec.decode
+        for i, line in enumerate(lines):
+            fields = decode(line)
+            if fields is None:
+                continue
+            if fields[0].strip() == search_name and str(fields[1]).strip() == search_phone:
+                del lines[i]
+                return True
+        return False
+
+    def _remove_lines(self, lines: List[str], removed: Counter) -> Tuple[List[str], List[Record]]:
+        """Drop removed (encoded line -> count) from lines, returns the kept lines and the contacts not found"""
+        kept = []
+        for line in lines:
+            if removed[line] > 0:
+                removed[line] -= 1
+            else:
+                kept.append(line)
+        missing = []
+        for line, count in removed.items():
+            for _ in range(count):
+                record = self.codec.decode_record(line)
+                if not self._remove_line(kept, record['name'], record['phone']):
+                    missing.append(record)
+        return kept, missing
+
+    @staticmethod
+    def _size(lines: List[str]) -> int:
+        return sum(map(len, lines)) + len(lines)
+
+    def _split(self, lines: List[str]) -> List[Tuple[str, List[str]]]:
+        """Cut an oversized shard's lines into pieces of about half a shard, as (lowest name, lines).
+
+        Pieces are only cut between different names, so equal names stay together.
+        """
+        names = []
+        decode = self.codec.decode
+        for line in lines:
+            fields = decode(line)
+            names.append(fields[0].lower() if fields is not None else names[-1] if names else '')
+        target = self.shard_bytes // 2
+        pieces = []
+        start = size = 0
+        for i, line in enumerate(lines):
+            if size >= target and names[i] != names[i - 1]:
+                pieces.append((names[start], lines[start:i]))
+                start, size = i, 0
+            size += len(line) + 1
+        pieces.append((names[start], lines[start:]))
+        return pieces
+
+    def _change_category(self, contact_type: str, removed: List[Record], added: List[Record],
+                         changes: Dict[str, List[str]], removes: List[str]) -> int:
+        """Remove and add contacts of one category, rewriting only the shards their names fall in.
+
+        removed are matched on their exact line first, as the codec writes
+        them, then on name and phone (delete and update do not know the
+        email, or a hand-edited file). The files to write are added
+        to changes and those to delete to removes, for one _commit;
+        returns how many of removed were found. Caller holds the lock.
+        """
+        shards = self.shards(contact_type)
+        touched: Dict[int, Tuple[Counter, List[Record]]] = {}
+        for record in removed:
+            edit = touched.setdefault(shards.find(str(record['name']).lower()), (Counter(), []))
+            edit[0][self.codec.encode_record(record)] += 1
+        for record in added:
+            touched.setdefault(shards.find(record['name'].lower()), (Counter(), []))[1].append(record)
+
+        paths = shards.paths()
+        # New lines of every shard that changed, by shard number
+        edited: Dict[int, List[str]] = {}
+        missing = []
+        for i, (gone, new) in sorted(touched.items()):
+            lines = self._read_lines(paths[i])
+            count = len(lines)
+            metrics.count('rows_scanned', count)
+            if gone:
+                lines, not_found = self._remove_lines(lines, gone)
+                missing += not_found
+            if new:
+                lines = self._merge_lines(lines, new)
+            if new or len(lines) != count:
+                edited[i] = lines
+        # Only a hand-edited file puts a name outside its shard's range
+        for i in range(len(shards)):
+            if not missing:
+                break
+            if i in touched:
+                continue
+            lines = self._read_lines(paths[i])
+            still_missing = [record for record in missing
+                             if not self._remove_line(lines, record['name'], record['phone'])]
+            if len(still_missing) < len(missing):
+                edited[i] = lines
+            missing = still_missing
+
+        self._rebalance(shards, edited, changes, removes)
+        return len(removed) - len(missing)
+
+    def _rebalance(self, shards: ShardMap, edited: Dict[int, List[str]],
+                   changes: Dict[str, List[str]], removes: List[str]):
+        """Split edited shards grown past shard_bytes, merge those shrunk below a quarter of it"""
+        # [lowest name, file, new lines or None if unchanged] of every shard
+        entries = []
+        for i, (low, name) in enumerate(zip(shards.lows, shards.files)):
+            lines = edited.get(i)
+            if lines is not None and self._size(lines) > self.shard_bytes:
+                pieces = self._split(lines)
+                entries.append([low, name, pieces[0][1]])
+                entries += [[piece_low, shards.new_file(), piece] for piece_low, piece in pieces[1:]]
+                logger.debug("Split %s into %d shards", name, len(pieces))
+            else:
+                entries.append([low, name, lines])
+
+        def size(entry) -> int:
+            if entry[2] is not None:
+                return self._size(entry[2])
+            # Shard sizes are counted uncompressed
+            return content_size(os.path.join(self.directory, entry[1]))
+
+        i = 0
+        while i < len(entries) and len(entries) > 1:
+            if entries[i][2] is None or size(entries[i]) >= self.shard_bytes // 4:
+                i += 1
+                continue
+            # Into the smaller neighbour, if the two together stay well below a split
+            neighbours = [j for j in (i - 1, i + 1) if 0 <= j < len(entries)]
+            j = min(neighbours, key=lambda j: size(entries[j]))
+            if size(entries[i]) + size(entries[j]) > self.shard_bytes // 2:
+                i += 1
+                continue
+            first, second = sorted((i, j))
+            for entry in (entries[first], entries[second]):
+                if entry[2] is None:
+                    entry[2] = self._read_lines(os.path.join(self.directory, entry[1]))
+            merged = [entries[first][0], entries[first][1], entries[first][2] + entries[second][2]]
+            removes.append(os.path.join(self.directory, entries[second][1]))
+            logger.debug("Merged %s into %s", entries[second][1], entries[first][1])
+            entries[first:second + 1] = [merged]
+            i = first
+
+        for _, name, lines in entries:
+            if lines is not None:
+                changes[os.path.join(self.directory, name)] = lines
+        lows, files = [entry[0] for entry in entries], [entry[1] for entry in entries]
+        if (lows, files) != (shards.lows, shards.files):
+            manifest = ShardMap.manifest_path(self.directory, shards.contact_type)
+            if len(files) == 1:
+                removes.append(manifest)
+            else:
+                shards.lows, shards.files = lows, files
+                changes[manifest] = shards.lines()
+
+    def _apply_changes(self, edits: Dict[str, Tuple[List[Record], List[Record]]]) -> int:
+        """Remove and add contacts of several categories (type -> (removed, added)) in one commit,
+        returns how many removed contacts were found"""
+        self.recover()
+        with self._locked(edits):
+            # Re-read under the lock: another instance may have written since our load
+            changes: Dict[str, List[str]] = {}
+            removes: List[str] = []
+            found = sum(self._change_category(contact_type, removed, added, changes, removes)
+                        for contact_type, (removed, added) in edits.items())
+            if changes or removes:
+                self._commit(edits, changes, removes)
+            return found
+
+    def convert(self) -> int:
+        """Rewrite every category file not in this storage's format (``compression``),
+        returns how many were rewritten. A corrupt block stops its category's conversion."""
+        self.recover()
+        converted = 0
+        for contact_type in self.contact_types:
+            with self._locked([contact_type]):
+                changes = {filename: self._read_lines(filename) for filename in self.shards(contact_type).paths()
+                           if os.path.exists(filename) and compression_of(filename) != self.compression}
+                if changes:
+                    self._commit([contact_type], changes)
+                    converted += len(changes)
+        return converted
+
+    def add_many(self, records: Iterable[Record]):
+        """Merge new contacts into their shards, one rewrite per shard"""
+        edits: Dict[str, Tuple[List[Record], List[Record]]] = {}
+        for record in records:
+            edits.setdefault(record['type'], ([], []))[1].append(record)
+        if edits:
+            self._apply_changes(edits)
+
+    def update(self, old_name: str, old_phone: str, old_type: str, record: Record):
+        """Delete and add in one transaction, even when the type changes"""
+        old = make_record(old_name, old_phone, '', old_type)
+        if record['type'] == old_type:
+            self._apply_changes({old_type: ([old], [record])})
+        else:
+            self._apply_changes({old_type: ([old], []), record['type']: ([], [record])})
+
+    def apply_batch(self, changes: List[Change]):
+        """Rewrite each affected shard once, all in one transaction"""
+        edits: Dict[str, Tuple[List[Record], List[Record]]] = {}
+        for old, new in changes:
+            if old is not None:
+                edits.setdefault(old['type'], ([], []))[0].append(old)
+            if new is not None:
+                edits.setdefault(new['type'], ([], []))[1].append(new)
+        if edits:
+            self._apply_changes(edits)
+
+    def delete(self, name: str, phone: str, contact_type: str) -> bool:
+        try:
+            # Read under the lock, so a change made meanwhile by another instance is kept
+            if not self._apply_changes({contact_type: ([make_record(name, phone, '', contact_type)], [])}):
+                logger.debug("Contact %s, %s not found in %s", name, phone, contact_type)
+                return False
+            logger.debug("Deleted %s from %s", name, contact_type)
+            return True
+        except Exception as e:
+            logger.error("Error deleting contact from %s: %s", contact_type, e)
+            return False
+
+
+class SqliteStorage(ContactStorage):
+    """SQLite database in WAL mode with indexes for lookups, search and type filters"""
+    indexed = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            email TEXT NOT NULL DEFAULT '',
+            type TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS contacts_name_phone ON contacts (name, phone);
+        CREATE INDEX IF NOT EXISTS contacts_lower_name ON contacts (lower(name));
+        CREATE INDEX IF NOT EXISTS contacts_type_name ON contacts (type, lower(name));
+    """
+
+    def __init__(self, path: str = os.path.join('contacts', 'contacts.db')):
+        self.path = path
+        self.directory = os.path.dirname(path) or '.'
+        os.makedirs(self.directory, exist_ok=True)
+        self.contact_types = load_contact_types(self.directory)
+        # Queries may come from a worker thread, the lock serialises them
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _record(row: Tuple[str, str, str, str]) -> Record:
+        return make_record(*row)
+
+    @staticmethod
+    def _like_pattern(term: str) -> str:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{escaped}%"
+
+    def load(self) -> Iterator[Record]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, phone, email, type FROM contacts ORDER BY lower(name)").fetchall()
+        return (self._record(row) for row in rows)
+
+    def add(self, record: Record):
+        self.add_many([record])
+
+    def add_many(self, records: Iterable[Record]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO contacts (name, phone, email, type) VALUES (?, ?, ?, ?)",
+                ((r['name'], r['phone'], r['email'], r['type']) for r in records))
+
+    def delete(self, name: str, phone: str, contact_type: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM contacts WHERE name = ? AND phone = ? AND type = ?",
+                (str(name).strip(), str(phone).strip(), contact_type))
+        return cursor.rowcount > 0
+
+    def update(self, old_name: str, old_phone: str, old_type: str, record: Record):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM contacts WHERE name = ? AND phone = ? AND type = ?",
+                (str(old_name).strip(), str(old_phone).strip(), old_type))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO contacts (name, phone, email, type) VALUES (?, ?, ?, ?)",
+                (record['name'], record['phone'], record['email'], record['type']))
+
+    def apply_batch(self, changes: List[Change]):
+        """All changes in one SQLite transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM contacts WHERE name = ? AND phone = ? AND type = ?",
+                ((str(old['name']).strip(), str(old['phone']).strip(), old['type'])
+                 for old, _ in changes if old is not None))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO contacts (name, phone, email, type) VALUES (?, ?, ?, ?)",
+                ((new['name'], new['phone'], new['email'], new['type'])
+                 for _, new in changes if new is not None))
+
+    def find(self, name: str, phone: str) -> Optional[Record]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name, phone, email, type FROM contacts WHERE name = ? AND phone = ?",
+                (str(name).strip(), str(phone).strip())).fetchone()
+        return self._record(row) if row else None
+
+    def search(self, term: str = '', contact_type: Optional[str] = None) -> List[Record]:
+        clauses = []
+        params: List[str] = []
+        if contact_type:
+            clauses.append("type = ?")
+            params.append(contact_type)
+        if term:
+            clauses.append("lower(name) LIKE ? ESCAPE '\\'")
+            params.append(self._like_pattern(term.lower()))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT name, phone, email, type FROM contacts {where} ORDER BY lower(name)",
+                params).fetchall()
+        return [self._record(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM contacts").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate(source: ContactStorage, target: ContactStorage, batch_size: int = 10000) -> int:
+    """Copy every contact from one backend into another, returns the number copied"""
+    copied = 0
+    batch = []
+    for record in source.load():
+        batch.append(make_record(record['name'], record['phone'],
+                                 record.get('email', ''), record['type']))
+        if len(batch) >= batch_size:
+            target.add_many(batch)
+            copied += len(batch)
+            batch = []
+    if batch:
+        target.add_many(batch)
+        copied += len(batch)
+    target.flush()
+    return copied
+
+
+class JournalStorage(ContactStorage):
+    """Append-only journal storage engine.
+
+    Every add, update and delete is appended as one line to
+    ``<directory>/journal.log``. Appends are fsynced in batches: after
+    ``sync_batch`` operations or ``sync_interval`` seconds, whichever comes
+    first. Once ``compact_threshold`` operations pile up the journal is
+    sealed and a background thread folds it into the sorted per-type
+    snapshot files (the same ``<type>.txt`` JSON lines ``load_contacts``
+    reads), so a write never costs more than one append.
+    """
+    JOURNAL = 'journal.log'
+    SEALED = 'journal.log.compacting'
+
+    def __init__(self, directory: str = 'contacts', contact_types: Optional[List[str]] = None,
+                 sync_interval: float = 0.05, sync_batch: int = 64,
+                 compact_threshold: int = 10000, codec: Optional[RecordCodec] = None):
+        self.directory = directory
+        self.contact_types = list(contact_types or load_contact_types(directory))
+        self.codec = codec or get_codec()
+        self.sync_interval = sync_interval
+        self.sync_batch = sync_batch
+        self.compact_threshold = compact_threshold
+
+        self._journal_path = os.path.join(directory, self.JOURNAL)
+        self._sealed_path = os.path.join(directory, self.SEALED)
+        self._lock = threading.Lock()
+        self._journal = None
+        self._pending = 0
+        self._ops_since_compact = 0
+        # (type, name, phone) of every stored contact, so delete can report misses
+        self._keys = set()
+        self._compactor: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _snapshot_path(self, contact_type: str) -> str:
+        return os.path.join(self.directory, f"{contact_type}.txt")
+
+    @staticmethod
+    def _pair(name: str, phone: str) -> Tuple[str, str]:
+        return str(name).strip(), str(phone).strip()
+
+    @classmethod
+    def _key(cls, contact_type: str, name: str, phone: str) -> Tuple[str, str, str]:
+        return (contact_type,) + cls._pair(name, phone)
+
+    # Replay
+
+    def load(self) -> Iterator[Record]:
+        """Replay snapshots and journals, returning every stored contact"""
+        os.makedirs(self.directory, exist_ok=True)
+        # Reloading: replay what this instance appended, from a settled snapshot
+        self.flush()
+        if self._compactor is not None:
+            self._compactor.join()
+        state = self._read_snapshots()
+
+        # A sealed journal left behind means a compaction did not finish.
+        # Replay is idempotent, so apply it before the active journal.
+        ops = 0
+        for path in (self._sealed_path, self._journal_path):
+            ops += self._replay(path, state)
+
+        self._keys = {(contact_type,) + key
+                      for contact_type, keyed in state.items() for key in keyed}
+
+        self._open_journal()
+        self._ops_since_compact = ops
+        if os.path.exists(self._sealed_path):
+            self._start_compaction()
+
+        return (record for keyed in state.values()
+                for records in keyed.values() for record in records)
+
+    def _read_snapshots(self, strict: bool = False) -> Dict[str, Dict[Tuple[str, str], List[Record]]]:
+        """Read every snapshot file into {type: {(name, phone): [records]}}.
+
+        Snapshots may be compressed category files; a corrupt block is
+        logged and skipped, or with strict (before rewriting them) raised.
+        """
+        state = {}
+        for contact_type in self.contact_types:
+            keyed = {}
+            filename = self._snapshot_path(contact_type)
+            corrupt: Optional[List[CorruptBlockError]] = None if strict else []
+            if os.path.exists(filename):
+                try:
+                    for line in iter_lines(filename, corrupt):
+                        if line.strip():
+                            record = self.codec.decode_record(line.strip())
+                            if record is None:
+                                continue
+                            key = self._pair(record['name'], record['phone'])
+                            keyed.setdefault(key, []).append(record)
+                except CorruptBlockError:
+                    raise
+                except Exception as e:
+                    logger.error("Error loading contacts from %s: %s", filename, e)
+            for error in corrupt or ():
+                logger.error("Skipped contacts: %s", error)
+            state[contact_type] = keyed
+        return state
+
+    @classmethod
+    def _apply(cls, state: Dict[str, Dict[Tuple[str, str], List[Record]]], entry: Dict):
+        op = entry['op']
+        if op == 'batch':
+            for change in entry['ops']:
+                cls._apply(state, change)
+            return
+        if op in ('delete', 'update'):
+            old = entry['old']
+            state.get(old['type'], {}).pop(cls._pair(old['name'], old['phone']), None)
+        if op in ('add', 'update'):
+            new = entry['new']
+            key = cls._pair(new['name'], new['phone'])
+            records = state.setdefault(new['type'], {}).setdefault(key, [])
+            # Replaying an add that already reached a snapshot must not duplicate it
+            if new not in records:
+                records.append(new)
+
+    def _replay(self, path: str, state: Dict[str, Dict[Tuple[str, str], List[Record]]]) -> int:
+        if not os.path.exists(path):
+            return 0
+        ops = 0
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Torn final append from a crash, it was never acknowledged
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._apply(state, entry)
+                ops += len(entry['ops']) if entry['op'] == 'batch' else 1
+        return ops
+
+    # Writes
+
+    def add(self, record: Record):
+        """Append an add operation"""
+        self._keys.add(self._key(record['type'], record['name'], record['phone']))
+        self._append({'op': 'add', 'new': record})
+
+    def delete(self, name: str, phone: str, contact_type: str) -> bool:
+        """Append a delete operation, returns False if the contact is unknown"""
+        key = self._key(contact_type, name, phone)
+        if key not in self._keys:
+            return False
+        self._keys.discard(key)
+        self._append({'op': 'delete', 'old': {'name': key[1], 'phone': key[2], 'type': contact_type}})
+        return True
+
+    def update(self, old_name: str, old_phone: str, old_type: str, record: Record):
+        """Append a single update operation replacing one contact with another"""
+        key = self._key(old_type, old_name, old_phone)
+        self._keys.discard(key)
+        self._keys.add(self._key(record['type'], record['name'], record['phone']))
+        self._append({'op': 'update',
+                      'old': {'name': key[1], 'phone': key[2], 'type': old_type},
+                      'new': record})
+
+    def apply_batch(self, changes: List[Change]):
+        """Append the whole batch as one line, so a crash keeps all of it or none"""
+        ops = []
+        for old, new in changes:
+            entry: Dict = {'op': 'add' if old is None else 'delete' if new is None else 'update'}
+            if old is not None:
+                key = self._key(old['type'], old['name'], old['phone'])
+                self._keys.discard(key)
+                entry['old'] = {'name': key[1], 'phone': key[2], 'type': old['type']}
+            if new is not None:
+                self._keys.add(self._key(new['type'], new['name'], new['phone']))
+                entry['new'] = new
+            ops.append(entry)
+        if ops:
+            self._append({'op': 'batch', 'ops': ops}, len(ops))
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._journal = open(self._journal_path, 'a')
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='journal-fsync', daemon=True)
+            self._flusher.start()
+
+    def _append(self, entry: Dict, ops: int = 1):
+        with self._lock:
+            if self._journal is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._open_journal()
+            line = json.dumps(entry) + '\n'
+            self._journal.write(line)
+            metrics.count('bytes_written', len(line))
+            self._pending += 1
+            self._ops_since_compact += ops
+            if self._pending >= self.sync_batch:
+                self._sync_locked()
+            if self._ops_since_compact >= self.compact_threshold:
+                self._seal_locked()
+
+    def _sync_locked(self):
+        if self._journal is not None and self._pending:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending = 0
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.sync_interval):
+            with self._lock:
+                self._sync_locked()
+
+    def flush(self):
+        """Force pending appends to disk"""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        """Flush the journal and wait for a running compaction"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            self._sync_locked()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if self._compactor is not None:
+            self._compactor.join()
+
+    # Compaction
+
+    def _seal_locked(self):
+        """Swap in a fresh journal and fold the old one into the snapshots"""
+        if os.path.exists(self._sealed_path):
+            # Previous compaction still running, keep appending
+            return
+        self._sync_locked()
+        self._journal.close()
+        os.replace(self._journal_path, self._sealed_path)
+        self._journal = open(self._journal_path, 'a')
+        self._ops_since_compact = 0
+        self._start_compaction()
+
+    def _start_compaction(self):
+        self._compactor = threading.Thread(target=self.compact, name='journal-compact', daemon=True)
+        self._compactor.start()
+
+    def compact(self):
+        """Rewrite the sorted per-type snapshots from the sealed journal"""
+        if not os.path.exists(self._sealed_path):
+            return
+        try:
+            state = self._read_snapshots(strict=True)
+            self._replay(self._sealed_path, state)
+            for contact_type, keyed in state.items():
+                records = [record for records in keyed.values() for record in records]
+                _write_snapshot(self._snapshot_path(contact_type), records, self.codec)
+            os.remove(self._sealed_path)
+        except Exception as e:
+            # The sealed journal stays in place and is replayed on next load
+            logger.error("Error compacting journal: %s", e)
@@ -0,0 +1,111 @@
+import io
+import os
+
+import pytest
+
+from blockfile import (COMPRESSIONS, BlockReader, CorruptBlockError, compression_of, content_size,
+                       iter_lines, open_category, write_blocks)
+
+LINES = [f'{{"name": "Person {i}", "phone": "{i:010d}", "email": "", "type": "friend"}}'
+         for i in range(3000)]
+PLAIN = ''.join(line + '\n' for line in LINES).encode()
+
+
+def write(path, lines=LINES, compression='zlib'):
+    with open(path, 'wb') as f:
+        write_blocks(f, lines, compression, block_bytes=4096)
+    return str(path)
+
+
+def damage(path, position, cut=False):
+    """Flip the byte at position, or with cut drop it and everything after"""
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    if cut:
+        data = data[:position]
+    else:
+        data[position] ^= 0xff
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_lines_round_trip(tmp_path, compression):
+    path = write(tmp_path / 'friend.txt', compression=compression)
+    assert compression_of(path) == compression
+    assert content_size(path) == len(PLAIN)
+    assert list(iter_lines(path)) == LINES
+    with open_category(path) as reader:
+        assert len(reader) > 1
+        assert reader.lines == len(LINES)
+
+
+def test_reader_seeks_in_plain_offsets(tmp_path):
+    path = write(tmp_path / 'friend.txt')
+    with open_category(path) as reader:
+        for start, stop in [(0, 10), (4000, 9000), (len(PLAIN) - 5, len(PLAIN) + 100)]:
+            reader.seek(start)
+            assert reader.read(stop - start) == PLAIN[start:stop]
+            assert reader.tell() == min(stop, len(PLAIN))
+        reader.seek(12345)
+        assert b''.join(reader) == PLAIN[12345:]
+
+
+def test_plain_and_empty_files(tmp_path):
+    plain = tmp_path / 'plain.txt'
+    plain.write_text('a\nb\n')
+    assert compression_of(str(plain)) is None
+    assert list(iter_lines(str(plain))) == ['a', 'b']
+    assert compression_of(str(tmp_path / 'missing.txt')) is None
+    empty = write(tmp_path / 'empty.txt', [])
+    assert list(iter_lines(empty)) == []
+    assert content_size(empty) == 0
+
+
+def test_corrupt_block_raises_or_is_skipped(tmp_path):
+    path = write(tmp_path / 'friend.txt')
+    with open(path, 'rb') as f:
+        reader = BlockReader(f, path)
+        position = reader._positions[2]
+        first = reader._first_lines[2]
+        count = reader._first_lines[3] - first
+    damage(path, position + 40)
+
+    with pytest.raises(CorruptBlockError) as raised:
+        list(iter_lines(path))
+    assert raised.value.block == 2
+    assert raised.value.first_line == first
+    assert f"lines {first + 1}-{first + count}" in str(raised.value)
+
+    corrupt = []
+    assert list(iter_lines(path, corrupt)) == LINES[:first] + LINES[first + count:]
+    assert [error.block for error in corrupt] == [2]
+
+
+def test_truncated_file_is_reported(tmp_path):
+    path = write(tmp_path / 'friend.txt')
+    with open(path, 'rb') as f:
+        reader = BlockReader(f, path)
+        position = reader._positions[3]
+        first = reader._first_lines[3]
+    damage(path, position + 100, cut=True)
+
+    with pytest.raises(CorruptBlockError, match="truncated"):
+        list(iter_lines(path))
+    corrupt = []
+    assert list(iter_lines(path, corrupt)) == LINES[:first]
+    assert corrupt[0].first_line == first
+    with open(path, 'rb') as f:
+        with pytest.raises(CorruptBlockError):
+            BlockReader(f, path).check()
+
+
+def test_damaged_index_is_rebuilt(tmp_path):
+    path = write(tmp_path / 'friend.txt')
+    damage(path, os.path.getsize(path) - 30)
+    assert list(iter_lines(path)) == LINES
+
+
+def test_unknown_compression_is_rejected():
+    with pytest.raises(ValueError):
+        write_blocks(io.BytesIO(), LINES, 'rot13')
@@ -0,0 +1,98 @@
+import pytest
+
+from bulk_io import iter_export, iter_import, parse_vcard
+from contact_service import ContactError, ContactService
+from contact_store import ContactNode
+from storage import JsonLinesStorage
+
+
+class FailingStorage(JsonLinesStorage):
+    """Saves the first batch of an import, then fails as on a full disk"""
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.batches = 0
+
+    def add_many(self, records):
+        self.batches += 1
+        if self.batches > 1:
+            raise OSError(28, "No space left on device")
+        super().add_many(records)
+
+
+def write_csv(path, count):
+    with open(path, 'w', newline='') as f:
+        f.write("name,phone,email,type\n")
+        for i in range(count):
+            f.write(f"Person {i},{5550000000 + i},,friend\n")
+
+
+def test_failed_batch_is_left_out_of_the_store(tmp_path):
+    path = str(tmp_path / 'import.csv')
+    write_csv(path, 25)
+    service = ContactService(FailingStorage(str(tmp_path / 'contacts')))
+    service.load()
+
+    imported = []
+    with pytest.raises(ContactError, match="Could not save contacts to file"):
+        for stats in iter_import(path, service, batch_size=10):
+            imported.append(stats.imported)
+
+    assert imported == [10]
+    assert len(service.store) == 10
+    assert service.store.find('Person 9', '5550000009') is not None
+    assert service.store.find('Person 10', '5550000010') is None
+    assert len(list(JsonLinesStorage(str(tmp_path / 'contacts')).load())) == 10
+    assert [operation.label for operation in service.history.undo_stack] == ['import 10 contacts']
+    service.close()
+
+
+def test_import_skips_duplicates_and_can_be_undone(tmp_path):
+    path = str(tmp_path / 'import.csv')
+    write_csv(path, 5)
+    with open(path, 'a') as f:
+        f.write("Person 1,5550000001,,friend\nNo Phone,,,friend\n")
+    service = ContactService(JsonLinesStorage(str(tmp_path / 'contacts')))
+    service.load()
+    service.add('Person 0', '5550000000', '', 'friend')
+
+    stats = list(iter_import(path, service))[-1]
+    assert (stats.read, stats.imported, stats.duplicates, stats.invalid) == (7, 4, 2, 1)
+    assert len(service.store) == 5
+
+    service.undo()
+    assert [node.name for node in service.store] == ['Person 0']
+    assert len(list(JsonLinesStorage(str(tmp_path / 'contacts')).load())) == 1
+    service.close()
+
+
+@pytest.mark.parametrize('fmt', ['vcard', 'csv', 'jsonl', 'binary'])
+def test_export_then_import_keeps_every_field(tmp_path, fmt):
+    nodes = [ContactNode('A\\b\nC', '5550000001', 'a,b@example.com', 'friend'),
+             ContactNode('Smith, John; Jr.', '5550000002', '', 'family'),
+             ContactNode('Back\\\\slash \\n not a newline', '5550000003', 'x;y@example.com', 'colleague')]
+    path = str(tmp_path / 'contacts.out')
+    list(iter_export(path, nodes, fmt=fmt))
+    service = ContactService(JsonLinesStorage(str(tmp_path / 'contacts')))
+    service.load()
+
+    stats = list(iter_import(path, service, fmt=fmt))[-1]
+    assert stats.imported == 3, stats.errors
+    assert sorted((n.name, n.phone, n.email, n.contact_type) for n in service.store) == \
+        sorted((n.name, n.phone, n.email, n.contact_type) for n in nodes)
+    service.close()
+
+
+def test_vcard_unescapes_in_one_pass():
+    lines = ["BEGIN:VCARD", "FN:a\\\\nb\\,c\\;d\\Ne", "TEL:5550000001", "END:VCARD"]
+    [(_, record)] = parse_vcard(lines)
+    assert record['name'] == 'a\\nb,c;d\ne'
+
+
+@pytest.mark.parametrize('tel, phone', [('+91 98765-43210', '9876543210'),
+                                        ('0 98765 43210', '9876543210'),
+                                        ('tel:+1-555-123-4567', '5551234567'),
+                                        ('(555) 123.4567', '5551234567'),
+                                        ('555-CALL-NOW', '555CALLNOW')])
+def test_vcard_phone_drops_formatting_and_prefixes(tel, phone):
+    [(_, record)] = parse_vcard(["BEGIN:VCARD", "FN:Ada", f"TEL;TYPE=CELL:{tel}", "END:VCARD"])
+    assert record['phone'] == phone
@@ -0,0 +1,80 @@
+import os
+import shutil
+
+import change_feed
+from change_feed import ChangeFeed
+from contact_service import ContactService
+from storage import JsonLinesStorage, make_record
+
+
+def open_service(directory):
+    service = ContactService(JsonLinesStorage(directory), feed=ChangeFeed(directory))
+    service.load()
+    return service
+
+
+def contacts(service):
+    return sorted((node.name, node.phone, node.email, node.contact_type) for node in service.store)
+
+
+def log_lines(service):
+    with open(service.feed.path) as f:
+        return sum(1 for _ in f)
+
+
+def test_close_compacts_the_log_and_pulls_still_match(tmp_path, monkeypatch):
+    monkeypatch.setattr(change_feed, 'COMPACT_MIN_ENTRIES', 50)
+    first, second = str(tmp_path / 'a'), str(tmp_path / 'b')
+    JsonLinesStorage(first).add_many(make_record(f"Person {i}", f"{5550000000 + i}", '', 'friend')
+                                     for i in range(10))
+    shutil.copytree(first, second)
+    a, b = open_service(first), open_service(second)
+    a.sync(b)
+    # b has pulled part of the edits before a compacts
+    for round_ in range(10):
+        for i in range(10):
+            a.update(f"Person {i}", f"{5550000000 + i}", f"Person {i}", f"{5550000000 + i}",
+                     f"p{i}.{round_}@example.com", 'friend')
+        if round_ == 4:
+            b.pull(a)
+    a.delete("Person 9", "5550000009")
+    seq = a.feed.seq
+    assert log_lines(a) == 101
+
+    a.close()
+    a = open_service(first)
+    # The latest entry of each contact is kept, at its seq
+    assert log_lines(a) == 10
+    assert a.feed.seq == seq
+    b.pull(a)
+    assert contacts(a) == contacts(b)
+    assert ("Person 9", "5550000009") not in {(name, phone) for name, phone, _, _ in contacts(b)}
+    # A store that never pulled still gets everything
+    third = str(tmp_path / 'c')
+    c = open_service(third)
+    c.pull(a)
+    assert contacts(c) == contacts(a)
+    for service in (a, b, c):
+        service.close()
+
+
+def test_feed_sharing_a_compacted_log_reads_it_again(tmp_path):
+    directory = str(tmp_path)
+    one, two = ChangeFeed(directory), ChangeFeed(directory)
+    records = [make_record(f"Person {i}", f"{5550000000 + i}", '', 'friend') for i in range(3)]
+    one.record((None, record) for record in records)
+    one.record((record, make_record(record['name'], record['phone'], 'x@example.com', 'family'))
+               for record in records)
+    assert two.refresh() == 6
+    one.compact()
+
+    # The other instance appends to the new log, not the replaced one
+    two.record([(None, make_record("Person 3", "5550000003", '', 'friend'))])
+    assert two.seq == 7
+    assert one.refresh() == 7
+    assert [entry.seq for entry in one.changes_since(0)] == [4, 5, 6, 7]
+    assert [entry.seq for entry in one.changes_since(5)] == [6, 7]
+    with open(os.path.join(directory, change_feed.FEED_NAME)) as f:
+        assert sum(1 for _ in f) == 4
+    one.close()
+    two.close()
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from codec import CODECS, BinaryRecords, get_codec
+
+CONTACTS = [
+    ('Ada Lovelace', '5551234567', 'ada@example.com', 'friend'),
+    ('Zoë "Z" Müller', '+44 20 7946 0958', '', 'work'),
+    ('Back\\slash\ttab', '1', 'x@y', 'family'),
+    ('日本語の名前', '0312345678', '名前@example.jp', 'other'),
+]
+
+
+def dumps(name, phone, email, contact_type):
+    return json.dumps({'name': name, 'phone': phone, 'email': email, 'type': contact_type})
+
+
+@pytest.mark.parametrize('name', CODECS)
+@pytest.mark.parametrize('fields', CONTACTS)
+def test_lines_match_json_dumps_and_round_trip(name, fields):
+    codec = get_codec(name)
+    line = codec.encode(*fields)
+    assert line == dumps(*fields)
+    assert codec.decode(line) == fields
+    assert codec.decode_record(line) == dict(zip(('name', 'phone', 'email', 'type'), fields))
+
+
+@pytest.mark.parametrize('writer', CODECS)
+@pytest.mark.parametrize('reader', CODECS)
+def test_every_codec_reads_every_other(writer, reader):
+    lines = [get_codec(writer).encode(*fields) for fields in CONTACTS]
+    assert [get_codec(reader).decode(line) for line in lines] == CONTACTS
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_other_json_shapes_are_read(name):
+    codec = get_codec(name)
+    assert codec.decode('{"type": "work", "name": "Bob", "phone": "2"}') == ('Bob', '2', '', 'work')
+    assert codec.decode('{"name":"Bob","phone":"2","email":"b@c","type":"work","extra":1}') == \
+        ('Bob', '2', 'b@c', 'work')
+
+
+@pytest.mark.parametrize('name', CODECS)
+@pytest.mark.parametrize('line', ['', 'not json', '[1, 2]', '{"name": "Bob"}',
+                                  '{"name": 5, "phone": "2", "email": "", "type": "work"}'])
+def test_lines_that_are_not_contacts_decode_to_none(name, line):
+    codec = get_codec(name)
+    assert codec.decode(line) is None
+    assert codec.decode_record(line) is None
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+
+
+def test_binary_records_round_trip():
+    records = BinaryRecords()
+    data = records.encode_many(CONTACTS)
+    decoded = list(records.decode_many(data))
+    assert [fields for _, fields in decoded] == CONTACTS
+    assert decoded[-1][0] == len(data)
+
+
+def test_binary_records_stop_at_a_partial_record():
+    records = BinaryRecords()
+    data = records.encode_many(CONTACTS)
+    whole = list(records.decode_many(data))
+    cut = whole[1][0] + 3
+    partial = list(records.decode_many(data[:cut]))
+    assert partial == whole[:2]
+    # Reading resumes from the last whole record once the rest arrives
+    assert list(records.decode_many(data, partial[-1][0])) == whole[2:]
+
+
+@pytest.mark.parametrize('fields', [
+    ('x' * 65536, '1', '', 'friend'),
+    ('Bob', '1' * 256, '', 'friend'),
+    ('Bob', '1', '', 't' * 256),
+])
+def test_binary_record_with_a_field_too_long_is_rejected(fields):
+    with pytest.raises(ValueError):
+        BinaryRecords().encode(*fields)
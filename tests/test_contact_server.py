@@ -0,0 +1,144 @@
+import asyncio
+import json
+
+import pytest
+
+from contact_server import ContactServer
+from contact_service import ContactService
+from storage import JsonLinesStorage
+
+
+async def exchange(service, request: bytes):
+    """Send one raw request to a fresh server, returns (status, JSON body) of its reply"""
+    server = ContactServer(service, port=0, workers=1)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(request)
+        await writer.drain()
+        reply = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+    finally:
+        server.close()
+    head, _, body = reply.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1.5'])
+def test_bad_content_length_is_rejected(tmp_path, length):
+    service = ContactService(JsonLinesStorage(str(tmp_path)))
+    service.load()
+    request = f"POST /contacts HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode('latin-1')
+    status, payload = asyncio.run(exchange(service, request))
+    assert status == 400
+    assert payload == {'error': "malformed Content-Length"}
+    service.close()
+
+
+def test_metrics_route_shows_query_cache_counters(tmp_path):
+    service = ContactService(JsonLinesStorage(str(tmp_path)))
+    service.load()
+    service.add('Ada Lovelace', '5551234567', '', 'friend')
+    server = ContactServer(service, workers=1)
+    for _ in range(2):
+        assert server.dispatch('GET', '/contacts?q=ada', b'')[0] == 200
+    status, payload = server.dispatch('GET', '/metrics', b'')
+    assert status == 200
+    assert payload['counters']['query_cache_hits'] >= 1
+    assert server.dispatch('POST', '/metrics', b'')[0] == 405
+    server.close()
+    service.close()
+
+
+@pytest.fixture
+def server(tmp_path):
+    service = ContactService(JsonLinesStorage(str(tmp_path)))
+    service.load()
+    service.add('Ada Lovelace', '5551234567', 'ada@example.com', 'friend')
+    service.add('Bob Stone', '5552345678', 'bob@example.com', 'family')
+    service.add('Cy Young', '5553456789', 'ada@example.com', 'family')
+    server = ContactServer(service, workers=1)
+    yield server
+    server.close()
+    service.close()
+
+
+def call(server, method, target, body=None):
+    return server.dispatch(method, target, b'' if body is None else json.dumps(body).encode())
+
+
+def names(payload):
+    return [contact['name'] for contact in payload['contacts']]
+
+
+def test_list_filters_sorts_and_pages(server):
+    status, payload = call(server, 'GET', '/contacts')
+    assert status == 200
+    assert payload['total'] == 3
+    assert names(payload) == ['Ada Lovelace', 'Bob Stone', 'Cy Young']
+    assert names(call(server, 'GET', '/contacts?q=o')[1]) == ['Ada Lovelace', 'Bob Stone', 'Cy Young']
+    assert names(call(server, 'GET', '/contacts?q=st')[1]) == ['Bob Stone']
+    assert names(call(server, 'GET', '/contacts?type=family')[1]) == ['Bob Stone', 'Cy Young']
+    assert names(call(server, 'GET', '/contacts?sort=phone&order=desc')[1]) == \
+        ['Cy Young', 'Bob Stone', 'Ada Lovelace']
+    status, payload = call(server, 'GET', '/contacts?offset=1&limit=1')
+    assert (payload['total'], payload['offset'], names(payload)) == (3, 1, ['Bob Stone'])
+    assert call(server, 'GET', '/contacts?sort=age')[0] == 400
+    assert call(server, 'GET', '/contacts?limit=ten')[0] == 400
+
+
+def test_lookups(server):
+    status, payload = call(server, 'GET', '/contacts/lookup?name=Bob+Stone&phone=5552345678')
+    assert status == 200
+    assert payload == {'name': 'Bob Stone', 'phone': '5552345678', 'email': 'bob@example.com', 'type': 'family'}
+    assert call(server, 'GET', '/contacts/lookup?name=Bob+Stone&phone=5550000000')[0] == 404
+    assert call(server, 'GET', '/contacts/lookup?name=Bob+Stone')[0] == 400
+    assert names(call(server, 'GET', '/contacts/by-phone?phone=555-234-5678')[1]) == ['Bob Stone']
+    assert sorted(names(call(server, 'GET', '/contacts/by-email?email=ada@example.com')[1])) == \
+        ['Ada Lovelace', 'Cy Young']
+    assert call(server, 'GET', '/contacts/by-phone?phone=')[0] == 400
+
+
+def test_add_update_and_delete(server):
+    dee = {'name': 'Dee Zhang', 'phone': '5554567890', 'email': '', 'type': 'college'}
+    status, payload = call(server, 'POST', '/contacts', dee)
+    assert (status, payload) == (201, dee)
+    assert call(server, 'POST', '/contacts', dee)[0] == 409
+    assert call(server, 'POST', '/contacts', dict(dee, name='', phone='5550000000'))[0] == 400
+
+    status, payload = call(server, 'PUT', '/contacts?name=Dee+Zhang&phone=5554567890', dict(dee, type='friend'))
+    assert (status, payload['type']) == (200, 'friend')
+    assert call(server, 'PUT', '/contacts?name=Nobody&phone=5550000000', dee)[0] == 404
+
+    assert call(server, 'DELETE', '/contacts?name=Dee+Zhang&phone=5554567890') == (200, {'deleted': True})
+    assert call(server, 'DELETE', '/contacts?name=Dee+Zhang&phone=5554567890')[0] == 404
+    assert call(server, 'GET', '/contacts')[1]['total'] == 3
+
+
+def test_bad_bodies_are_rejected(server):
+    assert server.dispatch('POST', '/contacts', b'{not json')[0] == 400
+    assert server.dispatch('POST', '/contacts', b'[1, 2]')[0] == 400
+    assert server.dispatch('POST', '/contacts', b'\xff')[0] == 400
+
+
+def test_types_duplicates_and_stats(server):
+    status, counts = call(server, 'GET', '/types')
+    assert status == 200
+    assert (counts['friend'], counts['family'], counts['college']) == (1, 2, 0)
+
+    status, payload = call(server, 'GET', '/duplicates')
+    assert status == 200
+    assert [(group['field'], group['value'], sorted(c['name'] for c in group['contacts']))
+            for group in payload['groups']] == [('email', 'ada@example.com', ['Ada Lovelace', 'Cy Young'])]
+    assert len(call(server, 'GET', '/duplicates?cross_type=1')[1]['groups']) == 1
+
+    assert call(server, 'GET', '/stats')[0] == 200
+
+
+@pytest.mark.parametrize('method, target, status', [
+    ('DELETE', '/types', 405),
+    ('POST', '/contacts/lookup', 405),
+    ('GET', '/nowhere', 404),
+])
+def test_unknown_routes(server, method, target, status):
+    assert call(server, method, target)[0] == status
@@ -0,0 +1,28 @@
+import pytest
+
+from blockfile import CorruptBlockError
+from contact_service import ContactError, ContactService, PagedContactService
+from storage import JsonLinesStorage
+
+
+class FailingStorage(JsonLinesStorage):
+    """Saves contacts, but every update fails as on a damaged category file"""
+    def update(self, old_name, old_phone, old_type, record):
+        raise CorruptBlockError(self.directory, 1, 10, 5, "CRC mismatch")
+
+
+@pytest.mark.parametrize('service_class', [ContactService, PagedContactService])
+def test_update_rolls_back_when_storage_fails(tmp_path, service_class):
+    service = service_class(FailingStorage(str(tmp_path)))
+    service.load()
+    service.add('Ada Lovelace', '5551234567', 'ada@example.com', 'friend')
+
+    with pytest.raises(ContactError, match="Could not save contact to file"):
+        service.update('Ada Lovelace', '5551234567', 'Ada King', '5557654321', 'ada@example.org', 'family')
+
+    assert service.store.find('Ada King', '5557654321') is None
+    old = service.store.find('Ada Lovelace', '5551234567')
+    assert (old.email, old.contact_type) == ('ada@example.com', 'friend')
+    assert len(service.store) == 1
+    assert [operation.label for operation in service.history.undo_stack] == ['add Ada Lovelace']
+    service.close()
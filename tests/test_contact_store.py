@@ -0,0 +1,27 @@
+import gc
+
+from contact_store import ContactStore
+from storage import make_record
+
+
+def records(count):
+    return [make_record(f"Person {i:04d}", f"{5550000000 + i}", '', 'friend') for i in range(count)]
+
+
+def test_bulk_load_leaves_the_collector_alone_by_default():
+    frozen = gc.get_freeze_count()
+    store = ContactStore()
+    store.bulk_load(records(100))
+    assert len(store) == 100
+    assert gc.get_freeze_count() == frozen
+    assert gc.isenabled()
+
+
+def test_bulk_load_freezes_only_when_asked():
+    store = ContactStore()
+    try:
+        store.bulk_load(records(100), freeze_gc=True)
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert [node.name for node in store][:2] == ['Person 0000', 'Person 0001']
@@ -0,0 +1,65 @@
+import os
+
+from blockfile import BlockReader, iter_lines, write_blocks
+from contact_service import PagedContactService
+from contact_store import ContactQuery
+from paged_store import PagedContactStore
+from storage import JsonLinesStorage, make_record
+
+
+def write_friends(directory, count=2000):
+    """friend.txt compressed in small blocks, so there are many to corrupt; returns its path"""
+    storage = JsonLinesStorage(directory, compression='zlib')
+    storage.add_many(make_record(f"Friend {i:05d}", f"555{i:07d}", '', 'friend') for i in range(count))
+    storage.close()
+    path = os.path.join(directory, 'friend.txt')
+    lines = list(iter_lines(path))
+    with open(path, 'wb') as f:
+        write_blocks(f, lines, 'zlib', block_bytes=4096)
+    return path
+
+
+def corrupt_block(path, block):
+    """Flip a byte inside a block's data, returns the number of lines it held"""
+    with open(path, 'rb') as f:
+        reader = BlockReader(f, path)
+        position = reader._positions[block]
+        lines = reader._first_lines[block + 1] - reader._first_lines[block]
+    with open(path, 'r+b') as f:
+        f.seek(position + 40)
+        byte = f.read(1)
+        f.seek(position + 40)
+        f.write(bytes([byte[0] ^ 0x55]))
+    return lines
+
+
+def test_lazy_open_skips_corrupt_block(tmp_path):
+    path = write_friends(str(tmp_path))
+    lost = corrupt_block(path, 2)
+    expected = [line for line in iter_lines(path, []) if line.strip()]
+
+    store = PagedContactStore(str(tmp_path), ['friend', 'family'], page_size=16)
+    store.open()
+    assert len(store) == 2000 - lost
+    names = [store[i].name for i in range(len(store))]
+    assert names == sorted(names)
+    assert len(names) == len(expected)
+    assert store.find('Friend 00000', '5550000000') is not None
+    assert len(store.query(ContactQuery('friend 01'))) == sum(1 for name in names if 'friend 01' in name.lower())
+
+    # The saved index keeps the block out of reads after a restart
+    again = PagedContactStore(str(tmp_path), ['friend', 'family'], page_size=16)
+    again.open()
+    assert [again[i].name for i in range(len(again))] == names
+
+
+def test_lazy_service_loads_with_corrupt_last_block(tmp_path):
+    path = write_friends(str(tmp_path))
+    with open(path, 'rb') as f:
+        blocks = len(BlockReader(f, path))
+    lost = corrupt_block(path, blocks - 1)
+
+    service = PagedContactService(JsonLinesStorage(str(tmp_path)))
+    service.load()
+    assert len(service.store) == 2000 - lost
+    assert service.store[len(service.store) - 1].name == f"Friend {2000 - lost - 1:05d}"
@@ -0,0 +1,41 @@
+from contact_store import ContactNode
+from search_index import NameSearchIndex
+
+
+def make_nodes(names):
+    nodes = []
+    for seq, name in enumerate(names):
+        node = ContactNode(name, f"{5550000000 + seq}", '', 'friend')
+        node.sort_key = (name.lower(), seq)
+        nodes.append(node)
+    return sorted(nodes, key=lambda node: node.sort_key)
+
+
+def test_result_on_screen_survives_later_edits():
+    nodes = make_nodes(['Ann Lee', 'Bob Stone', 'Bob Stone', 'Cara Bobbs', 'Dan Roe'])
+    index = NameSearchIndex()
+    index.build(nodes)
+    result = index.search('bob')
+    shown = [node.phone for node in result]
+    assert len(shown) == 3
+
+    # Remove a matching name entirely, and add to another one
+    index.remove_many([node for node in nodes if node.name == 'Bob Stone'])
+    extra = make_nodes(['Cara Bobbs'] * 7)[-1]
+    index.add(extra)
+
+    assert [result[i].phone for i in range(len(result))] == shown
+    assert [node.phone for node in result] == shown
+    assert [node.name for node in index.search('bob')] == ['Cara Bobbs', 'Cara Bobbs']
+
+
+def test_name_array_is_replaced_not_changed():
+    ann, bea, dan = make_nodes(['Ann Lee', 'Bea Moe', 'Dan Roe'])
+    index = NameSearchIndex()
+    index.build([ann, dan])
+    names = index.search_names('')
+    index.add(bea)
+    index.remove(ann)
+
+    assert names == ['ann lee', 'dan roe']
+    assert index.search_names('') == ['bea moe', 'dan roe']
@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from blockfile import CorruptBlockError
+from storage import JournalStorage, JsonLinesStorage, SqliteStorage, make_record
+
+BACKENDS = {
+    'jsonlines': lambda directory: JsonLinesStorage(directory),
+    'jsonlines-zlib': lambda directory: JsonLinesStorage(directory, compression='zlib'),
+    'journal': lambda directory: JournalStorage(directory, compact_threshold=4),
+    'sqlite': lambda directory: SqliteStorage(os.path.join(directory, 'contacts.db')),
+}
+
+ADA = make_record('Ada Lovelace', '5551234567', 'ada@example.com', 'friend')
+BOB = make_record('bob Stone', '5552345678', '', 'family')
+CY = make_record('Cy Young', '5553456789', 'cy@example.com', 'friend')
+DEE = make_record('Dee Zhang', '5554567890', '', 'college')
+
+
+def contents(storage):
+    return sorted((r['name'], r['phone'], r['email'], r['type']) for r in storage.load())
+
+
+@pytest.fixture(params=list(BACKENDS))
+def reopen(request, tmp_path):
+    """Open the backend on tmp_path, closing the previous instance first"""
+    opened = []
+
+    def open_storage():
+        if opened:
+            opened.pop().close()
+        storage = BACKENDS[request.param](str(tmp_path))
+        opened.append(storage)
+        list(storage.load())
+        return storage
+
+    yield open_storage
+    for storage in opened:
+        storage.close()
+
+
+def test_writes_survive_reopening(reopen):
+    storage = reopen()
+    storage.add(ADA)
+    storage.add_many([BOB, CY])
+    storage.update(CY['name'], CY['phone'], CY['type'], make_record('Cy Young', '5550000000', '', 'college'))
+    assert storage.delete(BOB['name'], BOB['phone'], BOB['type'])
+    expected = [('Ada Lovelace', '5551234567', 'ada@example.com', 'friend'),
+                ('Cy Young', '5550000000', '', 'college')]
+    assert contents(storage) == expected
+
+    storage = reopen()
+    assert contents(storage) == expected
+    storage.add(DEE)
+    storage = reopen()
+    assert len(contents(storage)) == 3
+
+
+def test_deleting_an_unknown_contact_returns_false(reopen):
+    storage = reopen()
+    storage.add(ADA)
+    assert not storage.delete('Nobody', '5550000000', 'friend')
+    assert not storage.delete(ADA['name'], ADA['phone'], 'family')
+    assert contents(reopen()) == [tuple(ADA.values())]
+
+
+def test_apply_batch_adds_updates_and_deletes(reopen):
+    storage = reopen()
+    storage.add_many([ADA, BOB])
+    moved = make_record('Bob Stone', '5552345678', 'bob@example.com', 'colleague')
+    storage.apply_batch([(None, CY), (BOB, moved), (ADA, None)])
+    expected = sorted([tuple(CY.values()), tuple(moved.values())])
+    assert contents(storage) == expected
+    assert contents(reopen()) == expected
+
+
+def test_load_sorted_and_load_type(reopen):
+    storage = reopen()
+    storage.add_many([DEE, CY, BOB, ADA])
+    storage = reopen()
+    assert [r['name'] for r in storage.load_sorted()] == ['Ada Lovelace', 'bob Stone', 'Cy Young', 'Dee Zhang']
+    assert sorted(r['name'] for r in storage.load_type('friend')) == ['Ada Lovelace', 'Cy Young']
+    assert storage.load_type('neighbour') == []
+
+
+def test_journal_is_compacted_into_snapshots(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_threshold=4)
+    list(storage.load())
+    storage.add_many([ADA, BOB, CY, DEE])
+    storage.add(make_record('Eve Adams', '5555678901', '', 'friend'))
+    storage.close()
+    assert not os.path.exists(tmp_path / JournalStorage.SEALED)
+    assert os.path.exists(tmp_path / 'friend.txt')
+
+    storage = JournalStorage(str(tmp_path))
+    assert len(list(storage.load())) == 5
+    storage.close()
+
+
+def test_sqlite_find_and_search(tmp_path):
+    storage = SqliteStorage(str(tmp_path / 'contacts.db'))
+    storage.add_many([ADA, BOB, CY, make_record('100%_Real', '5550000001', '', 'friend')])
+    assert storage.find('Ada Lovelace', '5551234567') == ADA
+    assert storage.find('Ada Lovelace', '5550000000') is None
+    assert [r['name'] for r in storage.search('o')] == ['Ada Lovelace', 'bob Stone', 'Cy Young']
+    assert [r['name'] for r in storage.search('o', 'friend')] == ['Ada Lovelace', 'Cy Young']
+    assert [r['name'] for r in storage.search('%_')] == ['100%_Real']
+    assert storage.count() == 4
+    storage.close()
+
+
+def test_writes_to_a_corrupt_category_are_refused(tmp_path):
+    storage = JsonLinesStorage(str(tmp_path), compression='zlib')
+    storage.add_many([make_record(f'Person {i}', f'555{i:07d}', '', 'friend') for i in range(20000)])
+    path = storage.shards('friend').paths()[0]
+    with open(path, 'r+b') as f:
+        f.seek(100)
+        byte = f.read(1)
+        f.seek(100)
+        f.write(bytes([byte[0] ^ 0xff]))
+    with pytest.raises(CorruptBlockError):
+        storage.add(ADA)
+    # Other categories are still writable, and the rest of the file still loads
+    storage.add(BOB)
+    assert 0 < len(storage.load_type('friend')) < 20000
+    storage.close()
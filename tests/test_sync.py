@@ -0,0 +1,93 @@
+import shutil
+
+import pytest
+
+from change_feed import ChangeFeed
+from contact_service import ContactService
+from storage import JsonLinesStorage, make_record
+
+
+def phone(i):
+    return f"{5550000000 + i}"
+
+
+def open_service(directory):
+    service = ContactService(JsonLinesStorage(directory), feed=ChangeFeed(directory))
+    service.load()
+    return service
+
+
+def records(service):
+    """The store's contacts, and what a fresh load of its files holds"""
+    stored = sorted((node.name, node.phone, node.email, node.contact_type) for node in service.store)
+    saved = sorted((r['name'], r['phone'], r['email'], r['type']) for r in JsonLinesStorage(service.storage.directory).load())
+    assert stored == saved
+    return stored
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two services on separate copies of the same contacts, synced once.
+
+    A test that reopens them puts the new ones in the list, so each is closed once, here.
+    """
+    first, second = str(tmp_path / 'a'), str(tmp_path / 'b')
+    JsonLinesStorage(first).add_many(make_record(f"Person {i}", phone(i), '', 'friend') for i in range(20))
+    shutil.copytree(first, second)
+    services = [open_service(first), open_service(second)]
+    services[0].sync(services[1])
+    yield services
+    for service in services:
+        service.close()
+
+
+@pytest.mark.parametrize('a_first', [True, False], ids=['a-pulls-first', 'b-pulls-first'])
+def test_sync_renames_deletes_and_conflicts(stores, a_first):
+    a, b = stores
+    # Renames and deletes on one side
+    a.update("Person 1", phone(1), "Person One", phone(1), 'one@example.com', 'colleague')
+    a.delete("Person 2", phone(2))
+    b.update("Person 3", phone(3), "Person Three", phone(3), '', 'family')
+    b.delete("Person 4", phone(4))
+    # Both edit the same contact, b later: the later edit wins
+    a.update("Person 5", phone(5), "Person 5", phone(5), 'a5@example.com', 'friend')
+    b.update("Person 5", phone(5), "Person 5", phone(5), 'b5@example.com', 'family')
+    # Both rename the same contact, a later
+    b.update("Person 6", phone(6), "Six B", phone(6), '', 'friend')
+    a.update("Person 6", phone(6), "Six A", phone(6), '', 'friend')
+    # One deletes what the other edits later, and the other way round
+    a.delete("Person 7", phone(7))
+    b.update("Person 7", phone(7), "Person 7", phone(7), 'b7@example.com', 'friend')
+    a.update("Person 8", phone(8), "Person 8", phone(8), 'a8@example.com', 'friend')
+    b.delete("Person 8", phone(8))
+    # The same new key added on both sides
+    a.add("Twin", phone(100), 'a@example.com', 'friend')
+    b.add("Twin", phone(100), 'b@example.com', 'family')
+
+    if a_first:
+        a.pull(b)
+        b.pull(a)
+    else:
+        b.pull(a)
+        a.pull(b)
+
+    assert records(a) == records(b)
+    contacts = {name: (email, contact_type) for name, _, email, contact_type in records(a)}
+    assert contacts["Person One"] == ('one@example.com', 'colleague')
+    assert contacts["Person Three"] == ('', 'family')
+    assert not {"Person 1", "Person 2", "Person 3", "Person 4", "Person 6", "Six B", "Person 8"} & set(contacts)
+    assert contacts["Person 5"] == ('b5@example.com', 'family')
+    assert contacts["Six A"] == ('', 'friend')
+    assert contacts["Person 7"] == ('b7@example.com', 'friend')
+    assert contacts["Twin"] == ('b@example.com', 'family')
+
+    # Nothing is left to exchange, and a restart keeps both in step
+    pulled, sent = a.sync(b)
+    assert pulled.changed == sent.changed == 0
+    for service in stores:
+        service.close()
+    stores[:] = [open_service(a.storage.directory), open_service(b.storage.directory)]
+    a, b = stores
+    assert records(a) == records(b)
+    pulled, sent = a.sync(b)
+    assert pulled.changed == sent.changed == 0
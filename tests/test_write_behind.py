@@ -0,0 +1,48 @@
+import pytest
+
+from change_feed import ChangeFeed
+from contact_service import ContactService
+from storage import JsonLinesStorage, make_record
+from write_behind import WriteBehindStorage
+
+
+class BrokenStorage(JsonLinesStorage):
+    """Every batch write fails, as on a disk that went read-only"""
+    closed = False
+
+    def apply_batch(self, changes):
+        raise OSError(30, "Read-only file system")
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_close_raises_when_queued_changes_cannot_be_saved(tmp_path):
+    backend = BrokenStorage(str(tmp_path))
+    storage = WriteBehindStorage(backend, interval=60)
+    storage.add(make_record('Ada Lovelace', '5551234567', '', 'friend'))
+    assert storage.pending == 1
+
+    with pytest.raises(OSError, match="Read-only"):
+        storage.close()
+    assert backend.closed
+    assert storage.pending == 1
+
+
+def test_service_close_still_closes_the_feed(tmp_path):
+    feed = ChangeFeed(str(tmp_path))
+    service = ContactService(WriteBehindStorage(BrokenStorage(str(tmp_path)), interval=60), feed=feed)
+    service.load()
+    service.add('Ada Lovelace', '5551234567', '', 'friend')
+
+    with pytest.raises(OSError):
+        service.close()
+    assert feed._file is None
+
+
+def test_close_writes_what_is_queued(tmp_path):
+    storage = WriteBehindStorage(JsonLinesStorage(str(tmp_path)), interval=60)
+    storage.add(make_record('Ada Lovelace', '5551234567', '', 'friend'))
+    storage.close()
+    assert [record['name'] for record in JsonLinesStorage(str(tmp_path)).load()] == ['Ada Lovelace']
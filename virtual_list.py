@@ -0,0 +1,233 @@
+import time
+from tkinter import ttk
+from typing import Optional, Callable, Dict, List, Sequence, Tuple
+
+from instrumentation import metrics
+
+
+class VirtualTreeview:
+    """Virtual list mode for a ttk.Treeview.
+
+    Only the rows in view (plus ``overscan`` rows below them) exist as
+    Treeview items. The items are a reusable pool whose values are swapped
+    as the window moves over the backing sequence, which can be anything
+    with ``len()`` and indexing, e.g. the ContactStore itself. The
+    scrollbar is driven by row position in the backing sequence, not by
+    the Treeview's own (tiny) item list.
+    """
+    def __init__(self, tree: ttk.Treeview, scrollbar: ttk.Scrollbar,
+                 row_values: Callable[[object], Tuple], overscan: int = 5,
+                 on_render: Optional[Callable[[float], None]] = None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.row_values = row_values
+        self.overscan = overscan
+        # Called with the render time in milliseconds (used for the debug frame time)
+        self.on_render = on_render
+
+        self.rows: Sequence = []
+        self.first = 0
+        self._visible = int(tree.cget('height') or 20)
+        self._iids: List[str] = []
+        self._node_by_iid: Dict[str, object] = {}
+        # Selected rows are remembered by object, so they survive scrolling
+        self._selected = set()
+
+        scrollbar.configure(command=self.yview)
+        tree.configure(yscrollcommand='')
+        tree.bind('<<TreeviewSelect>>', self._on_select)
+        tree.bind('<Configure>', self._on_configure)
+        tree.bind('<MouseWheel>', self._on_mousewheel)
+        tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        tree.bind('<Button-5>', lambda event: self.scroll(3))
+        tree.bind('<Up>', self._on_key_up)
+        tree.bind('<Down>', self._on_key_down)
+        tree.bind('<Prior>', lambda event: self._scroll_key(-self._visible))
+        tree.bind('<Next>', lambda event: self._scroll_key(self._visible))
+
+    # Backing sequence
+
+    def set_rows(self, rows: Sequence, keep_position: bool = False):
+        """Show a new backing sequence, e.g. fresh search results"""
+        self.rows = rows
+        if not keep_position:
+            self.first = 0
+            self._selected.clear()
+        self.render()
+
+    def row_inserted(self, index: int):
+        """Patch the view after rows[index] was inserted into the backing sequence"""
+        if index < self.first:
+            # Keep the same rows on screen
+            self.first += 1
+            self._update_scrollbar()
+        elif index < self.first + self._window():
+            self.render()
+        else:
+            self._update_scrollbar()
+
+    def row_deleted(self, index: int, node: object = None):
+        """Patch the view after rows[index] was removed from the backing sequence"""
+        self._selected.discard(node)
+        if index < self.first:
+            self.first -= 1
+            self._update_scrollbar()
+        elif index < self.first + self._window():
+            self.render()
+        else:
+            self._update_scrollbar()
+
+    def anchor(self) -> Optional[object]:
+        """The first row on screen, to hand to rows_replaced after a batch change"""
+        return self.rows[self.first] if self.first < len(self.rows) else None
+
+    def rows_replaced(self, anchor: Optional[object], removed: Sequence, added: Sequence,
+                      key: Callable[[object], object]):
+        """Patch the view after a batch change to a backing sequence sorted by key.
+
+        anchor is what ``anchor()`` returned before the change; the rows
+        removed or added before it shift the window so the same rows stay
+        on screen. One render however many rows changed.
+        """
+        self._selected.difference_update(removed)
+        if anchor is not None:
+            top = key(anchor)
+            self.first += (sum(1 for node in added if key(node) < top)
+                           - sum(1 for node in removed if key(node) < top))
+        self.render()
+
+    def row_changed(self, index: int):
+        """Patch the view after rows[index] was modified in place"""
+        position = index - self.first
+        if 0 <= position < len(self._iids):
+            node = self.rows[index]
+            iid = self._iids[position]
+            self._node_by_iid[iid] = node
+            self.tree.item(iid, values=self.row_values(node))
+
+    # Selection
+
+    def node(self, iid: str) -> object:
+        """Backing object currently shown by a Treeview item"""
+        return self._node_by_iid[iid]
+
+    def selection(self) -> List[object]:
+        """Selected backing objects, including ones scrolled out of view"""
+        in_view = [self._node_by_iid[iid] for iid in self.tree.selection()
+                   if iid in self._node_by_iid]
+        others = [node for node in self._selected if node not in in_view]
+        return in_view + others
+
+    def select(self, nodes: Sequence):
+        """Select backing objects, as if the user had clicked them"""
+        self._selected = set(nodes)
+        self.tree.selection_set([iid for iid in self._iids if self._node_by_iid.get(iid) in self._selected])
+
+    def _on_select(self, event):
+        in_window = {self._node_by_iid[iid] for iid in self._iids}
+        selected = {self._node_by_iid[iid] for iid in self.tree.selection()
+                    if iid in self._node_by_iid}
+        self._selected = (self._selected - in_window) | selected
+
+    # Scrolling
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= self._visible
+            self.scroll(amount)
+
+    def scroll(self, rows: int):
+        self.scroll_to(self.first + rows)
+
+    def scroll_to(self, first: int):
+        first = max(0, min(first, len(self.rows) - self._visible))
+        if first != self.first:
+            self.first = first
+            self.render()
+
+    def see(self, index: int):
+        """Scroll just enough to bring rows[index] into view"""
+        if index < self.first:
+            self.scroll_to(index)
+        elif index >= self.first + self._visible:
+            self.scroll_to(index - self._visible + 1)
+
+    def _on_mousewheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def _scroll_key(self, rows: int):
+        self.scroll(rows)
+        return 'break'
+
+    def _on_key_up(self, event):
+        focus = self.tree.focus()
+        if self.first > 0 and self._iids and focus == self._iids[0]:
+            self.scroll(-1)
+            return 'break'
+
+    def _on_key_down(self, event):
+        focus = self.tree.focus()
+        last = min(self._visible, len(self._iids)) - 1
+        if last >= 0 and focus == self._iids[last] and self.first + self._visible < len(self.rows):
+            self.scroll(1)
+            return 'break'
+
+    def _on_configure(self, event):
+        rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        # Leave room for the heading row
+        visible = max(1, (event.height - rowheight) // rowheight)
+        if visible != self._visible:
+            self._visible = visible
+            self.render()
+
+    # Rendering
+
+    def _window(self) -> int:
+        return self._visible + self.overscan
+
+    def render(self):
+        """Materialize rows[first:first + visible + overscan] into the item pool"""
+        start = time.perf_counter()
+        total = len(self.rows)
+        self.first = max(0, min(self.first, total - self._visible))
+        count = min(self._window(), total - self.first)
+
+        # Grow or shrink the pool to the number of rows on screen
+        if len(self._iids) < count:
+            metrics.count('tree_items_inserted', count - len(self._iids))
+        while len(self._iids) < count:
+            self._iids.append(self.tree.insert('', 'end', values=()))
+        while len(self._iids) > count:
+            iid = self._iids.pop()
+            self._node_by_iid.pop(iid, None)
+            self.tree.delete(iid)
+
+        selected = []
+        for position, iid in enumerate(self._iids):
+            node = self.rows[self.first + position]
+            self._node_by_iid[iid] = node
+            self.tree.item(iid, values=self.row_values(node))
+            if node in self._selected:
+                selected.append(iid)
+        self.tree.selection_set(selected)
+        metrics.count('tree_rows_rendered', len(self._iids))
+
+        self._update_scrollbar()
+        ms = (time.perf_counter() - start) * 1000
+        metrics.record('refresh', ms)
+        if self.on_render:
+            self.on_render(ms)
+
+    def _update_scrollbar(self):
+        total = len(self.rows)
+        if total <= self._visible:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.first / total, (self.first + self._visible) / total)
@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+from typing import Optional, Dict, List, Tuple, Iterable
+
+from instrumentation import metrics
+from storage import Change, ContactStorage, Record, make_record
+
+logger = logging.getLogger(__name__)
+
+# (name, phone) of a contact, stripped as ContactStore keys it
+Key = Tuple[str, str]
+
+
+class WriteBehindStorage(ContactStorage):
+    """Wraps a storage backend so writes return at once and a background
+    thread persists them.
+
+    add, update, delete and the batch calls only queue the change. The
+    queue is coalesced per contact: one added and deleted again before the
+    next write is never written, and one edited several times is written
+    once, as its last version. The writer hands everything queued to one
+    ``apply_batch`` call, which rewrites each affected category file once,
+    ``interval`` seconds after the first change was queued, as soon as
+    ``batch_size`` contacts are queued, and on flush and close.
+
+    At most ``max_pending`` contacts wait: past that, writes block until
+    the writer catches up, or raise OSError while its writes are failing.
+    A failed write stays queued and is retried every interval; ``pending``
+    and ``last_error`` tell the status bar where things stand.
+
+    The in-memory store is ahead of the backend, so ``indexed`` is False
+    and lookups go to the store. Reads that go to the backend flush first.
+    """
+    indexed = False
+
+    def __init__(self, storage: ContactStorage, interval: float = 0.5, batch_size: int = 1000,
+                 max_pending: int = 50000):
+        self.storage = storage
+        self.directory = storage.directory
+        # The backend's list, so types added through either are known to both
+        self.contact_types = storage.contact_types
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # [old, new] per contact, oldest first; see _queue
+        self._pending: Dict[Key, List[Optional[Record]]] = {}
+        self._in_flight = 0
+        self._first_queued: Optional[float] = None
+        self._closed = False
+        # Guards the queue; notified when changes are queued or written
+        self._cond = threading.Condition()
+        # Held while writing to the backend, by the writer thread or a flush
+        self._io_lock = threading.Lock()
+        self.last_error: Optional[str] = None
+        # time.time() of the last successful write
+        self.last_saved: Optional[float] = None
+        self._writer = threading.Thread(target=self._write_loop, name='write-behind', daemon=True)
+        self._writer.start()
+
+    @property
+    def pending(self) -> int:
+        """Contacts changed but not yet written, including a write in progress"""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    # Queue
+
+    @staticmethod
+    def _key(record: Record) -> Key:
+        return str(record['name']).strip(), str(record['phone']).strip()
+
+    def _queue(self, changes: Iterable[Change]):
+        """Merge changes into the queue, netting out those to the same contact; caller holds _cond"""
+        pending = self._pending
+        for old, new in changes:
+            if old is not None:
+                key = self._key(old)
+                entry = pending.get(key)
+                if entry is None:
+                    pending[key] = [old, None]
+                elif entry[0] is None:
+                    # Added since the last write: nothing to remove from the backend
+                    del pending[key]
+                else:
+                    entry[1] = None
+            if new is not None:
+                key = self._key(new)
+                entry = pending.get(key)
+                if entry is None:
+                    pending[key] = [None, new]
+                else:
+                    entry[1] = new
+
+    def _submit(self, changes: Iterable[Change]):
+        with self._cond:
+            while len(self._pending) + self._in_flight >= self.max_pending:
+                if self.last_error is not None:
+                    raise OSError(f"{len(self._pending) + self._in_flight} changes are still waiting "
+                                  f"to be saved: {self.last_error}")
+                self._cond.notify_all()
+                self._cond.wait()
+            self._queue(changes)
+            if self._first_queued is None:
+                # Starts the writer's interval
+                self._first_queued = time.monotonic()
+                self._cond.notify_all()
+            elif len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    # Writer
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if time.monotonic() - self._first_queued >= self.interval:
+            return True
+        # After a failure only the interval counts, so retries do not spin
+        return self.last_error is None and len(self._pending) >= min(self.batch_size, self.max_pending)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    wait = None if not self._pending else self._first_queued + self.interval - time.monotonic()
+                    self._cond.wait(wait if wait is None else max(wait, 0.001))
+                if self._closed:
+                    return
+            try:
+                self._write()
+            except Exception as e:
+                logger.error("Error saving %d contacts, retrying in %.1f s: %s",
+                             self.pending, self.interval, e)
+
+    def _write(self):
+        """Write everything queued in one apply_batch; on failure it stays queued and the error is raised"""
+        with self._io_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._first_queued = None
+                self._in_flight = len(pending)
+            if not pending:
+                return
+            changes = [(old, new) for old, new in pending.values()]
+            try:
+                with metrics.span('persist'):
+                    self.storage.apply_batch(changes)
+            except Exception as e:
+                with self._cond:
+                    # Back in front of whatever was queued meanwhile, retried after an interval
+                    newer, self._pending = self._pending, pending
+                    self._queue((old, new) for old, new in newer.values())
+                    self._first_queued = time.monotonic()
+                    self._in_flight = 0
+                    self.last_error = str(e)
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._in_flight = 0
+                self.last_error = None
+                self.last_saved = time.time()
+                # Wakes writes blocked on a full queue
+                self._cond.notify_all()
+            metrics.count('contacts_persisted', len(changes))
+
+    # ContactStorage
+
+    def load(self) -> Iterable[Record]:
+        self.flush()
+        return self.storage.load()
+
+    def load_sorted(self) -> Iterable[Record]:
+        self.flush()
+        return self.storage.load_sorted()
+
+    def load_type(self, contact_type: str) -> List[Record]:
+        self.flush()
+        return self.storage.load_type(contact_type)
+
+    def changed_types(self) -> List[str]:
+        # Mid-write our own change would look like another instance's: ask at the next poll
+        if not self._io_lock.acquire(blocking=False):
+            return []
+        try:
+            return self.storage.changed_types()
+        finally:
+            self._io_lock.release()
+
+    def add(self, record: Record):
+        self._submit([(None, record)])
+
+    def add_many(self, records: Iterable[Record]):
+        self._submit((None, record) for record in records)
+
+    def update(self, old_name: str, old_phone: str, old_type: str, record: Record):
+        self._submit([(make_record(old_name, old_phone, '', old_type), record)])
+
+    def delete(self, name: str, phone: str, contact_type: str) -> bool:
+        """Queue the delete; always True, the backend is only asked when it is written"""
+        self._submit([(make_record(name, phone, '', contact_type), None)])
+        return True
+
+    def apply_batch(self, changes: List[Change]):
+        self._submit(changes)
+
+    def add_contact_type(self, contact_type: str):
+        self.storage.add_contact_type(contact_type)
+
+    def flush(self):
+        """Write everything queued now and make it durable; raises if the write fails"""
+        self._write()
+        self.storage.flush()
+
+    def close(self):
+        """Stop the writer, write whatever is still queued and close the backend.
+
+        Raises, after closing the backend, if that last write fails: the
+        changes still queued are lost then, and the caller should say so.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        try:
+            self._write()
+        except Exception as e:
+            logger.error("Could not save %d contacts on close: %s", self.pending, e)
+            raise
+        finally:
+            self.storage.close()